@@ -0,0 +1,245 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from utils.block_index import BlockIndex
+from utils.chain import Chain
+from utils.env import getenv
+from utils.etherum import Address, Call, Client
+from utils.metrics import cache_lookup
+
+DEFAULT_LST_RATE_STORE = os.path.join(os.path.expanduser('~'), '.cache', 'web3-analytics', 'lst_rates.sqlite')
+
+YEAR_SECONDS = 365 * 86400
+
+# multicall3 deployment on ethereum, rates before it can not be read with aggregate3
+MULTICALL3_BLOCK = 14353601
+
+
+class LstToken:
+    """ liquid staking token and the view function returning how much eth one token (or share) is worth """
+    __slots__ = ["symbol", "address", "solidity", "params", "decimals"]
+
+    def __init__(self, symbol: str, address: Address, solidity: str, *params, decimals: int = 18):
+        self.symbol = symbol
+        self.address = address
+        self.solidity = solidity
+        self.params = params
+        self.decimals = decimals
+
+    def call(self) -> Call:
+        return Call(self.address, self.solidity, *self.params, allow_failure=True)
+
+    def __repr__(self):
+        return f"LstToken({self.symbol} {self.address})"
+
+
+ETH_LSTS = [
+    LstToken('stETH', Address('0xae7ab96520DE3A18E5e111B5EaAb095312D7fE84'),
+             'function getPooledEthByShares(uint256 _sharesAmount) view returns (uint256)', 10 ** 18),
+    LstToken('wstETH', Address('0x7f39C581F595B53c5cb19bD0b3f8dA6c935E2Ca0'),
+             'function stEthPerToken() view returns (uint256)'),
+    LstToken('rETH', Address('0xae78736Cd615f374D3085123A210448E74Fc6393'),
+             'function getExchangeRate() view returns (uint256)'),
+    LstToken('cbETH', Address('0xBe9895146f7AF43049ca1c1AE358B0541Ea49704'),
+             'function exchangeRate() view returns (uint256)'),
+    LstToken('sfrxETH', Address('0xac3E018457B222d93114458476f3E3416Abbe38F'),
+             'function pricePerShare() view returns (uint256)'),
+    LstToken('swETH', Address('0xf951E335afb289353dc249e82926178EaC7DEd78'),
+             'function swETHToETHRate() view returns (uint256)'),
+    LstToken('mETH', Address('0xe3cBd06D7dadB3F4e6557bAb7EdD924CD1489E8f'),
+             'function mETHToETH(uint256 mETHAmount) view returns (uint256)', 10 ** 18),
+]
+
+
+def exchange_rates(client: Client, tokens: Sequence[LstToken] = ETH_LSTS,
+                   block_identifier: int | str = 'latest') -> Dict[str, Optional[float]]:
+    """ eth per token of every lst, all rate functions in one multicall
+
+    :return: symbol -> rate, None when the call failed (e.g. the token was not deployed yet)
+    """
+    results = client.multicall([t.call() for t in tokens], block_identifier=block_identifier)
+    return {t.symbol: None if r is None else r / 10 ** t.decimals for t, r in zip(tokens, results)}
+
+
+def sample_blocks(client: Client, timestamps: Sequence[int]) -> Dict[int, int]:
+    """ last block at or before each unix timestamp, from the chain's BlockIndex
+
+    :return: block -> block timestamp, in timestamp order
+    """
+    index = BlockIndex.default(client.chain or Chain.ETH)
+    blocks = index.blocks_at(timestamps)
+    found = index.timestamps(blocks)
+    return {b: found[b] for b in dict.fromkeys(blocks.tolist()) if b in found}
+
+
+class LstRateStore:
+    """
+    lst exchange rates at sampled blocks, historical rates never change so every (chain, block, token) is read once
+
+    backfill reads all tokens at all uncached blocks with Client.multicall_at_blocks, one aggregate3 eth_call
+    per block sent as concurrent json-rpc batches, instead of one call per token per block
+    """
+    _default: Optional['LstRateStore'] = None
+
+    def __init__(self, path: str = DEFAULT_LST_RATE_STORE, tokens: Sequence[LstToken] = ETH_LSTS):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.tokens = list(tokens)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS lst_rates ('
+                           'chain TEXT NOT NULL, token TEXT NOT NULL, block_number INTEGER NOT NULL, '
+                           'timestamp INTEGER NOT NULL, rate REAL, '
+                           'PRIMARY KEY (chain, token, block_number))')
+        self._conn.commit()
+
+    @classmethod
+    def default(cls) -> 'LstRateStore':
+        """ process-wide store at $LST_RATE_STORE_PATH, or ~/.cache/web3-analytics/lst_rates.sqlite """
+        if cls._default is None:
+            cls._default = cls(getenv('LST_RATE_STORE_PATH', DEFAULT_LST_RATE_STORE))
+        return cls._default
+
+    def missing(self, chain: Chain, blocks: Iterable[int]) -> Dict[int, Tuple[str, ...]]:
+        """ :return: block -> symbols of the tokens without a stored rate at it, fully cached blocks left out """
+        with self._lock:
+            rows = self._conn.execute('SELECT block_number, token FROM lst_rates WHERE chain = ?',
+                                      (chain.value,)).fetchall()
+        stored: Dict[int, set] = {}
+        for block, token in rows:
+            stored.setdefault(block, set()).add(token)
+        missing = {}
+        for block in blocks:
+            symbols = tuple(t.symbol for t in self.tokens if t.symbol not in stored.get(block, ()))
+            if symbols:
+                missing[block] = symbols
+        return missing
+
+    def cached_blocks(self, chain: Chain) -> set:
+        """ blocks where the rate of every token of the store is stored """
+        with self._lock:
+            rows = self._conn.execute('SELECT DISTINCT block_number FROM lst_rates WHERE chain = ?',
+                                      (chain.value,)).fetchall()
+        blocks = [r[0] for r in rows]
+        missing = self.missing(chain, blocks)
+        return {b for b in blocks if b not in missing}
+
+    def backfill(self, client: Client, blocks: Dict[int, int], batch_size: int = 50, max_workers: int = 4) -> int:
+        """ read and store the rates of the tokens not stored yet at each block, such as every token at a new
+        block or only a token added to ETH_LSTS at blocks cached before
+
+        :param blocks: block -> block timestamp, see sample_blocks
+        :return: number of blocks read
+        """
+        chain = client.chain or Chain.ETH
+        missing = self.missing(chain, [b for b in blocks if b >= MULTICALL3_BLOCK])
+        cache_lookup('lst_rates', len(blocks) - len(missing), len(missing))
+        if not missing:
+            return 0
+        # blocks missing the same tokens share one multicall_at_blocks
+        groups: Dict[Tuple[str, ...], List[int]] = {}
+        for block in sorted(missing):
+            groups.setdefault(missing[block], []).append(block)
+        by_symbol = {t.symbol: t for t in self.tokens}
+        read = 0
+        for symbols, todo in groups.items():
+            tokens = [by_symbol[s] for s in symbols]
+            results = client.multicall_at_blocks([t.call() for t in tokens], todo, batch_size=batch_size,
+                                                 max_workers=max_workers)
+            rows = [(chain.value, t.symbol, block, blocks[block], None if r is None else r / 10 ** t.decimals)
+                    for block, values in results.items() for t, r in zip(tokens, values)]
+            with self._lock:
+                self._conn.executemany('INSERT OR REPLACE INTO lst_rates VALUES (?, ?, ?, ?, ?)', rows)
+                self._conn.commit()
+            read += len(results)
+        if read < len(missing):
+            logger.warning('{} of {} blocks failed, they are retried on the next backfill',
+                           len(missing) - read, len(missing))
+        return read
+
+    def rates(self, chain: Chain = Chain.ETH, start_time: Optional[datetime] = None,
+              end_time: Optional[datetime] = None) -> pd.DataFrame:
+        """ :return: stored rates indexed by block timestamp, one column per token symbol """
+        query = 'SELECT token, timestamp, rate FROM lst_rates WHERE chain = ?'
+        params: List = [chain.value]
+        if start_time is not None:
+            query += ' AND timestamp >= ?'
+            params.append(int(start_time.timestamp()))
+        if end_time is not None:
+            query += ' AND timestamp < ?'
+            params.append(int(end_time.timestamp()))
+        with self._lock:
+            df = pd.read_sql_query(query, self._conn, params=params)
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
+        table = df.pivot_table(index='timestamp', columns='token', values='rate', aggfunc='last')
+        return table.reindex(columns=[t.symbol for t in self.tokens if t.symbol in table.columns])
+
+
+def rate_history(client: Client, start_time: datetime, end_time: Optional[datetime] = None,
+                 step: timedelta = timedelta(days=1), store: Optional[LstRateStore] = None) -> pd.DataFrame:
+    """ lst exchange rates sampled every step between start_time and end_time, cached blocks are not read again
+
+    :return: dataframe indexed by block timestamp, one column of eth per token for each lst
+    """
+    store = store if store is not None else LstRateStore.default()
+    end_time = end_time or datetime.now()
+    seconds = int(step.total_seconds())
+    # samples on step boundaries, so later runs hit the same cached blocks
+    start = -(-int(start_time.timestamp()) // seconds) * seconds
+    timestamps = list(range(start, int(end_time.timestamp()), seconds))
+    begin = time.time()
+    blocks = sample_blocks(client, timestamps)
+    read = store.backfill(client, blocks)
+    logger.info('{} blocks sampled, {} read in {:.1f}s', len(blocks), read, time.time() - begin)
+    # cached blocks of other samplings are left out
+    table = store.rates(client.chain or Chain.ETH)
+    wanted = pd.to_datetime(sorted(blocks.values()), unit='s')
+    return table[table.index.isin(wanted)]
+
+
+def _growth(rates: pd.DataFrame, periods: int):
+    """ :return: (rate ratio over periods samples, years between the samples), both aligned to the later sample """
+    values = rates.to_numpy(dtype=float)
+    seconds = rates.index.to_numpy(dtype='datetime64[s]').astype(np.int64).astype(float)
+    ratio = np.full(values.shape, np.nan)
+    years = np.full((len(values), 1), np.nan)
+    if len(values) > periods:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio[periods:] = values[periods:] / values[:-periods]
+        years[periods:, 0] = (seconds[periods:] - seconds[:-periods]) / YEAR_SECONDS
+    return ratio, years
+
+
+def apr(rates: pd.DataFrame, periods: int = 7) -> pd.DataFrame:
+    """ annualised staking yield of every column of a rate history, vectorised
+
+    :param rates: rate_history output
+    :param periods: yield over this many samples, e.g. 7 for a 7 day apr of daily samples
+    :return: dataframe with the columns of rates, simple apr over the actual time between samples
+    """
+    ratio, years = _growth(rates, periods)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pd.DataFrame((ratio - 1.0) / years, index=rates.index, columns=rates.columns)
+
+
+def apy(rates: pd.DataFrame, periods: int = 7) -> pd.DataFrame:
+    """ compounded version of apr """
+    ratio, years = _growth(rates, periods)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pd.DataFrame(np.power(ratio, 1.0 / years) - 1.0, index=rates.index, columns=rates.columns)
+
+
+if __name__ == "__main__":
+    eth = Client.from_chain(Chain.ETH)
+    print(exchange_rates(eth))
+    history = rate_history(eth, datetime.now() - timedelta(days=365))
+    print(history.tail())
+    print(apr(history, periods=7).tail())
@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from utils.block_index import BlockIndex
+from utils.chain import Chain
+from utils.interval import interval_ms
+from utils.token_price import get_token_spot_candlesticks
+
+NATIVE_TOKENS = {
+    Chain.ETH: 'ETH',
+    Chain.ARB: 'ETH',
+    Chain.OP: 'ETH',
+    Chain.SCROLL: 'ETH',
+    Chain.BSC: 'BNB',
+    Chain.POL: 'POL',
+    Chain.AVAX: 'AVAX',
+    Chain.MANTLE: 'MNT',
+}
+
+
+def _int(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return int(value, 16)
+    return int(value)
+
+
+def _hex(value) -> str:
+    return value if isinstance(value, str) else '0x' + bytes(value).hex()
+
+
+def block_timestamps(chain: Chain, blocks: Iterable[int], batch_size: int = 100) -> Dict[int, int]:
+    """ :return: block number -> unix timestamp, blocks not in the chain's BlockIndex are fetched in batches """
+    return BlockIndex.default(chain).timestamps(blocks, batch_size=batch_size)
+
+
+def receipts_to_frame(receipts: Iterable[dict], chain: Chain = Chain.ETH,
+                      timestamps: Optional[Dict[int, int]] = None) -> pd.DataFrame:
+    """ build a columnar gas table from transaction receipts
+
+    :param receipts: web3 formatted receipts, such as Transaction.get_receipt() or Transaction.bulk()
+    :param chain: chain of the receipts, decides the native token
+    :param timestamps: optional block number -> unix timestamp, fetched from chain when missing
+    :return: dataframe with columns hash, block_number, timestamp, from, to, contract,
+             gas_used, effective_gas_price, l1_fee, fee_wei, native_fee
+    """
+    receipts = [r for r in receipts if r is not None]
+    gas_used = [_int(r['gasUsed']) for r in receipts]
+    gas_price = [_int(r.get('effectiveGasPrice', r.get('gasPrice'))) for r in receipts]
+    l1_fee = [_int(r.get('l1Fee')) for r in receipts]
+    # wei amounts pass 2 ** 53 quickly, fee_wei is summed in python ints and only native_fee is a float
+    fee_wei = [g * p + l for g, p, l in zip(gas_used, gas_price, l1_fee)]
+    df = pd.DataFrame({
+        'hash': [_hex(r['transactionHash']) for r in receipts],
+        'block_number': np.array([_int(r['blockNumber']) for r in receipts], dtype=np.int64),
+        'from': [str(r['from']).lower() for r in receipts],
+        'to': [str(r['to']).lower() if r.get('to') else None for r in receipts],
+        'contract': [str(r.get('to') or r.get('contractAddress')).lower() for r in receipts],
+        'gas_used': np.array(gas_used, dtype=np.int64),
+        'effective_gas_price': np.array(gas_price, dtype=object),
+        'l1_fee': np.array(l1_fee, dtype=object),
+        'fee_wei': np.array(fee_wei, dtype=object),
+        'native_fee': np.array([f / 10 ** 18 for f in fee_wei], dtype=np.float64),
+    })
+    if timestamps is None:
+        timestamps = block_timestamps(chain, df['block_number'].unique()) if len(df) else {}
+    df['timestamp'] = pd.to_datetime(df['block_number'].map(timestamps), unit='s')
+    return df
+
+
+def native_price_history(symbol: str, start_time: datetime, end_time: datetime,
+                         interval: str = '1h', page_size: int = 100) -> pd.DataFrame:
+    """ close prices of symbol between start_time and end_time, fetched page by page
+
+    :param page_size: candles per request, 100 works for every cex in utils.token_price
+    :return: dataframe with columns timestamp, price sorted by timestamp
+    """
+    interval_delta = timedelta(milliseconds=interval_ms(interval))
+    step = interval_delta * page_size
+    frames = []
+    cursor = start_time
+    while cursor <= end_time:
+        window_end = min(cursor + step, end_time + interval_delta)
+        df = get_token_spot_candlesticks(symbol, interval=interval, start_time=cursor, end_time=window_end,
+                                         limit=page_size)
+        if df is not None and len(df):
+            frames.append(df.loc[:, ['timestamp', 'close']])
+        cursor = window_end
+    if not frames:
+        return pd.DataFrame(columns=['timestamp', 'price'])
+    prices = pd.concat(frames).rename(columns={'close': 'price'})
+    prices['price'] = prices['price'].astype(float)
+    return prices.drop_duplicates('timestamp').sort_values('timestamp').reset_index(drop=True)
+
+
+def add_usd_fee(df: pd.DataFrame, chain: Chain = Chain.ETH, prices: Optional[pd.DataFrame] = None,
+                interval: str = '1h') -> pd.DataFrame:
+    """ join native token prices by timestamp (as-of, backward) and add price and usd_fee columns
+
+    :param df: output of receipts_to_frame
+    :param prices: optional dataframe with columns timestamp, price; fetched from cex candles when missing
+    """
+    if len(df) == 0:
+        return df.assign(price=pd.Series(dtype=float), usd_fee=pd.Series(dtype=float))
+    if prices is None:
+        symbol = NATIVE_TOKENS[chain]
+        start = df['timestamp'].min().to_pydatetime() - timedelta(milliseconds=interval_ms(interval))
+        end = df['timestamp'].max().to_pydatetime()
+        logger.info('loading {} {} prices from {} to {}', symbol, interval, start, end)
+        prices = native_price_history(symbol, start, end, interval=interval)
+    if df['timestamp'].isna().any():
+        logger.warning('{} transactions without block timestamp are dropped', int(df['timestamp'].isna().sum()))
+        df = df[df['timestamp'].notna()]
+    prices = prices.loc[:, ['timestamp', 'price']].sort_values('timestamp')
+    prices['timestamp'] = prices['timestamp'].astype(df['timestamp'].dtype)
+    df = pd.merge_asof(df.drop(columns=['price', 'usd_fee'], errors='ignore').sort_values('timestamp'),
+                       prices, on='timestamp', direction='backward')
+    df['usd_fee'] = df['native_fee'] * df['price']
+    return df
+
+
+def gas_spend(df: pd.DataFrame, by: Sequence[str] = ('from',), freq: Optional[str] = None) -> pd.DataFrame:
+    """ aggregate gas spend
+
+    :param df: output of receipts_to_frame or add_usd_fee
+    :param by: group columns, such as ['from'], ['contract'], ['from', 'contract']
+    :param freq: optional time bucket added to the group keys, such as '1D' or '1h'
+    :return: dataframe of txs, gas_used, native_fee (and usd_fee) per group, sorted by spend
+    """
+    keys: List = list(by)
+    if freq is not None:
+        keys.append(df['timestamp'].dt.floor(freq).rename('period'))
+    agg = {'txs': ('hash', 'size'), 'gas_used': ('gas_used', 'sum'), 'native_fee': ('native_fee', 'sum')}
+    if 'usd_fee' in df.columns:
+        agg['usd_fee'] = ('usd_fee', 'sum')
+    result = df.groupby(keys, sort=False).agg(**agg).reset_index()
+    return result.sort_values('usd_fee' if 'usd_fee' in result.columns else 'native_fee',
+                              ascending=False).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    from analytics.transaction import Transaction
+
+    txs = Transaction.bulk(['0x07a582bdfca3c12da00572252e86b4b343201f37b3c9741d9ac99f195e8d3d1d'])
+    gas_df = add_usd_fee(receipts_to_frame([t.get_receipt() for t in txs]))
+    print(gas_df)
+    print(gas_spend(gas_df, by=['from'], freq='1D'))
@@ -1,45 +1,107 @@
 import math
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
 import pandas as pd
-from loguru import logger
 
-from utils.token_price import get_token_price
-from utils.token_price import get_token_spot_candlesticks
+from utils.candle_store import CandleStore
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+
+
+def scale_k(relative_price: float) -> int:
+    """ power of ten that brings a relative price to [1, 10) """
+    return -1 * math.floor(math.log10(relative_price))
+
+
+def align_legs(base_df: pd.DataFrame, quote_df: pd.DataFrame,
+               scale: Optional[int] = None) -> Tuple[pd.DataFrame, int]:
+    """ inner join of two unified candle dataframes on timestamp, as sorted-index intersection
+
+    :param scale: power of ten applied to the pair prices, default scale_k of the last aligned close
+    :return: (pair dataframe indexed by timestamp with open, high, low, close, scale)
+    """
+    base_ts = base_df['timestamp'].to_numpy(dtype='datetime64[ns]')
+    quote_ts = quote_df['timestamp'].to_numpy(dtype='datetime64[ns]')
+    ts, base_idx, quote_idx = np.intersect1d(base_ts, quote_ts, assume_unique=True, return_indices=True)
+    ratios = {col: base_df[col].to_numpy(dtype=float)[base_idx] / quote_df[col].to_numpy(dtype=float)[quote_idx]
+              for col in PRICE_COLUMNS}
+    if scale is None:
+        scale = scale_k(ratios['close'][-1]) if len(ts) else 0
+    factor = pow(10.0, scale)
+    pair_df = pd.DataFrame({col: ratios[col] * factor for col in PRICE_COLUMNS},
+                           index=pd.DatetimeIndex(ts, name='timestamp'))
+    return pair_df, scale
 
 
 class Pair(object):
-    def __init__(self, base_token: str, quote_token: str = 'BTC'):
+    def __init__(self, base_token: str, quote_token: str = 'BTC', store: Optional[CandleStore] = None):
         self.base_token = base_token.upper()
         self.quote_token = quote_token.upper()
+        self.store = store if store is not None else CandleStore.default()
+
+    def legs(self, interval: str = '1d', limit: Optional[int] = None, start_time: Optional[datetime] = None,
+             end_time: Optional[datetime] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """ base and quote candles from the candle store, both legs are loaded concurrently """
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            base, quote = pool.map(lambda token: self.store.candles(token, interval, limit=limit,
+                                                                    start_time=start_time, end_time=end_time),
+                                   [self.base_token, self.quote_token])
+        return base, quote
 
     @property
     def scale_k(self):
-        logger.info("test")
-        relative_price = get_token_price(self.base_token) / get_token_price(self.quote_token)
-        return -1 * math.floor(math.log10(relative_price))
+        """ scale_k of the last daily close of the pair """
+        base_df, quote_df = self.legs('1d', limit=7)
+        return align_legs(base_df, quote_df)[1]
 
-    def candlesticks(self, interval: str = '1d', limit: int = 200) -> pd.DataFrame:
+    def candlesticks(self, interval: str = '1d', limit: Optional[int] = None,
+                     start_time: Optional[datetime] = None, end_time: Optional[datetime] = None) -> pd.DataFrame:
         """
-            :param interval: [1m/3m/5m/15m/30m/1h/2h/4h]
-            :param limit: at most 200
-            :return: dataframe of historical pair price
+            :param interval: any spelling of utils.interval, such as 1m/5m/15m/1h/4h/1d
+            :param limit: only the last limit candles of each leg
+            :return: dataframe of historical pair price, indexed by timestamp, scaled by scale_k of the last close
         """
-        limit = 200 if limit > 200 or limit <= 0 else limit
-        scale_k = self.scale_k
-        base_df = get_token_spot_candlesticks(self.base_token, interval=interval, limit=limit)
-        quote_df = get_token_spot_candlesticks(self.quote_token, interval=interval, limit=limit)
+        base_df, quote_df = self.legs(interval, limit=limit, start_time=start_time, end_time=end_time)
+        return align_legs(base_df, quote_df)[0]
+
+
+def cross_candlesticks(tokens: Iterable[str], interval: str = '1d', limit: Optional[int] = None,
+                       start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                       store: Optional[CandleStore] = None,
+                       max_workers: int = 8) -> Dict[Tuple[str, str], pd.DataFrame]:
+    """ candlesticks of every ordered pair of tokens, each token's candles are loaded once
+
+    :return: (base, quote) -> dataframe as Pair(base, quote).candlesticks
+    """
+    tokens = list(dict.fromkeys(t.upper() for t in tokens))
+    store = store if store is not None else CandleStore.default()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        frames = dict(zip(tokens, pool.map(
+            lambda token: store.candles(token, interval, limit=limit, start_time=start_time, end_time=end_time),
+            tokens)))
+    return {(base, quote): align_legs(frames[base], frames[quote])[0]
+            for base in tokens for quote in tokens if base != quote}
 
-        for col in ['open', 'high', 'low', 'close']:
-            base_df[col] = base_df[col].astype(float)
-            quote_df[col] = quote_df[col].astype(float)
 
-        pair_df = pd.merge(base_df, quote_df, on='timestamp', how='inner')
-        for col in ['open', 'high', 'low', 'close']:
-            pair_df[col] = pair_df[col + '_x'] / pair_df[col + '_y'] * pow(10, scale_k)
-        pair_df.set_index('timestamp', inplace=True)
-        pair_df = pair_df.loc[:, ['open', 'high', 'low', 'close']]
-        return pair_df.sort_values(by='timestamp')
+def cross_matrix(tokens: Iterable[str], interval: str = '1d', limit: Optional[int] = None,
+                 store: Optional[CandleStore] = None, max_workers: int = 8) -> pd.DataFrame:
+    """ N x N matrix of the latest close of base (row) in quote (column), unscaled,
+    each token's candles are loaded once and aligned on their common timestamps """
+    tokens = list(dict.fromkeys(t.upper() for t in tokens))
+    store = store if store is not None else CandleStore.default()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        frames = list(pool.map(lambda token: store.candles(token, interval, limit=limit), tokens))
+    closes = pd.concat([f.set_index('timestamp')['close'] for f in frames], axis=1, keys=tokens, join='inner')
+    if len(closes) == 0:
+        return pd.DataFrame(np.nan, index=tokens, columns=tokens)
+    last = closes.iloc[-1].to_numpy()
+    return pd.DataFrame(last[:, None] / last[None, :], index=tokens, columns=tokens)
 
 
 if __name__ == "__main__":
     df = Pair('ETH', 'BTC').candlesticks(interval='1d')
     print(df)
+    print(cross_matrix(['BTC', 'ETH', 'SOL', 'BNB'], interval='1d', limit=30))
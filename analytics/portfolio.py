@@ -1,6 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Optional, Sequence
+
+import numpy as np
 import pandas as pd
 from loguru import logger
 
+from analytics.risk import close_matrix
+from utils.candle_store import CandleStore
+from utils.interval import INTERVAL_MS, normalize_interval
 from utils.token_price import get_token_price
 
 
@@ -11,18 +19,24 @@ def parce_df_address_group(address: str):
         return address
 
 
-def parce_df_token_price(df: pd.DataFrame):
+def parce_df_token_price(df: pd.DataFrame, prices: Optional[Dict[str, float]] = None):
+    """ :param prices: token -> price already fetched, other tokens are priced with get_token_price """
     for index, row in df.iterrows():
-        token_price = get_token_price(row['token']) if row['token'].lower() != 'usd' else 1
+        if row['token'].lower() == 'usd':
+            token_price = 1
+        elif prices is not None and prices.get(row['token']) is not None:
+            token_price = prices[row['token']]
+        else:
+            token_price = get_token_price(row['token'])
         df.at[index, 'price'] = float(token_price)
         df.at[index, 'value'] = float(token_price) * float(row['amount'])
     return df
 
 
-def portfolio_token_analysis(balance):
+def portfolio_token_analysis(balance, prices: Optional[Dict[str, float]] = None):
     df = pd.DataFrame(balance, columns=['token', 'address', 'amount'])
     df = df.groupby('token')['amount'].sum().reset_index()
-    df = parce_df_token_price(df)
+    df = parce_df_token_price(df, prices)
     total_value = df['value'].sum()
     logger.info(f'total_value is {total_value}')
     df['pct'] = df['value'] / total_value
@@ -40,3 +54,155 @@ def portfolio_address_analysis(balance):
     df['pct'] = df['value'] / total_value
     df = df.sort_values('pct', ascending=False)
     return df
+
+
+# historical valuation
+
+# priced at 1 usd without candles
+USD_TOKENS = {'USD', 'USDT', 'USDC', 'DAI', 'BUSD', 'FDUSD'}
+
+
+def holdings_from_ledger(ledger: pd.DataFrame, symbols: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """ holding changes from a transfer ledger, all chains and addresses are summed per token symbol
+
+    :param ledger: TransferIndexer.ledger() output, only timestamp, token and amount are used
+    :param symbols: token contract -> symbol, default the token column is already a symbol,
+                    transfers of unmapped contracts are dropped
+    :return: dataframe with columns timestamp, token, amount (signed change)
+    """
+    df = ledger.loc[:, ['timestamp', 'token', 'amount']]
+    if symbols is not None:
+        mapping = {k.lower(): v.upper() for k, v in symbols.items()}
+        df = df.assign(token=df['token'].str.lower().map(mapping))
+        dropped = df['token'].isna()
+        if dropped.any():
+            logger.warning('{} transfers of tokens without symbol are not valued', int(dropped.sum()))
+            df = df[~dropped]
+    return df.assign(token=df['token'].str.upper()).reset_index(drop=True)
+
+
+def holdings_from_snapshots(snapshots: pd.DataFrame) -> pd.DataFrame:
+    """ holding changes from position snapshots
+
+    :param snapshots: dataframe with columns timestamp, token, amount (position held from timestamp on)
+    :return: dataframe with columns timestamp, token, amount (signed change)
+    """
+    df = snapshots.loc[:, ['timestamp', 'token', 'amount']].assign(token=lambda x: x['token'].str.upper())
+    df = df.groupby(['token', 'timestamp'], as_index=False)['amount'].sum().sort_values(['token', 'timestamp'])
+    df['amount'] = df.groupby('token')['amount'].diff().fillna(df['amount'])
+    return df.reset_index(drop=True)
+
+
+class PortfolioHistory:
+    """
+    portfolio value, pnl, drawdown and per-token contribution over a time grid
+
+    holding changes and close prices are laid out as (time x token) arrays once, holdings and prices are joined
+    as of every grid timestamp with searchsorted, so the whole history is valued in one vectorised pass
+
+    the grid is the candle close times, a holding change counts from the first close at or after it.
+    pnl only comes from price moves, transfers in and out are flows, so value(t) - value(t-1) = pnl + flow.
+    nav compounds the per-bar return pnl / previous value, drawdown is measured on nav
+    """
+
+    def __init__(self, changes: pd.DataFrame, timestamps: pd.DatetimeIndex, tokens: Sequence[str],
+                 closes: np.ndarray):
+        """
+        :param changes: dataframe with columns timestamp, token, amount, see holdings_from_ledger
+        :param timestamps: grid, sorted
+        :param tokens: columns of closes
+        :param closes: (time x token) close prices as of each grid timestamp, nan before a token has a price
+        """
+        self.timestamps = pd.DatetimeIndex(timestamps)
+        self.tokens = list(tokens)
+        column = {t: i for i, t in enumerate(self.tokens)}
+        changes = changes[changes['token'].isin(column)]
+        n_times, n_tokens = len(self.timestamps), len(self.tokens)
+
+        grid = self.timestamps.to_numpy(dtype='datetime64[ns]')
+        rows = np.searchsorted(grid, changes['timestamp'].to_numpy(dtype='datetime64[ns]'), side='left')
+        cols = changes['token'].map(column).to_numpy(dtype=np.int64)
+        # changes after the last grid timestamp land in the extra row and are not valued yet
+        delta = np.zeros((n_times + 1, n_tokens))
+        np.add.at(delta, (rows, cols), changes['amount'].to_numpy(dtype=float))
+        self.changes = delta[:n_times]
+        self.quantities = np.cumsum(self.changes, axis=0)
+
+        self.prices = np.asarray(closes, dtype=np.float64)
+        unpriced = np.isnan(self.prices) & (self.quantities != 0)
+        if unpriced.any():
+            missing = [self.tokens[i] for i in np.flatnonzero(unpriced.any(axis=0))]
+            logger.warning('no price for held tokens {}, valued at 0 until priced', missing)
+        prices = np.nan_to_num(self.prices)
+
+        self.values = self.quantities * prices
+        self.flows = self.changes * prices
+        self.token_pnl = np.zeros_like(self.values)
+        self.token_pnl[1:] = self.quantities[:-1] * np.diff(prices, axis=0)
+        # a token getting its first price is not a gain
+        self.token_pnl[1:][np.isnan(self.prices[:-1])] = 0.0
+
+    @classmethod
+    def load(cls, changes: pd.DataFrame, interval: str = '1d', start_time: Optional[datetime] = None,
+             end_time: Optional[datetime] = None, store: Optional[CandleStore] = None) -> 'PortfolioHistory':
+        """ value holding changes on closes from the candle store
+
+        :param start_time: first grid timestamp, default the first holding change
+        """
+        interval = normalize_interval(interval)
+        step = pd.Timedelta(milliseconds=INTERVAL_MS[interval])
+        first = pd.Timestamp(changes['timestamp'].min())
+        start_time = start_time or (first - step).to_pydatetime()
+        tokens = sorted(set(changes['token']))
+        priced = [t for t in tokens if t not in USD_TOKENS]
+        store = store if store is not None else CandleStore.default()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            frames = list(pool.map(lambda token: store.candles(token, interval, start_time=start_time,
+                                                               end_time=end_time), priced))
+        frames = {t: f for t, f in zip(priced, frames) if len(f)}
+        if frames:
+            open_times, columns, matrix = close_matrix(frames)
+        else:
+            open_times, columns, matrix = pd.DatetimeIndex([]), [], np.empty((0, 0))
+        closes = np.full((len(open_times), len(tokens)), np.nan)
+        for i, token in enumerate(tokens):
+            if token in USD_TOKENS:
+                closes[:, i] = 1.0
+            elif token in frames:
+                closes[:, i] = matrix[:, columns.index(token)]
+        return cls(changes, open_times + step, tokens, closes)
+
+    @property
+    def value(self) -> np.ndarray:
+        return self.values.sum(axis=1)
+
+    @property
+    def pnl(self) -> np.ndarray:
+        return self.token_pnl.sum(axis=1)
+
+    def frame(self) -> pd.DataFrame:
+        """ :return: dataframe indexed by timestamp with value, flow, pnl, cum_pnl, return, nav, drawdown """
+        value, pnl = self.value, self.pnl
+        previous = np.r_[0.0, value[:-1]]
+        returns = np.divide(pnl, previous, out=np.zeros_like(pnl), where=previous > 0)
+        nav = np.cumprod(1.0 + returns)
+        drawdown = nav / np.maximum.accumulate(nav) - 1.0 if len(nav) else nav
+        return pd.DataFrame({'value': value, 'flow': self.flows.sum(axis=1), 'pnl': pnl,
+                             'cum_pnl': np.cumsum(pnl), 'return': returns, 'nav': nav, 'drawdown': drawdown},
+                            index=pd.DatetimeIndex(self.timestamps, name='timestamp'))
+
+    def contribution(self) -> pd.DataFrame:
+        """ :return: cumulative pnl of each token, indexed by timestamp """
+        return pd.DataFrame(np.cumsum(self.token_pnl, axis=0), columns=self.tokens,
+                            index=pd.DatetimeIndex(self.timestamps, name='timestamp'))
+
+    def summary(self) -> pd.DataFrame:
+        """ :return: last quantity, price, value and total pnl per token, pct is the share of total pnl """
+        if len(self.timestamps) == 0:
+            return pd.DataFrame(columns=['token', 'amount', 'price', 'value', 'pnl', 'pct'])
+        pnl = self.token_pnl.sum(axis=0)
+        total = pnl.sum()
+        df = pd.DataFrame({'token': self.tokens, 'amount': self.quantities[-1], 'price': self.prices[-1],
+                           'value': self.values[-1], 'pnl': pnl,
+                           'pct': pnl / total if total else np.nan})
+        return df.sort_values('value', ascending=False).reset_index(drop=True)
@@ -1,44 +1,109 @@
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
 from web3 import Web3
 from loguru import logger
 
+from utils.block_index import BlockIndex
 from utils.chain import Chain
+from utils.log_decoder import EventRegistry, default_registry
+from utils.receipt_store import ReceiptStore, format_receipt
+from utils.rpc import batch_call
+from utils.rpc_provider import web3_for
+
+# receipts older than this many blocks are treated as finalised and persisted
+FINALITY_CONFIRMATIONS = 64
+
+
+@lru_cache(maxsize=None)
+def chain_web3(chain: Chain) -> Web3:
+    """ one shared Web3 per chain """
+    return web3_for(chain)
 
 
 class Transaction(object):
-    def __init__(self, transaction_hash: str, chain: Chain = Chain('eth')):
+    def __init__(self, transaction_hash: str, chain: Chain = Chain('eth'),
+                 store: Optional[ReceiptStore] = None, receipt: Optional[dict] = None):
         self.transaction_hash = transaction_hash
         self.chain = chain
-        self.web3 = Web3(Web3.HTTPProvider(chain.url))
-    
+        self.web3 = chain_web3(chain)
+        self.store = store if store is not None else ReceiptStore.default()
+        self._receipt = receipt
+
+    @classmethod
+    def bulk(cls, hashes: Iterable[str], chain: Chain = Chain('eth'), store: Optional[ReceiptStore] = None,
+             batch_size: int = 100, max_workers: int = 4) -> List['Transaction']:
+        """ load many transactions with receipts
+
+        receipts are read from the receipt store first, the rest are fetched with json-rpc batch requests,
+        and finalised ones are written back to the store
+
+        :param hashes: transaction hashes
+        :param chain: chain of all transactions
+        :param store: receipt store, default ReceiptStore.default()
+        :param batch_size: receipts per json-rpc batch
+        :param max_workers: concurrent batch requests
+        :return: list of Transaction with receipt loaded, in the same order as hashes
+        """
+        hashes = list(hashes)
+        store = store if store is not None else ReceiptStore.default()
+        receipts = store.get_many(chain, hashes)
+        missing = list(dict.fromkeys(h.lower() for h in hashes if h.lower() not in receipts))
+        if missing:
+            logger.info('fetching {} receipts on {}, {} from store', len(missing), chain.value, len(receipts))
+            calls = [('eth_blockNumber', [])] + [('eth_getTransactionReceipt', [h]) for h in missing]
+            results = batch_call(chain, calls, batch_size=batch_size, max_workers=max_workers)
+            latest = int(results[0], 16) if results[0] else 0
+            finalised = []
+            for h, raw in zip(missing, results[1:]):
+                if raw is None:
+                    continue
+                receipts[h] = format_receipt(raw)
+                if int(raw['blockNumber'], 16) <= latest - FINALITY_CONFIRMATIONS:
+                    finalised.append(raw)
+            if finalised:
+                store.put_many(chain, finalised)
+        return [cls(h, chain, store=store, receipt=receipts.get(h.lower())) for h in hashes]
+
     def get_receipt(self):
-        if not self.web3.is_connected():
-            raise ConnectionError("Unable to connect to the Web3 provider.")
+        if self._receipt is not None:
+            return self._receipt
+        receipt = self.store.get(self.chain, self.transaction_hash)
+        if receipt is not None:
+            self._receipt = receipt
+            return receipt
         try:
             # Fetch transaction receipt to get gasUsed and logs
             receipt: dict = self.web3.eth.get_transaction_receipt(self.transaction_hash)
-            return receipt
         except Exception as e:
-            print(f"Error fetching transaction data: {e}")
+            logger.error(f"Error fetching transaction data: {e}")
             return None
-        
+        self._receipt = receipt
+        # the head cached by the block index is at most HEAD_TTL seconds old, that only delays persisting
+        if receipt['blockNumber'] <= BlockIndex.default(self.chain).head()[0] - FINALITY_CONFIRMATIONS:
+            self.store.put_many(self.chain, [receipt])
+        return receipt
 
     @property
-    def eth_gas_fee(self):
+    def gas_fee_wei(self) -> int:
         """
-        Calculate gas fee in wei (gasUsed * effectiveGasPrice)
+        Gas fee in wei (gasUsed * effectiveGasPrice, plus l1Fee on rollups)
         """
         receipt = self.get_receipt()
         gas_used = receipt['gasUsed']
         gas_price = receipt.get('effectiveGasPrice', receipt.get('gasPrice'))
-        gas_fee_wei = gas_used * gas_price
-        
-        # Convert gas fee to Ether for easier reading
-        if self.chain.value == "eth":
-            gas_fee_eth = self.web3.from_wei(gas_fee_wei, 'ether')
-            return gas_fee_eth
-        else:
-            return gas_fee_wei
-    
+        # web3 does not format the rollup fields, l1Fee stays a hex string
+        l1_fee = receipt.get('l1Fee') or 0
+        if isinstance(l1_fee, str):
+            l1_fee = int(l1_fee, 16)
+        return gas_used * gas_price + l1_fee
+
+    @property
+    def eth_gas_fee(self):
+        """
+        Gas fee in the native token of the chain (ether on ETH, BNB on BSC, ...)
+        """
+        return self.web3.from_wei(self.gas_fee_wei, 'ether')
 
     @property
     def logs(self):
@@ -49,9 +114,17 @@ class Transaction(object):
         logs = receipt.get('logs',[])
         return logs
 
+    def decoded_logs(self, registry: EventRegistry = default_registry):
+        """
+        Return: Dataframe of logs decoded by registry, unknown events are skipped
+        """
+        return registry.decode_logs(self.logs)
+
 
 if __name__ == "__main__":
     txn_hash = '0x07a582bdfca3c12da00572252e86b4b343201f37b3c9741d9ac99f195e8d3d1d'
     txn = Transaction(txn_hash)
     print(txn.eth_gas_fee)
     print(txn.logs)
+    for t in Transaction.bulk([txn_hash]):
+        print(t.eth_gas_fee)
@@ -0,0 +1,255 @@
+import os
+import sqlite3
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from analytics.gas import block_timestamps
+from utils.chain import Chain
+from utils.rpc import batch_call
+
+# solidity_to_selector of the signatures, written out so the indexer does not import web3 through utils.etherum
+# event Transfer(address indexed from, address indexed to, uint256 value)
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+# function decimals() view returns (uint8)
+DECIMALS_SELECTOR = '0x313ce567'
+DEFAULT_TRANSFER_DB = os.path.join(os.path.expanduser('~'), '.cache', 'web3-analytics', 'transfers.sqlite')
+
+
+def _topic_address(address: str) -> str:
+    return '0x' + '0' * 24 + address.lower()[2:]
+
+
+class TransferIndexer:
+    """
+    incremental ERC-20 Transfer indexer for a set of watched addresses
+
+    logs are queried with topic filters on the indexed from / to, block windows are batched into json-rpc
+    batch requests and split in half when a node rejects a window, progress is stored per chain so each
+    update only scans blocks after the last indexed one
+    """
+
+    def __init__(self, addresses: Iterable[str], path: str = DEFAULT_TRANSFER_DB, window: int = 2000,
+                 windows_per_batch: int = 10, confirmations: int = 12):
+        self.addresses = sorted({a.lower() for a in addresses})
+        self.window = window
+        self.windows_per_batch = windows_per_batch
+        self.confirmations = confirmations
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS transfers (
+                chain TEXT NOT NULL, block_number INTEGER NOT NULL, timestamp INTEGER,
+                tx_hash TEXT NOT NULL, log_index INTEGER NOT NULL, token TEXT NOT NULL,
+                "from" TEXT NOT NULL, "to" TEXT NOT NULL, value TEXT NOT NULL,
+                PRIMARY KEY (chain, tx_hash, log_index));
+            CREATE INDEX IF NOT EXISTS transfers_from ON transfers ("from");
+            CREATE INDEX IF NOT EXISTS transfers_to ON transfers ("to");
+            CREATE TABLE IF NOT EXISTS progress (
+                chain TEXT NOT NULL, address TEXT NOT NULL, last_block INTEGER NOT NULL,
+                PRIMARY KEY (chain, address));
+            CREATE TABLE IF NOT EXISTS tokens (
+                chain TEXT NOT NULL, token TEXT NOT NULL, decimals INTEGER,
+                PRIMARY KEY (chain, token));
+        ''')
+        self._conn.commit()
+
+    def last_block(self, chain: Chain) -> Optional[int]:
+        """ last block indexed for every watched address on chain """
+        rows = self._conn.execute(
+            'SELECT address, last_block FROM progress WHERE chain = ?', (chain.value,)).fetchall()
+        done = dict(rows)
+        if any(a not in done for a in self.addresses):
+            return None
+        return min(done[a] for a in self.addresses)
+
+    def _save_progress(self, chain: Chain, block: int) -> None:
+        self._conn.executemany('INSERT OR REPLACE INTO progress VALUES (?, ?, ?)',
+                               [(chain.value, a, block) for a in self.addresses])
+
+    def _fetch_decimals(self, chain: Chain, tokens: List[str]) -> None:
+        known = {t for (t,) in self._conn.execute('SELECT token FROM tokens WHERE chain = ?', (chain.value,))}
+        tokens = [t for t in tokens if t not in known]
+        if not tokens:
+            return
+        results = batch_call(chain, [('eth_call', [{'to': t, 'data': DECIMALS_SELECTOR}, 'latest'])
+                                         for t in tokens])
+        rows = [(chain.value, t, int(r, 16) if r and r != '0x' else None) for t, r in zip(tokens, results)]
+        self._conn.executemany('INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)', rows)
+
+    def update(self, chain: Chain, start_block: int = 0, to_block: Optional[int] = None) -> int:
+        """ index transfers from the last indexed block (or start_block) up to to_block
+
+        :param chain: chain to scan
+        :param start_block: first block when the chain has never been indexed
+        :param to_block: last block, default latest - confirmations
+        :return: number of new transfers
+        """
+        if not self.addresses:
+            return 0
+        if to_block is None:
+            to_block = int(batch_call(chain, [('eth_blockNumber', [])])[0], 16) - self.confirmations
+        last = self.last_block(chain)
+        from_block = start_block if last is None else last + 1
+        if from_block > to_block:
+            return 0
+        logger.info('indexing transfers on {} from {} to {}', chain.value, from_block, to_block)
+
+        watched = [_topic_address(a) for a in self.addresses]
+        pending: Deque[Tuple[int, int]] = deque(
+            (b, min(b + self.window - 1, to_block)) for b in range(from_block, to_block + 1, self.window))
+        total = 0
+        committed = from_block - 1
+        completed: Dict[int, int] = {}  # start -> end of windows fetched but not yet contiguous with committed
+        while pending:
+            windows = [pending.popleft() for _ in range(min(self.windows_per_batch, len(pending)))]
+            calls = []
+            for lo, hi in windows:
+                base = {'fromBlock': hex(lo), 'toBlock': hex(hi)}
+                calls.append(('eth_getLogs', [dict(base, topics=[TRANSFER_TOPIC, watched])]))
+                calls.append(('eth_getLogs', [dict(base, topics=[TRANSFER_TOPIC, None, watched])]))
+            results = batch_call(chain, calls, batch_size=len(calls))
+
+            logs, failed = [], []
+            for i, (lo, hi) in enumerate(windows):
+                sent, received = results[2 * i], results[2 * i + 1]
+                if sent is None or received is None:
+                    if lo == hi:
+                        raise ValueError(f'eth_getLogs failed for block {lo} on {chain.value}')
+                    failed.append((lo, hi))
+                else:
+                    logs.extend(sent)
+                    logs.extend(received)
+                    completed[lo] = hi
+            for lo, hi in reversed(failed):
+                mid = (lo + hi) // 2
+                pending.appendleft((mid + 1, hi))
+                pending.appendleft((lo, mid))
+            total += self._store(chain, logs)
+            # progress only moves over windows that are fetched without gaps
+            while committed + 1 in completed:
+                committed = completed.pop(committed + 1)
+            if committed >= from_block:
+                self._save_progress(chain, committed)
+            self._conn.commit()
+        logger.info('indexed {} transfers on {}', total, chain.value)
+        return total
+
+    def _store(self, chain: Chain, logs: List[dict]) -> int:
+        # ERC-721 Transfer shares topic0 but has tokenId as a 4th topic
+        logs = [log for log in logs if len(log['topics']) == 3 and not log.get('removed')]
+        if not logs:
+            return 0
+        timestamps = block_timestamps(chain, [int(log['blockNumber'], 16) for log in logs])
+        rows = []
+        for log in logs:
+            block = int(log['blockNumber'], 16)
+            data = log['data']
+            rows.append((chain.value, block, timestamps.get(block), log['transactionHash'].lower(),
+                         int(log['logIndex'], 16), log['address'].lower(),
+                         '0x' + log['topics'][1][-40:].lower(), '0x' + log['topics'][2][-40:].lower(),
+                         str(int(data, 16) if data and data != '0x' else 0)))
+        before = self._conn.total_changes
+        self._conn.executemany('INSERT OR IGNORE INTO transfers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        inserted = self._conn.total_changes - before
+        self._fetch_decimals(chain, sorted({r[5] for r in rows}))
+        return inserted
+
+    def update_all(self, chains: Iterable[Chain], start_block: int = 0) -> Dict[Chain, int]:
+        return {chain: self.update(chain, start_block=start_block) for chain in chains}
+
+    def ledger(self, address: Optional[str] = None, chain: Optional[Chain] = None,
+               from_block: Optional[int] = None) -> pd.DataFrame:
+        """ signed per-address transfer ledger
+
+        :param address: only this watched address, default all watched addresses
+        :param chain: only this chain, default all chains
+        :param from_block: only transfers at or after this block, e.g. the delta since the last update
+        :return: dataframe with columns chain, address, block_number, timestamp, tx_hash, log_index,
+                 token, counterparty, amount (positive for inflow, scaled by token decimals)
+        """
+        addresses = [address.lower()] if address else self.addresses
+        query = ('SELECT t.chain, t.block_number, t.timestamp, t.tx_hash, t.log_index, t.token, '
+                 't."from", t."to", t.value, k.decimals FROM transfers t '
+                 'LEFT JOIN tokens k ON k.chain = t.chain AND k.token = t.token '
+                 'WHERE (t."from" IN ({0}) OR t."to" IN ({0}))'.format(','.join('?' * len(addresses))))
+        params = addresses + addresses
+        if chain is not None:
+            query += ' AND t.chain = ?'
+            params.append(chain.value)
+        if from_block is not None:
+            query += ' AND t.block_number >= ?'
+            params.append(from_block)
+        df = pd.read_sql_query(query, self._conn, params=params)
+        scale = np.power(10.0, df['decimals'].fillna(18).astype(float))
+        df['amount'] = df['value'].map(float) / scale
+        watched = set(addresses)
+        inflow = df[df['to'].isin(watched)].assign(address=lambda x: x['to'], counterparty=lambda x: x['from'])
+        outflow = df[df['from'].isin(watched)].assign(address=lambda x: x['from'], counterparty=lambda x: x['to'],
+                                                      amount=lambda x: -x['amount'])
+        result = pd.concat([inflow, outflow], ignore_index=True)
+        result['timestamp'] = pd.to_datetime(result['timestamp'], unit='s')
+        columns = ['chain', 'address', 'block_number', 'timestamp', 'tx_hash', 'log_index', 'token',
+                   'counterparty', 'amount']
+        return result.loc[:, columns].sort_values(['block_number', 'log_index']).reset_index(drop=True)
+
+    def balances(self, address: Optional[str] = None) -> pd.DataFrame:
+        """ net token balances from the indexed ledger """
+        df = self.ledger(address)
+        return df.groupby(['chain', 'address', 'token'], as_index=False)['amount'].sum()
+
+
+def cost_basis(ledger: pd.DataFrame, prices: pd.DataFrame) -> pd.DataFrame:
+    """ average cost basis per token from a transfer ledger
+
+    inflows are valued at the token price at transfer time, outflows release cost at the running average cost.
+    transfers between two watched addresses are left out, an internal move does not change the cost basis.
+    inflows without a price at or before them are tracked as unpriced_quantity, while any of it is still held
+    the cost and avg_cost of the token are unknown (NaN) instead of understated
+
+    :param ledger: TransferIndexer.ledger() output, chain, address, block_number, timestamp, log_index, token,
+                   counterparty and amount are used
+    :param prices: dataframe with columns token, timestamp, price (usd)
+    :return: dataframe with columns chain, token, quantity, cost, avg_cost, unpriced_quantity
+    """
+    columns = ['chain', 'token', 'quantity', 'cost', 'avg_cost', 'unpriced_quantity']
+    # both legs of a move between watched addresses, the ledger only has rows of watched addresses
+    left = ledger[~ledger['counterparty'].isin(set(ledger['address']))]
+    left = left.sort_values(['timestamp', 'block_number', 'log_index'], kind='stable')
+    if len(left) == 0:
+        return pd.DataFrame(columns=columns)
+    right = prices.loc[:, ['token', 'timestamp', 'price']].sort_values('timestamp')
+    right['timestamp'] = right['timestamp'].astype(left['timestamp'].dtype)
+    df = pd.merge_asof(left, right, on='timestamp', by='token', direction='backward')
+    rows = []
+    for (chain, token), group in df.groupby(['chain', 'token'], sort=False):
+        quantity = cost = unpriced = 0.0
+        for amount, price in zip(group['amount'].to_numpy(), group['price'].to_numpy()):
+            if amount >= 0:
+                quantity += amount
+                if np.isnan(price):
+                    unpriced += amount
+                else:
+                    cost += amount * price
+            elif quantity > 0:
+                # priced and unpriced holdings are released in proportion
+                kept = 1 - min(-amount, quantity) / quantity
+                cost *= kept
+                unpriced *= kept
+                quantity *= kept
+        if unpriced > 0:
+            rows.append((chain, token, quantity, np.nan, np.nan, unpriced))
+        else:
+            rows.append((chain, token, quantity, cost, cost / quantity if quantity > 0 else np.nan, 0.0))
+    return pd.DataFrame(rows, columns=columns)
+
+
+if __name__ == "__main__":
+    indexer = TransferIndexer(['0x28C6c06298d514Db089934071355E5743bf21d60'])
+    indexer.update(Chain.ETH, start_block=21000000)
+    print(indexer.ledger().tail(10))
+    print(indexer.balances())
@@ -0,0 +1,154 @@
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from utils.chain import Chain
+from utils.interval import INTERVAL_MS, exchange_interval, normalize_interval
+
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+
+def _word(value: int) -> str:
+    return '0x' + f'{value:064x}'
+
+
+def _topic_address(address: str) -> str:
+    return '0x' + '0' * 24 + address.lower()[2:]
+
+
+# synthetic fixtures, deterministic for a seed so runs are comparable
+
+
+def synthetic_klines(interval: str, count: int, start_ms: int, price: float = 100.0, volatility: float = 0.01,
+                     seed: int = 0) -> List[list]:
+    """ random walk kline rows in the binance format """
+    step = INTERVAL_MS[normalize_interval(interval)]
+    rng = np.random.default_rng(seed)
+    closes = price * np.exp(np.cumsum(rng.normal(0, volatility, count)))
+    opens = np.concatenate([[price], closes[:-1]])
+    spread = np.abs(rng.normal(0, volatility / 2, count))
+    highs = np.maximum(opens, closes) * (1 + spread)
+    lows = np.minimum(opens, closes) * (1 - spread)
+    volumes = rng.uniform(10, 1000, count)
+    return [[start_ms + i * step, f'{o:.8f}', f'{h:.8f}', f'{lo:.8f}', f'{c:.8f}', f'{v:.8f}',
+             start_ms + (i + 1) * step - 1, f'{v * c:.8f}', 100, f'{v / 2:.8f}', f'{v * c / 2:.8f}', '0']
+            for i, (o, h, lo, c, v) in enumerate(zip(opens, highs, lows, closes, volumes))]
+
+
+def synthetic_market(symbols: Sequence[str], intervals: Sequence[str] = ('1h', '1d'), count: int = 2000,
+                     end_ms: Optional[int] = None) -> Dict[str, Dict[str, List[list]]]:
+    """ klines of several binance symbols (BTCUSDT), ending at the last candle closed before end_ms (default now)
+
+    :return: symbol -> interval -> kline rows, as MockBinanceServer takes them
+    """
+    end_ms = end_ms if end_ms is not None else int(time.time() * 1000)
+    market = {}
+    for i, symbol in enumerate(symbols):
+        market[symbol] = {}
+        for interval in intervals:
+            step = INTERVAL_MS[normalize_interval(interval)]
+            start = (end_ms // step - count) * step
+            market[symbol][interval] = synthetic_klines(interval, count, start, price=10.0 * (i + 1), seed=i)
+    return market
+
+
+def synthetic_transfers(tokens: Sequence[str], watched: Sequence[str], from_block: int, to_block: int,
+                        count: int, seed: int = 0) -> Dict[str, object]:
+    """ ERC-20 Transfer logs from or to the watched addresses and the receipts of their transactions
+
+    :return: {'logs': raw json-rpc logs sorted by block, 'receipts': transaction hash -> raw receipt}
+    """
+    rng = np.random.default_rng(seed)
+    blocks = np.sort(rng.integers(from_block, to_block + 1, count))
+    logs, receipts = [], {}
+    for i, block in enumerate(blocks.tolist()):
+        token = tokens[int(rng.integers(len(tokens)))]
+        mine = watched[int(rng.integers(len(watched)))]
+        other = '0x' + f'{int(rng.integers(1, 2 ** 62)):040x}'
+        sender, receiver = (mine, other) if rng.random() < 0.5 else (other, mine)
+        tx_hash = _word(seed * 10 ** 9 + i + 1)
+        log = {'address': token.lower(), 'blockNumber': hex(block), 'blockHash': _word(block),
+               'transactionHash': tx_hash, 'transactionIndex': '0x0', 'logIndex': hex(i % 100),
+               'topics': [TRANSFER_TOPIC, _topic_address(sender), _topic_address(receiver)],
+               'data': _word(int(rng.integers(1, 10 ** 6)) * 10 ** 12), 'removed': False}
+        logs.append(log)
+        receipts[tx_hash] = {
+            'transactionHash': tx_hash, 'transactionIndex': '0x0', 'blockNumber': hex(block),
+            'blockHash': _word(block), 'from': sender, 'to': token.lower(), 'contractAddress': None,
+            'cumulativeGasUsed': hex(60_000), 'gasUsed': hex(60_000), 'effectiveGasPrice': hex(20 * 10 ** 9),
+            'status': '0x1', 'type': '0x2', 'logs': [log], 'logsBloom': '0x' + '00' * 256}
+    return {'logs': logs, 'receipts': receipts}
+
+
+# recorded fixtures
+
+
+def save(path: str, fixtures: dict) -> None:
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(fixtures, f)
+
+
+def load(path: str) -> dict:
+    """ :return: {'logs': [...], 'receipts': {...}, 'klines': {...}}, keys missing in the file are empty """
+    with open(path) as f:
+        fixtures = json.load(f)
+    fixtures.setdefault('logs', [])
+    fixtures.setdefault('receipts', {})
+    fixtures.setdefault('klines', {})
+    return fixtures
+
+
+def record_transfers(chain: Chain, watched: Iterable[str], from_block: int, to_block: int,
+                     window: int = 2000) -> Dict[str, object]:
+    """ Transfer logs from or to the watched addresses and their receipts, read from the nodes of chain """
+    from utils.rpc import batch_call
+
+    watched = [_topic_address(a) for a in watched]
+    calls = []
+    for lo in range(from_block, to_block + 1, window):
+        base = {'fromBlock': hex(lo), 'toBlock': hex(min(lo + window - 1, to_block))}
+        calls.append(('eth_getLogs', [dict(base, topics=[TRANSFER_TOPIC, watched])]))
+        calls.append(('eth_getLogs', [dict(base, topics=[TRANSFER_TOPIC, None, watched])]))
+    logs = {(log['transactionHash'], log['logIndex']): log
+            for result in batch_call(chain, calls, batch_size=10) if result for log in result}
+    logs = sorted(logs.values(), key=lambda log: (int(log['blockNumber'], 16), int(log['logIndex'], 16)))
+    hashes = list(dict.fromkeys(log['transactionHash'] for log in logs))
+    raw = batch_call(chain, [('eth_getTransactionReceipt', [h]) for h in hashes])
+    return {'logs': logs, 'receipts': {h: r for h, r in zip(hashes, raw) if r is not None}}
+
+
+def record_klines(symbols: Sequence[str], intervals: Sequence[str] = ('1h', '1d'),
+                  limit: int = 1000) -> Dict[str, Dict[str, List[list]]]:
+    """ the last limit klines of binance symbols, in the format of synthetic_market """
+    from utils.http_session import exchange_session
+
+    http = exchange_session('binance')
+    market = {}
+    for symbol in symbols:
+        market[symbol] = {}
+        for interval in intervals:
+            params = {'symbol': symbol, 'interval': exchange_interval('binance', interval), 'limit': limit}
+            market[symbol][interval] = http.get('https://api.binance.com/api/v3/klines', params=params,
+                                                weight=2).json()
+    return market
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='record benchmark fixtures from live endpoints')
+    parser.add_argument('path')
+    parser.add_argument('--watch', nargs='+', required=True, help='addresses whose transfers are recorded')
+    parser.add_argument('--from-block', type=int, required=True)
+    parser.add_argument('--to-block', type=int, required=True)
+    parser.add_argument('--symbols', nargs='+', default=['BTCUSDT', 'ETHUSDT', 'SOLUSDT', 'BNBUSDT'])
+    args = parser.parse_args()
+    recorded = record_transfers(Chain.ETH, args.watch, args.from_block, args.to_block)
+    recorded['klines'] = record_klines(args.symbols)
+    save(args.path, recorded)
+    print(f"{len(recorded['logs'])} logs, {len(recorded['receipts'])} receipts recorded to {args.path}")
@@ -0,0 +1,97 @@
+"""
+import time benchmarks
+
+each module is imported in a fresh interpreter, the best of repeat runs is reported with the number of modules
+it loads. heavy dependencies a module must not pull in are checked too, e.g. a price lookup through
+utils.token_price should never load pandas or web3, and nothing should read .env at import
+
+usage:
+    python -m benchmarks.imports --out imports.json
+    python -m benchmarks.imports --baseline imports.json      # exit 1 on regression
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+# module -> dependencies it must not load at import
+MODULES: Dict[str, tuple] = {
+    'utils.chain': ('dotenv', 'pandas', 'web3'),
+    'utils.metrics': ('dotenv', 'requests', 'numpy'),
+    'utils.token_price': ('dotenv', 'pandas', 'web3', 'eth_abi'),
+    'utils.cex.binance': ('dotenv', 'pandas', 'web3'),
+    'utils.rpc': ('dotenv', 'pandas', 'web3'),
+    'utils.block_index': ('dotenv', 'pandas', 'web3'),
+    'utils.candle_store': ('dotenv', 'web3'),
+    'analytics.transfers': ('dotenv', 'web3'),
+    'analytics.portfolio': ('dotenv', 'web3', 'eth_abi'),
+    'analytics.pair': ('dotenv', 'web3'),
+    'strategy.grid_backtest': ('dotenv', 'web3', 'requests'),
+    'utils.etherum': ('dotenv',),
+}
+
+_PROBE = ('import json, sys, time\n'
+          'start = time.perf_counter()\n'
+          'import {module}\n'
+          'seconds = time.perf_counter() - start\n'
+          'print(json.dumps({{"seconds": seconds, "modules": sorted(sys.modules)}}))\n')
+
+
+def measure(module: str, repeat: int = 5) -> dict:
+    """ :return: best import seconds of repeat fresh interpreters and the top level packages loaded """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    best, loaded = None, []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', _PROBE.format(module=module)], capture_output=True, text=True,
+                             env=env, cwd=root, check=True).stdout
+        probe = json.loads(out.strip().splitlines()[-1])
+        if best is None or probe['seconds'] < best:
+            best, loaded = probe['seconds'], probe['modules']
+    packages = sorted({m.split('.')[0] for m in loaded})
+    return {'seconds': best, 'modules': len(loaded), 'packages': packages}
+
+
+def check(results: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None, tolerance: float = 0.25) -> List[str]:
+    """ :return: forbidden dependencies loaded, and modules slower than baseline by more than tolerance """
+    problems = []
+    for module, result in results.items():
+        for dependency in MODULES.get(module, ()):
+            if dependency in result['packages']:
+                problems.append(f'{module} imports {dependency}')
+        base = (baseline or {}).get(module)
+        if base is not None and result['seconds'] > base['seconds'] * (1 + tolerance):
+            problems.append(f"{module}: {base['seconds'] * 1000:.0f}ms -> {result['seconds'] * 1000:.0f}ms")
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='import time of the package modules in fresh interpreters')
+    parser.add_argument('--only', nargs='+', help='modules to measure, default all of MODULES')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--out', help='write results as json')
+    parser.add_argument('--baseline', help='results json of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed import time growth')
+    args = parser.parse_args(argv)
+
+    results = {module: measure(module, args.repeat) for module in args.only or list(MODULES)}
+    print(f"{'module':<26}{'import ms':>10}{'modules':>9}")
+    for module, result in results.items():
+        print(f"{module:<26}{result['seconds'] * 1000:>10.1f}{result['modules']:>9}")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    problems = check(results, baseline, args.tolerance)
+    for line in problems:
+        print(f'REGRESSION {line}')
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
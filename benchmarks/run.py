@@ -0,0 +1,314 @@
+"""
+offline benchmark suite
+
+every scenario runs against in-process mock endpoints, a json-rpc node (utils.rpc_mock) serving Transfer logs and
+receipts from fixtures and a binance api (utils.cex.binance_mock) serving klines, so results only depend on
+this code and the machine. fixtures are synthetic and seeded by default, or recorded from live endpoints with
+benchmarks/fixtures.py
+
+usage:
+    python -m benchmarks.run --out results.json
+    python -m benchmarks.run --baseline results.json --tolerance 0.25     # exit 1 on regression
+    python -m benchmarks.run --only multicall pair_candlesticks_warm --rpc-latency 0.02
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from benchmarks import fixtures as fx
+from utils import metrics
+from utils.cex.binance_mock import MockBinanceServer
+from utils.chain import Chain
+from utils.rpc_mock import MockRpcServer
+
+HEAD = 20_000_000
+TOKENS = ['0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48', '0xdac17f958d2ee523a2206206994597c13d831ec7',
+          '0xc02aaa39b223fe8d0a0e5c3756cc2ad83ec6f83c', '0x2260fac5e5542a773aa44fbc8bfcef7c05c2c599']
+WATCHED = ['0x28c6c06298d514db089934071355e5743bf21d60', '0x21a31ee1afc51d94c2efccaa2092ad1028285549']
+SYMBOLS = ['BTCUSDT', 'ETHUSDT', 'SOLUSDT', 'BNBUSDT', 'LINKUSDT', 'AVAXUSDT']
+
+
+class Environment:
+    """ mock node, mock binance and scratch stores, environment variables point the code under test at them """
+
+    def __init__(self, fixtures: dict, nodes: int = 1, rpc_latency: float = 0.0, cex_latency: float = 0.0):
+        self.fixtures = fixtures
+        self.nodes = [MockRpcServer(latency=rpc_latency, head=HEAD, logs=fixtures['logs'],
+                                    receipts=fixtures['receipts']) for _ in range(nodes)]
+        self.cex = MockBinanceServer(fixtures['klines'], latency=cex_latency)
+        self.directory = tempfile.mkdtemp(prefix='web3-analytics-bench-')
+        self._runs = 0
+        self._env: Dict[str, Optional[str]] = {}
+        self._route = None
+
+    @property
+    def url(self) -> str:
+        return ','.join(node.url for node in self.nodes)
+
+    def path(self, name: str) -> str:
+        """ a new scratch sqlite path, so cold scenarios start from an empty store """
+        self._runs += 1
+        return os.path.join(self.directory, f'{name}-{self._runs}.sqlite')
+
+    def requests(self) -> int:
+        return sum(node.requests for node in self.nodes) + sum(self.cex.requests.values())
+
+    def __enter__(self) -> 'Environment':
+        for node in self.nodes:
+            node.start()
+        self.cex.start()
+        self._route = self.cex.route()
+        self._route.__enter__()
+        values = {'ETH_CHAIN_URL': self.url,
+                  'BLOCK_INDEX_PATH': os.path.join(self.directory, 'blocks.sqlite'),
+                  'RECEIPT_STORE_PATH': os.path.join(self.directory, 'receipts.sqlite'),
+                  'CANDLE_STORE_PATH': os.path.join(self.directory, 'candles.sqlite')}
+        for key, value in values.items():
+            self._env[key] = os.environ.get(key)
+            os.environ[key] = value
+        return self
+
+    def __exit__(self, *exc) -> None:
+        for key, value in self._env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        self._route.__exit__()
+        self.cex.stop()
+        for node in self.nodes:
+            node.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+# scenarios: scenario(env) -> run, every run() does one timed unit of work and returns the number of operations
+
+SCENARIOS: Dict[str, Callable[[Environment], Callable[[], int]]] = {}
+
+
+def scenario(fn):
+    SCENARIOS[fn.__name__] = fn
+    return fn
+
+
+@scenario
+def multicall(env: Environment) -> Callable[[], int]:
+    """ 1000 balanceOf calls in aggregate3 batches of 100 """
+    from utils.etherum import Call, Client
+
+    client = Client(env.url)
+    calls = [Call(TOKENS[i % len(TOKENS)], 'function balanceOf(address) view returns (uint256)',
+                  WATCHED[i % len(WATCHED)], allow_failure=True) for i in range(1000)]
+    return lambda: len(client.multicall(calls, batch_size=100))
+
+
+@scenario
+def multicall_at_blocks(env: Environment) -> Callable[[], int]:
+    """ 7 calls pinned at 500 historical blocks """
+    from analytics.eth_lst import ETH_LSTS
+    from utils.etherum import Client
+
+    client = Client(env.url)
+    calls = [t.call() for t in ETH_LSTS]
+    blocks = range(HEAD - 500 * 7200, HEAD, 7200)
+    return lambda: len(client.multicall_at_blocks(calls, blocks)) * len(calls)
+
+
+@scenario
+def transfer_scan(env: Environment) -> Callable[[], int]:
+    """ TransferIndexer over the fixture block range into a fresh database """
+    from analytics.transfers import TransferIndexer
+
+    first = int(env.fixtures['logs'][0]['blockNumber'], 16) if env.fixtures['logs'] else HEAD - 100_000
+    last = int(env.fixtures['logs'][-1]['blockNumber'], 16) if env.fixtures['logs'] else HEAD
+
+    def run() -> int:
+        indexer = TransferIndexer(WATCHED, path=env.path('transfers'))
+        return indexer.update(Chain.ETH, start_block=first, to_block=last)
+    return run
+
+
+@scenario
+def contract_logs(env: Environment) -> Callable[[], int]:
+    """ Client.get_contract_logs of one token over the fixture range, decoded by web3 """
+    from utils.etherum import Client
+
+    client = Client(env.url, event_from_doris=False)
+    token = env.fixtures['logs'][0]['address'] if env.fixtures['logs'] else TOKENS[0]
+    solidity = 'event Transfer(address indexed from, address indexed to, uint256 value)'
+    return lambda: len(client.get_contract_logs(token, solidity, HEAD - 1_000_000, HEAD))
+
+
+@scenario
+def receipts_cold(env: Environment) -> Callable[[], int]:
+    """ Transaction.bulk of every fixture receipt into an empty receipt store """
+    from analytics.transaction import Transaction
+    from utils.receipt_store import ReceiptStore
+
+    hashes = list(env.fixtures['receipts'])
+    return lambda: len(Transaction.bulk(hashes, Chain.ETH, store=ReceiptStore(env.path('receipts'))))
+
+
+@scenario
+def portfolio_token_analysis(env: Environment) -> Callable[[], int]:
+    """ valuation of a 30 row balance over the fixture symbols, prices from the mock cex """
+    from analytics.portfolio import portfolio_token_analysis as analyse
+
+    tokens = [s[:-4] for s in env.fixtures['klines']] + ['USD']
+    balance = [(tokens[i % len(tokens)], f'onchain-eth-{i % 5}', 1.5 + i) for i in range(30)]
+    return lambda: len(analyse(balance))
+
+
+@scenario
+def pair_candlesticks_cold(env: Environment) -> Callable[[], int]:
+    """ ETH/BTC 1000 hourly candles into an empty candle store """
+    from analytics.pair import Pair
+    from utils.candle_store import CandleStore
+
+    return lambda: len(Pair('ETH', 'BTC', store=CandleStore(env.path('candles'))).candlesticks('1h', limit=1000))
+
+
+@scenario
+def pair_candlesticks_warm(env: Environment) -> Callable[[], int]:
+    """ ETH/BTC 1000 hourly candles from an up to date candle store """
+    from analytics.pair import Pair
+    from utils.candle_store import CandleStore
+
+    pair = Pair('ETH', 'BTC', store=CandleStore(env.path('candles')))
+    pair.candlesticks('1h', limit=1000)
+    return lambda: len(pair.candlesticks('1h', limit=1000))
+
+
+def _grid_candles(count: int) -> pd.DataFrame:
+    rows = fx.synthetic_klines('1m', count, 0, price=100.0, volatility=0.002, seed=7)
+    return pd.DataFrame([r[1:5] for r in rows], columns=['open', 'high', 'low', 'close']).astype(float)
+
+
+@scenario
+def grid_backtest(env: Environment) -> Callable[[], int]:
+    """ one 100 level geometric grid over 200k one minute candles """
+    from strategy.grid_backtest import backtest_grid, candles_to_array
+    from strategy.grid_trading import GridConfig
+
+    candles = candles_to_array(_grid_candles(200_000))
+    config = GridConfig('BTCUSDT', upper_price=130.0, lower_price=70.0, grid_number=100, total_invest=10_000,
+                        grid_type='geometric')
+
+    def run() -> int:
+        backtest_grid(config, candles)
+        return candles.shape[1]
+    return run
+
+
+@scenario
+def grid_sweep(env: Environment) -> Callable[[], int]:
+    """ 5 x 5 x 4 grid parameter sweep over 50k candles on 2 processes """
+    from strategy.grid_sweep import sweep_grid
+
+    candles = _grid_candles(50_000)
+    return lambda: len(sweep_grid(candles, 'BTCUSDT', upper_prices=[110, 120, 130, 140, 150],
+                                  lower_prices=[50, 60, 70, 80, 90], grid_numbers=[10, 20, 50, 100],
+                                  total_invest=10_000, processes=2))
+
+
+# measurement
+
+
+def measure(run: Callable[[], int], repeat: int, requests: Callable[[], int]) -> dict:
+    """ one warm up run, then repeat timed runs
+
+    :return: runs, ops per run, latency mean / p50 / p99 / min seconds per run, ops per second and mock http
+             requests per run
+    """
+    run()
+    seconds, ops = [], 0
+    before = requests()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ops = run()
+        seconds.append(time.perf_counter() - start)
+    timings = np.array(seconds)
+    return {'runs': repeat, 'ops': int(ops), 'mean': float(timings.mean()),
+            'p50': float(np.percentile(timings, 50)), 'p99': float(np.percentile(timings, 99)),
+            'min': float(timings.min()), 'ops_per_sec': float(ops / timings.mean()) if timings.mean() else 0.0,
+            'requests': (requests() - before) / repeat}
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """ :return: scenarios whose fastest run slowed by more than tolerance or that send more requests,
+    the fastest run is the least disturbed by other load on the machine """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['min'] > base['min'] * (1 + tolerance):
+            regressions.append(f"{name}: fastest run {base['min'] * 1000:.1f}ms -> {result['min'] * 1000:.1f}ms")
+        if result['requests'] > base['requests']:
+            regressions.append(f"{name}: requests per run {base['requests']:.1f} -> {result['requests']:.1f}")
+    return regressions
+
+
+def report(results: Dict[str, dict]) -> str:
+    lines = [f"{'scenario':<26}{'ops':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'ops/s':>12}{'requests':>10}"]
+    for name, r in results.items():
+        lines.append(f"{name:<26}{r['ops']:>8}{r['mean'] * 1000:>10.2f}{r['p50'] * 1000:>10.2f}"
+                     f"{r['p99'] * 1000:>10.2f}{r['ops_per_sec']:>12.0f}{r['requests']:>10.1f}")
+    return '\n'.join(lines)
+
+
+def default_fixtures(transfers: int = 5000, seed: int = 0) -> dict:
+    fixtures = fx.synthetic_transfers(TOKENS, WATCHED, HEAD - 200_000, HEAD - 100, transfers, seed=seed)
+    fixtures['klines'] = fx.synthetic_market(SYMBOLS, intervals=('1h', '1d'), count=2000)
+    return fixtures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='offline benchmarks against mock rpc / cex endpoints')
+    parser.add_argument('--only', nargs='+', choices=sorted(SCENARIOS), help='scenarios to run, default all')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per scenario')
+    parser.add_argument('--fixtures', help='recorded fixtures json, default seeded synthetic fixtures')
+    parser.add_argument('--transfers', type=int, default=5000, help='synthetic Transfer logs')
+    parser.add_argument('--nodes', type=int, default=1, help='mock rpc nodes behind the router')
+    parser.add_argument('--rpc-latency', type=float, default=0.0, help='seconds slept per rpc http request')
+    parser.add_argument('--cex-latency', type=float, default=0.0, help='seconds slept per cex http request')
+    parser.add_argument('--out', help='write results and metrics as json')
+    parser.add_argument('--baseline', help='results json of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown of the fastest run')
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+    metrics.enable()
+    fixtures = fx.load(args.fixtures) if args.fixtures else default_fixtures(args.transfers)
+    results, snapshots = {}, {}
+    with Environment(fixtures, args.nodes, args.rpc_latency, args.cex_latency) as env:
+        for name in args.only or list(SCENARIOS):
+            metrics.REGISTRY.reset()
+            results[name] = measure(SCENARIOS[name](env), args.repeat, env.requests)
+            snapshots[name] = metrics.REGISTRY.snapshot()
+    print(report(results))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'results': results, 'metrics': snapshots}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
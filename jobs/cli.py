@@ -0,0 +1,299 @@
+"""
+batch jobs over csv / parquet inputs
+
+    python -m jobs.cli prices fetch -i tokens.csv -o prices.parquet
+    python -m jobs.cli portfolio snapshot -i balances.csv -o portfolio-{time}.parquet
+    python -m jobs.cli pools price -i pools.csv -o pool_prices.csv
+    python -m jobs.cli grid backtest -i grids.csv -o backtests.parquet --interval 1h --limit 2000
+    python -m jobs.cli batch jobs.csv
+    python -m jobs.cli daemon jobs.csv --every 60 --metrics-port 9108
+    python -m jobs.cli refresh refresh.json --every 60 --out refresh/
+
+every job of a batch, and every run of the daemon, shares one Context: rpc clients, exchange sessions,
+the candle store and recent prices stay warm instead of being rebuilt per job. a jobs file has the columns
+command (such as "prices fetch"), input, output and optionally the options of the command. refresh runs the
+jobs.refresh dag instead, only the nodes whose block, tick or inputs moved are computed again
+"""
+import argparse
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+from loguru import logger
+
+from jobs.tables import read_table, write_table
+from utils.chain import Chain
+
+
+class Context:
+    """ state shared by the jobs of a batch and by the runs of the daemon """
+
+    def __init__(self, price_ttl: float = 30, max_workers: int = 8):
+        """
+        :param price_ttl: seconds a fetched price is reused
+        :param max_workers: concurrent price requests
+        """
+        self.price_ttl = price_ttl
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._clients: Dict[Chain, object] = {}
+        self._prices: Dict[str, Tuple[Optional[float], float]] = {}
+        self._heads: Dict[Chain, Tuple[int, float]] = {}
+        self._store = None
+
+    def client(self, chain: Chain):
+        """ one utils.etherum.Client per chain """
+        from utils.etherum import Client
+
+        with self._lock:
+            if chain not in self._clients:
+                self._clients[chain] = Client.from_chain(chain, event_from_doris=False)
+            return self._clients[chain]
+
+    def head(self, chain: Chain, max_age: float = 1.0) -> int:
+        """ latest block of chain, reused for max_age seconds so the nodes of one refresh agree on it """
+        from utils.rpc import batch_call
+
+        with self._lock:
+            cached = self._heads.get(chain)
+        if cached is None or time.time() - cached[1] > max_age:
+            cached = (int(batch_call(chain, [('eth_blockNumber', [])])[0], 16), time.time())
+            with self._lock:
+                self._heads[chain] = cached
+        return cached[0]
+
+    @property
+    def store(self):
+        """ the process-wide CandleStore, its frame cache stays in memory between runs """
+        from utils.candle_store import CandleStore
+
+        if self._store is None:
+            self._store = CandleStore.default()
+        return self._store
+
+    def prices(self, tokens: Iterable[str]) -> Dict[str, Optional[float]]:
+        """ usd prices of tokens, the ones not fetched in the last price_ttl seconds are fetched concurrently
+
+        :return: upper-case token -> price, None when no exchange has it
+        """
+        from utils.token_price import get_token_price
+
+        tokens = list(dict.fromkeys(t.upper() for t in tokens))
+        now = time.time()
+        with self._lock:
+            missing = [t for t in tokens if t != 'USD' and now - self._prices.get(t, (None, 0.0))[1] > self.price_ttl]
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                fetched = list(pool.map(get_token_price, missing))
+            with self._lock:
+                self._prices.update({t: (p, now) for t, p in zip(missing, fetched)})
+        logger.debug('{} prices, {} fetched', len(tokens), len(missing))
+        with self._lock:
+            return {t: 1.0 if t == 'USD' else self._prices[t][0] for t in tokens}
+
+
+def _require(table: pd.DataFrame, *columns: str) -> None:
+    missing = [c for c in columns if c not in table.columns]
+    if missing:
+        raise ValueError(f"input is missing columns {missing}")
+
+
+# commands: command(ctx, input table, **options) -> output table
+
+
+def prices_fetch(ctx: Context, table: pd.DataFrame) -> pd.DataFrame:
+    """ input: token. output: token, price, fetched_at """
+    _require(table, 'token')
+    prices = ctx.prices(table['token'].astype(str))
+    return pd.DataFrame({'token': list(prices), 'price': list(prices.values()),
+                         'fetched_at': pd.Timestamp.now(tz='UTC')})
+
+
+def portfolio_snapshot(ctx: Context, table: pd.DataFrame) -> pd.DataFrame:
+    """ input: token, amount, optionally address. output: portfolio_token_analysis, one row per token """
+    from analytics.portfolio import portfolio_token_analysis
+
+    _require(table, 'token', 'amount')
+    table = table.assign(token=table['token'].astype(str).str.upper())
+    if 'address' not in table.columns:
+        table = table.assign(address='all')
+    prices = ctx.prices(table['token'])
+    df = portfolio_token_analysis(table[['token', 'address', 'amount']].values.tolist(), prices)
+    return df.assign(snapshot_at=pd.Timestamp.now(tz='UTC'))
+
+
+def pools_price(ctx: Context, table: pd.DataFrame) -> pd.DataFrame:
+    """ input: address, optionally chain (default eth) and version (v2 / v3, default v2).
+    output: the input with block and price, the pools of a chain are read in one multicall at one block """
+    from utils.pool import get_pool_prices
+
+    _require(table, 'address')
+    table = table.assign(chain=table['chain'].astype(str) if 'chain' in table.columns else 'eth',
+                         version=table['version'].astype(str).str.lower() if 'version' in table.columns else 'v2')
+    frames = []
+    for chain_name, pools in table.groupby('chain', sort=False):
+        chain = Chain.from_string(chain_name)
+        client, block = ctx.client(chain), ctx.head(chain)
+        prices = get_pool_prices(client, list(zip(pools['address'], pools['version'])), block_identifier=block)
+        frames.append(pools.assign(block=block, price=prices))
+    return pd.concat(frames, ignore_index=True) if frames else table.assign(block=None, price=None)
+
+
+def grid_backtest(ctx: Context, table: pd.DataFrame, interval: str = '1h', limit: int = 1000) -> pd.DataFrame:
+    """ input: symbol (token such as BTC), upper_price, lower_price, grid_number, total_invest, optionally
+    grid_type. output: the input with the backtest results, candles of each symbol are loaded once """
+    from strategy.grid_backtest import backtest_grid, candles_to_array
+    from strategy.grid_trading import GridConfig
+
+    _require(table, 'symbol', 'upper_price', 'lower_price', 'grid_number', 'total_invest')
+    candles = {s: candles_to_array(ctx.store.candles(s, interval, limit=limit))
+               for s in table['symbol'].astype(str).str.upper().unique()}
+    rows = []
+    for row in table.to_dict('records'):
+        config = GridConfig(row['symbol'], float(row['upper_price']), float(row['lower_price']),
+                            int(row['grid_number']), float(row['total_invest']),
+                            grid_type=row.get('grid_type') if isinstance(row.get('grid_type'), str) else 'arithmetic')
+        result = backtest_grid(config, candles[str(row['symbol']).upper()])
+        rows.append(dict(row, total_return=result.total_return, max_drawdown=result.max_drawdown,
+                         turnover=result.turnover, trades=result.trades, final_equity=result.final_equity))
+    return pd.DataFrame(rows)
+
+
+# command name -> (function, option name -> type)
+COMMANDS: Dict[str, Tuple[Callable[..., pd.DataFrame], Dict[str, type]]] = {
+    'prices fetch': (prices_fetch, {}),
+    'portfolio snapshot': (portfolio_snapshot, {}),
+    'pools price': (pools_price, {}),
+    'grid backtest': (grid_backtest, {'interval': str, 'limit': int}),
+}
+
+
+def run_job(ctx: Context, command: str, input_path: str, output_path: Optional[str] = None,
+            **options) -> Optional[str]:
+    """ :return: the output path written """
+    fn, types = COMMANDS[command]
+    options = {k: types[k](v) for k, v in options.items() if k in types and v is not None and not pd.isna(v)}
+    start = time.time()
+    df = fn(ctx, read_table(input_path), **options)
+    path = write_table(df, output_path)
+    logger.info('{} {} -> {} rows in {:.2f}s', command, input_path, len(df), time.time() - start)
+    return path
+
+
+def run_batch(ctx: Context, jobs: pd.DataFrame) -> List[str]:
+    """ run every job of a jobs table in order, a failed job is logged and the rest still run
+
+    :return: the commands that failed
+    """
+    _require(jobs, 'command', 'input')
+    failed = []
+    for job in jobs.to_dict('records'):
+        command, input_path = str(job.pop('command')).strip(), job.pop('input')
+        output = job.pop('output', None)
+        try:
+            run_job(ctx, command, input_path, output if isinstance(output, str) else None, **job)
+        except Exception as e:
+            logger.exception('job {} {} failed: {}', command, input_path, e)
+            failed.append(command)
+    return failed
+
+
+def daemon(ctx: Context, jobs_path: str, every: float, runs: Optional[int] = None) -> None:
+    """ run the jobs file every `every` seconds on the same Context until SIGINT / SIGTERM or runs runs,
+    the jobs file is read again on every run so it can be edited while the daemon is up """
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    count = 0
+    while not stop.is_set():
+        start = time.time()
+        failed = run_batch(ctx, read_table(jobs_path))
+        count += 1
+        logger.info('run {} done in {:.2f}s, {} jobs failed', count, time.time() - start, len(failed))
+        if runs is not None and count >= runs:
+            break
+        # runs start on multiples of every, a slow run skips the ticks it overran
+        stop.wait(every - (time.time() % every))
+
+
+def refresh(ctx: Context, config_path: str, every: Optional[float] = None, runs: Optional[int] = None,
+            out: Optional[str] = None, fmt: str = 'parquet', state: Optional[str] = None) -> int:
+    """ refresh the jobs.refresh dag of a config once, or every `every` seconds like daemon
+
+    :param out: directory the computed node results are written to, one file per node
+    :param state: dag state database, default $DAG_STATE_PATH
+    :return: number of nodes failed or blocked in the last refresh
+    """
+    from jobs.refresh import Refresh, load_config, write_results
+
+    dag = Refresh(load_config(config_path)).dag(path=state)
+    stop = threading.Event()
+    if every:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+    count, failed = 0, 0
+    while not stop.is_set():
+        status = dag.run(ctx)
+        failed = sum(s in ('failed', 'blocked') for s in status.values())
+        if out:
+            write_results(dag, status, out, fmt)
+        count += 1
+        if not every or (runs is not None and count >= runs):
+            break
+        stop.wait(every - (time.time() % every))
+    return failed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m jobs.cli', description='batch jobs over csv / parquet files')
+    parser.add_argument('--price-ttl', type=float, default=30, help='seconds a fetched price is reused')
+    groups = parser.add_subparsers(dest='group', required=True)
+    subparsers: Dict[str, argparse._SubParsersAction] = {}
+    for command, (fn, types) in COMMANDS.items():
+        group, action = command.split(' ')
+        if group not in subparsers:
+            subparsers[group] = groups.add_parser(group).add_subparsers(dest='action', required=True)
+        sub = subparsers[group].add_parser(action, help=(fn.__doc__ or '').strip().split('\n')[0])
+        sub.add_argument('-i', '--input', required=True, help='csv / parquet / json file, - for csv on stdin')
+        sub.add_argument('-o', '--output', help='csv / parquet / json file, {time} is the run time, default stdout')
+        for name, kind in types.items():
+            sub.add_argument(f'--{name}', type=kind)
+    batch = groups.add_parser('batch', help='run every job of a jobs file in one process')
+    batch.add_argument('jobs')
+    run = groups.add_parser('daemon', help='run a jobs file on a schedule, keeping clients and caches warm')
+    run.add_argument('jobs')
+    run.add_argument('--every', type=float, default=60, help='seconds between runs')
+    run.add_argument('--runs', type=int, help='stop after this many runs')
+    run.add_argument('--metrics-port', type=int, help='serve utils.metrics on this port')
+    dag = groups.add_parser('refresh', help='incremental refresh of prices, balances, pools and lst rates')
+    dag.add_argument('config', help='json config, see jobs.refresh')
+    dag.add_argument('--every', type=float, help='seconds between refreshes, default refresh once')
+    dag.add_argument('--runs', type=int, help='stop after this many refreshes')
+    dag.add_argument('--out', help='directory for the node results computed by a refresh')
+    dag.add_argument('--format', default='parquet', choices=['parquet', 'csv', 'json'])
+    dag.add_argument('--state', help='dag state database, default $DAG_STATE_PATH')
+    args = parser.parse_args(argv)
+
+    ctx = Context(price_ttl=args.price_ttl)
+    if args.group == 'batch':
+        return 1 if run_batch(ctx, read_table(args.jobs)) else 0
+    if args.group == 'daemon':
+        if args.metrics_port:
+            from utils import metrics
+            metrics.enable()
+            metrics.REGISTRY.serve(args.metrics_port)
+        daemon(ctx, args.jobs, args.every, args.runs)
+        return 0
+    if args.group == 'refresh':
+        return 1 if refresh(ctx, args.config, args.every, args.runs, args.out, args.format, args.state) else 0
+    command = f'{args.group} {args.action}'
+    options = {name: getattr(args, name) for name in COMMANDS[command][1]}
+    run_job(ctx, command, args.input, args.output, **options)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
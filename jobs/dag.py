@@ -0,0 +1,201 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import pandas as pd
+from loguru import logger
+
+from utils.env import getenv
+
+DEFAULT_DAG_STATE = os.path.join(os.path.expanduser('~'), '.cache', 'web3-analytics', 'dag.sqlite')
+
+COMPUTED, SKIPPED, FAILED, BLOCKED = 'computed', 'skipped', 'failed', 'blocked'
+
+
+def row_hashes(df: pd.DataFrame) -> pd.Series:
+    """ one uint64 hash per row (index included), labelled by the index of df """
+    return pd.util.hash_pandas_object(df, index=True)
+
+
+def changed_rows(new: pd.Series, old: Optional[pd.Series]) -> pd.Index:
+    """ index labels of rows added or changed between two row_hashes, removed rows are left out """
+    if old is None:
+        return new.index
+    common = new.index.isin(old.index)
+    same = pd.Series(False, index=new.index)
+    same[common] = new[common].to_numpy() == old.reindex(new.index[common]).to_numpy()
+    return new.index[~same.to_numpy()]
+
+
+class Node:
+    """ one step of a Dag: a dataframe computed from the results of its deps """
+    __slots__ = ["name", "fn", "deps", "stamp"]
+
+    def __init__(self, name: str, fn: Callable[[Any, 'NodeRun'], pd.DataFrame], deps: Sequence[str] = (),
+                 stamp: Optional[Callable[[Any], str]] = None):
+        """
+        :param fn: fn(ctx, run) returning the result, with a unique index
+        :param deps: names of the nodes whose results are inputs
+        :param stamp: stamp(ctx) such as the head block or the current time tick, the node runs again when it
+                      moves. without a stamp the node only runs when an input changed
+        """
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.stamp = stamp
+
+    def __repr__(self):
+        return f"Node({self.name} <- {list(self.deps)})"
+
+
+class NodeRun:
+    """ what a node function gets: its inputs, what changed in them since its last run, and its last result """
+    __slots__ = ["name", "inputs", "changed", "previous", "stamp"]
+
+    def __init__(self, name: str, inputs: Dict[str, pd.DataFrame], changed: Dict[str, pd.Index],
+                 previous: Optional[pd.DataFrame], stamp: str):
+        self.name = name
+        self.inputs = inputs
+        # dep -> index labels of rows added or changed, all rows when the node never ran
+        self.changed = changed
+        self.previous = previous
+        self.stamp = stamp
+
+
+class Dag:
+    """
+    incremental refresh of dependent dataframes
+
+    nodes run as soon as their deps are done, independent nodes side by side on a thread pool. a node is only run
+    when its stamp moved (new block, new tick) or rows of its inputs were added, changed or removed, and then gets
+    the changed rows of every input so it can update its last result instead of recomputing it. removed rows are
+    not listed, a node drops them by reindexing to its inputs. results, row hashes and stamps are kept in sqlite,
+    a refresh in a new process (such as a cron job) starts from the last state and only pays for the delta. a failed
+    node keeps its last result and the nodes depending on it are not run
+    """
+
+    def __init__(self, nodes: Iterable[Node], path: Optional[str] = None, max_workers: int = 4):
+        """
+        :param path: state database, default $DAG_STATE_PATH or ~/.cache/web3-analytics/dag.sqlite
+        """
+        self.nodes = {n.name: n for n in nodes}
+        self.order = self._topological_order()
+        self.max_workers = max_workers
+        path = path or getenv('DAG_STATE_PATH', DEFAULT_DAG_STATE)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS dag_state ('
+                           'node TEXT NOT NULL PRIMARY KEY, stamp TEXT, state BLOB NOT NULL, updated_at REAL)')
+        self._conn.commit()
+        self._stamps: Dict[str, str] = {}
+        # node -> {'result': dataframe, 'hashes': row hashes, 'consumed': dep -> row hashes of the input used}
+        self._states: Dict[str, dict] = {}
+        for node, stamp, state in self._conn.execute('SELECT node, stamp, state FROM dag_state'):
+            if node in self.nodes:
+                self._stamps[node] = stamp
+                self._states[node] = pickle.loads(state)
+
+    def _topological_order(self) -> List[str]:
+        for node in self.nodes.values():
+            unknown = [d for d in node.deps if d not in self.nodes]
+            if unknown:
+                raise ValueError(f"{node.name} depends on unknown nodes {unknown}")
+        order, done, visiting = [], set(), set()
+
+        def visit(name: str) -> None:
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"dependency cycle through {name}")
+            visiting.add(name)
+            for dep in self.nodes[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.nodes:
+            visit(name)
+        return order
+
+    def result(self, name: str) -> Optional[pd.DataFrame]:
+        """ last result of a node, also from an earlier process """
+        state = self._states.get(name)
+        return None if state is None else state['result']
+
+    def _save(self, name: str, stamp: str, state: dict) -> None:
+        blob = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._stamps[name] = stamp
+            self._states[name] = state
+            self._conn.execute('INSERT OR REPLACE INTO dag_state VALUES (?, ?, ?, ?)', (name, stamp, blob, time.time()))
+            self._conn.commit()
+
+    def _run_node(self, ctx, name: str) -> str:
+        node = self.nodes[name]
+        stamp = str(node.stamp(ctx)) if node.stamp is not None else ''
+        state = self._states.get(name)
+        consumed = state['consumed'] if state is not None else {}
+        inputs, changed, removed = {}, {}, False
+        for dep in node.deps:
+            dep_state = self._states[dep]
+            inputs[dep] = dep_state['result']
+            changed[dep] = changed_rows(dep_state['hashes'], consumed.get(dep))
+            old = consumed.get(dep)
+            removed = removed or (old is not None and not old.index.isin(dep_state['hashes'].index).all())
+        if (state is not None and stamp == self._stamps.get(name) and not removed
+                and not any(len(c) for c in changed.values())):
+            return SKIPPED
+        previous = state['result'] if state is not None else None
+        result = node.fn(ctx, NodeRun(name, inputs, changed, previous, stamp))
+        if not result.index.is_unique:
+            raise ValueError(f"result of {name} has a duplicated index")
+        self._save(name, stamp, {'result': result, 'hashes': row_hashes(result),
+                                 'consumed': {dep: self._states[dep]['hashes'] for dep in node.deps}})
+        return COMPUTED
+
+    def run(self, ctx=None, targets: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """ refresh targets and everything they depend on, default every node
+
+        :return: node -> computed / skipped / failed / blocked (a dep failed)
+        """
+        wanted = set()
+        stack = list(targets) if targets is not None else list(self.nodes)
+        while stack:
+            name = stack.pop()
+            if name not in wanted:
+                wanted.add(name)
+                stack.extend(self.nodes[name].deps)
+        status: Dict[str, str] = {}
+        running: Dict[Future, str] = {}
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while len(status) < len(wanted):
+                for name in self.order:
+                    if name not in wanted or name in status or name in running.values():
+                        continue
+                    deps = [status.get(d) for d in self.nodes[name].deps]
+                    if any(s in (FAILED, BLOCKED) for s in deps):
+                        status[name] = BLOCKED
+                        logger.warning('{} not refreshed, a dependency failed', name)
+                    elif all(s is not None for s in deps):
+                        running[pool.submit(self._run_node, ctx, name)] = name
+                if not running:
+                    continue
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        status[name] = future.result()
+                    except Exception as e:
+                        logger.exception('{} failed: {}', name, e)
+                        status[name] = FAILED
+        logger.info('dag refreshed in {:.2f}s: {}', time.time() - start,
+                    ', '.join(f'{n} {status[n]}' for n in self.order if n in status))
+        return status
@@ -0,0 +1,175 @@
+"""
+the price / balance / pool / lst refresh as a Dag
+
+    prices ─────┐
+                ├─> valuations ─> portfolio
+    balances ───┘
+    pool_states
+    lst_rates
+
+prices move on every tick, balances and pool states on every new block, lst rates once a day. balances only
+scan the blocks since the last refresh and valuations only revalue the rows whose balance or price changed,
+so a minute-level refresh costs the delta rather than the whole universe
+
+config (json):
+    {"tokens": ["BTC", "ETH"], "addresses": ["0x..."], "chains": ["eth"], "start_block": 21000000,
+     "symbols": {"0xa0b8...": "USDC"}, "pools": [{"address": "0x...", "version": "v3", "chain": "eth"}],
+     "lst_days": 30, "tick": 60}
+"""
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from jobs.dag import Dag, Node, NodeRun
+from utils.chain import Chain
+
+DEFAULT_CONFIG = {'tokens': [], 'addresses': [], 'chains': ['eth'], 'start_block': 0, 'symbols': {}, 'pools': [],
+                  'lst_days': 30, 'tick': 60}
+
+
+def load_config(path: str) -> dict:
+    with open(path) as f:
+        return dict(DEFAULT_CONFIG, **json.load(f))
+
+
+class Refresh:
+    """ node functions of the refresh, bound to a config """
+
+    def __init__(self, config: dict, transfer_db: Optional[str] = None):
+        """ :param transfer_db: TransferIndexer database, default the indexer's """
+        self.config = dict(DEFAULT_CONFIG, **config)
+        self.chains = [Chain.from_string(c) for c in self.config['chains']]
+        self.symbols = {k.lower(): v.upper() for k, v in self.config['symbols'].items()}
+        self.transfer_db = transfer_db
+        self._indexer = None
+
+    @property
+    def indexer(self):
+        from analytics.transfers import DEFAULT_TRANSFER_DB, TransferIndexer
+
+        if self._indexer is None:
+            self._indexer = TransferIndexer(self.config['addresses'], path=self.transfer_db or DEFAULT_TRANSFER_DB)
+        return self._indexer
+
+    def dag(self, path: Optional[str] = None, max_workers: int = 4) -> Dag:
+        pool_chains = sorted({p.get('chain', 'eth') for p in self.config['pools']})
+        # editing the watched addresses moves the balances stamp even when no block passed
+        watched = hashlib.sha1(','.join(sorted(a.lower() for a in self.config['addresses'])).encode()).hexdigest()[:12]
+        return Dag([
+            Node('prices', self.prices, stamp=lambda ctx: int(time.time() // self.config['tick'])),
+            Node('balances', self.balances, stamp=lambda ctx: f'{self._heads(ctx, self.chains)}|{watched}'),
+            Node('pool_states', self.pool_states,
+                 stamp=lambda ctx: self._heads(ctx, [Chain.from_string(c) for c in pool_chains])),
+            Node('lst_rates', self.lst_rates, stamp=lambda ctx: datetime.now(timezone.utc).date().isoformat()),
+            Node('valuations', self.valuations, deps=['prices', 'balances']),
+            Node('portfolio', self.portfolio, deps=['valuations']),
+        ], path=path, max_workers=max_workers)
+
+    @staticmethod
+    def _heads(ctx, chains: List[Chain]) -> str:
+        return ','.join(f'{c.value}:{ctx.head(c)}' for c in chains)
+
+    # nodes
+
+    def prices(self, ctx, run: NodeRun) -> pd.DataFrame:
+        """ usd price per token symbol, of the configured tokens and of every mapped token contract """
+        universe = list(dict.fromkeys([t.upper() for t in self.config['tokens']] + list(self.symbols.values())))
+        prices = ctx.prices(universe)
+        return pd.DataFrame({'price': pd.Series(prices, dtype=float)}).rename_axis('symbol')
+
+    def balances(self, ctx, run: NodeRun) -> pd.DataFrame:
+        """ net balance per (chain, address, token contract), only transfers of new blocks are read again,
+        a change of the watched addresses recomputes every balance """
+        indexer = self.indexer
+        heads = {c: ctx.head(c) for c in self.chains}
+        for chain in self.chains:
+            indexer.update(chain, start_block=self.config['start_block'],
+                           to_block=heads[chain] - indexer.confirmations)
+        indexed = {c.value: indexer.last_block(c) for c in self.chains}
+        addresses = sorted(indexer.addresses)
+        previous = run.previous
+        known = previous.attrs.get('indexed', {}) if previous is not None else {}
+        if (previous is None or previous.attrs.get('addresses') != addresses
+                or any(known.get(c) is None for c in indexed)):
+            result = indexer.balances().set_index(['chain', 'address', 'token'])[['amount']]
+        else:
+            frames = [indexer.ledger(chain=Chain.from_string(c), from_block=known[c] + 1)
+                      for c in indexed if indexed[c] is not None and indexed[c] > known[c]]
+            frames = [f for f in frames if len(f)]
+            if frames:
+                delta = pd.concat(frames).groupby(['chain', 'address', 'token'])['amount'].sum()
+                amount = previous['amount'].add(delta, fill_value=0.0)
+                result = amount.to_frame('amount')
+            else:
+                result = previous.copy()
+        result.attrs['indexed'] = indexed
+        result.attrs['addresses'] = addresses
+        return result.sort_index()
+
+    def pool_states(self, ctx, run: NodeRun) -> pd.DataFrame:
+        """ price of every configured pool, the pools of a chain in one multicall at its head block """
+        from utils.pool import get_pool_prices
+
+        pools = pd.DataFrame(self.config['pools'], columns=['address', 'version', 'chain'])
+        pools = pools.fillna({'version': 'v2', 'chain': 'eth'})
+        frames = []
+        for chain_name, group in pools.groupby('chain', sort=False):
+            chain = Chain.from_string(chain_name)
+            block = ctx.head(chain)
+            prices = get_pool_prices(ctx.client(chain), list(zip(group['address'], group['version'])),
+                                     block_identifier=block)
+            frames.append(group.assign(block=block, price=prices))
+        if not frames:
+            return pd.DataFrame(columns=['version', 'chain', 'block', 'price'], index=pd.Index([], name='address'))
+        return pd.concat(frames).set_index('address')
+
+    def lst_rates(self, ctx, run: NodeRun) -> pd.DataFrame:
+        """ latest exchange rate and 7 day apr of every lst, days already in the LstRateStore are not read """
+        from analytics.eth_lst import apr, rate_history
+
+        history = rate_history(ctx.client(Chain.ETH), datetime.now() - timedelta(days=self.config['lst_days']))
+        if len(history) == 0:
+            return pd.DataFrame(columns=['rate', 'apr_7d'], index=pd.Index([], name='token'))
+        return pd.DataFrame({'rate': history.iloc[-1], 'apr_7d': apr(history, periods=7).iloc[-1]}).rename_axis('token')
+
+    def valuations(self, ctx, run: NodeRun) -> pd.DataFrame:
+        """ usd value per balance row, only rows whose balance or token price changed are revalued """
+        balances, prices = run.inputs['balances'], run.inputs['prices']['price']
+        symbols = balances.index.get_level_values('token').str.lower().map(self.symbols)
+        table = balances.assign(symbol=symbols)
+        previous = run.previous
+        if previous is None:
+            todo = table
+        else:
+            changed_prices = set(run.changed['prices'])
+            dirty = table.index.isin(run.changed['balances']) | table['symbol'].isin(changed_prices)
+            todo = table[dirty]
+        valued = todo.assign(price=todo['symbol'].map(prices).astype(float))
+        valued['value'] = valued['amount'] * valued['price']
+        if previous is None:
+            return valued
+        kept = previous[previous.index.isin(table.index) & ~previous.index.isin(valued.index)]
+        return pd.concat([kept, valued]).sort_index()
+
+    def portfolio(self, ctx, run: NodeRun) -> pd.DataFrame:
+        """ amount and value per token symbol over all chains and addresses, with its share of the total """
+        valuations = run.inputs['valuations'].dropna(subset=['symbol'])
+        df = valuations.groupby('symbol')[['amount', 'value']].sum()
+        total = df['value'].sum()
+        df['pct'] = df['value'] / total if total else 0.0
+        return df.sort_values('value', ascending=False)
+
+
+def write_results(dag: Dag, status: Dict[str, str], directory: str, fmt: str = 'parquet') -> None:
+    """ write the results of the nodes computed in this refresh to directory/<node>.<fmt> """
+    from jobs.tables import write_table
+
+    for name, state in status.items():
+        result = dag.result(name)
+        if state == 'computed' and result is not None:
+            write_table(result.reset_index(), os.path.join(directory, f'{name}.{fmt}'))
@@ -0,0 +1,55 @@
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+import pandas as pd
+
+# file extension -> format, parquet needs pyarrow (or fastparquet)
+FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet', '.json': 'json', '.jsonl': 'json'}
+
+
+def table_format(path: str) -> str:
+    fmt = FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f"unsupported table file {path}, use one of {sorted(FORMATS)}")
+    return fmt
+
+
+def read_table(path: str) -> pd.DataFrame:
+    """ csv, parquet or json lines file as a dataframe, '-' reads csv from stdin """
+    if path == '-':
+        return pd.read_csv(sys.stdin)
+    fmt = table_format(path)
+    if fmt == 'csv':
+        return pd.read_csv(path)
+    if fmt == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_json(path, lines=path.endswith('.jsonl'))
+
+
+def output_path(path: str, now: Optional[datetime] = None) -> str:
+    """ fill the {time} placeholder of an output path, e.g. prices-{time}.parquet keeps one file per daemon run """
+    now = now or datetime.now(timezone.utc)
+    return path.replace('{time}', now.strftime('%Y%m%dT%H%M%S'))
+
+
+def write_table(df: pd.DataFrame, path: Optional[str] = None) -> Optional[str]:
+    """ write df by the extension of path, parquet keeps the columns typed, no path prints it
+
+    :return: the path written, after output_path
+    """
+    if not path or path == '-':
+        print(df.to_string(index=False))
+        return None
+    path = output_path(path)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    fmt = table_format(path)
+    if fmt == 'csv':
+        df.to_csv(path, index=False)
+    elif fmt == 'parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.to_json(path, orient='records', lines=path.endswith('.jsonl'), date_format='iso')
+    return path
@@ -0,0 +1,241 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Set, Tuple
+
+from strategy.order_book import GridOrder, BUY, SELL
+from utils.dex.backpack import PAGE_SIZE
+from utils.dex.backpack_async import is_error, order_params
+
+logger = logging.getLogger("ExchangeAdapter")
+
+
+class ExchangeAdapter(ABC):
+    """交易所适配器接口, 由 GridExecutor 批量调用"""
+
+    @abstractmethod
+    def place_orders(self, orders: List[GridOrder]) -> List[Optional[str]]:
+        """批量下单, 按顺序返回交易所订单号, 失败的位置返回 None"""
+
+    @abstractmethod
+    def cancel_orders(self, exchange_ids: List[str]) -> None:
+        """批量撤单"""
+
+    @abstractmethod
+    def on_tick(self, price: float) -> List[str]:
+        """推送最新价格, 返回自上次调用以来完全成交的交易所订单号"""
+
+    @abstractmethod
+    def open_order_ids(self) -> List[str]:
+        """查询交易所当前的全部挂单号"""
+
+    def resume(self, exchange_ids: List[str]) -> None:
+        """重启后恢复需要跟踪成交的挂单"""
+
+
+class BackpackAdapter(ExchangeAdapter):
+    """
+    Backpack 适配器
+
+    通过 BpxClient.ExeOrder / orderCancel 下单撤单, 每隔 poll_interval 秒用 ordersQuery 查询挂单,
+    已下单但不在挂单列表里的订单再到订单历史里确认状态: Filled 视为成交, 在外部撤销或过期的订单停止跟踪,
+    历史里还查不到的订单继续跟踪 (不处理部分成交)
+    """
+    SIDES = {BUY: 'Bid', SELL: 'Ask'}
+    CLOSED = ('Cancelled', 'Expired')
+
+    def __init__(self, client, symbol: str, time_in_force: str = 'GTC', poll_interval: float = 1.0,
+                 history_depth: int = 1000):
+        """
+        :param history_depth: 确认订单状态时最多读取的订单历史条数
+        """
+        self.client = client
+        self.symbol = symbol
+        self.time_in_force = time_in_force
+        self.poll_interval = poll_interval
+        self.history_depth = history_depth
+        self._open: Set[str] = set()
+        self._last_poll = 0.0
+
+    def place_orders(self, orders: List[GridOrder]) -> List[Optional[str]]:
+        exchange_ids = []
+        for order in orders:
+            try:
+                data = self.client.ExeOrder(self.symbol, self.SIDES[order.side], 'Limit', self.time_in_force,
+                                            str(order.amount), str(order.price)).json()
+                exchange_id = data.get('id')
+                if exchange_id is None:
+                    logger.error(f"下单失败: {order}, {data}")
+            except Exception as e:
+                logger.error(f"下单失败: {order}, {e}")
+                exchange_id = None
+            if exchange_id is not None:
+                self._open.add(exchange_id)
+            exchange_ids.append(exchange_id)
+        return exchange_ids
+
+    def cancel_orders(self, exchange_ids: List[str]) -> None:
+        for exchange_id in exchange_ids:
+            try:
+                self.client.orderCancel(self.symbol, exchange_id)
+            except Exception as e:
+                logger.error(f"撤单失败: {exchange_id}, {e}")
+            self._open.discard(exchange_id)
+
+    def on_tick(self, price: float) -> List[str]:
+        now = time.time()
+        if not self._open or now - self._last_poll < self.poll_interval:
+            return []
+        self._last_poll = now
+        open_orders = self.client.ordersQuery(self.symbol)
+        if not isinstance(open_orders, list):
+            logger.error(f"查询挂单失败: {open_orders}")
+            return []
+        missing = self._open - {o['id'] for o in open_orders}
+        if not missing:
+            return []
+        filled, closed = self._confirm(missing)
+        self._open.difference_update(filled + closed)
+        return filled
+
+    def _confirm(self, missing: Set[str]) -> Tuple[List[str], List[str]]:
+        """在订单历史里确认不在挂单列表里的订单, 返回 (完全成交, 撤销或过期) 的订单号"""
+        filled, closed = [], []
+        try:
+            if self.history_depth <= PAGE_SIZE:
+                # 一页就够时只发一次请求, 不预取下一页
+                orders = self.client.orderHistoryQuery(self.symbol, self.history_depth, 0)
+                if not isinstance(orders, list):
+                    raise ValueError(orders)
+            else:
+                orders = itertools.islice(self.client.iterOrderHistory(self.symbol), self.history_depth)
+            for order in orders:
+                exchange_id = order.get('id')
+                if exchange_id not in missing:
+                    continue
+                if order.get('status') == 'Filled':
+                    filled.append(exchange_id)
+                elif order.get('status') in self.CLOSED:
+                    logger.warning(f"订单 {exchange_id} 已在外部{order['status']}, 停止跟踪")
+                    closed.append(exchange_id)
+                if len(filled) + len(closed) == len(missing):
+                    break
+        except Exception as e:
+            logger.error(f"查询订单历史失败: {e}")
+        return filled, closed
+
+    def open_order_ids(self) -> List[str]:
+        open_orders = self.client.ordersQuery(self.symbol)
+        if not isinstance(open_orders, list):
+            raise ValueError(f"查询挂单失败: {open_orders}")
+        return [o['id'] for o in open_orders]
+
+    def resume(self, exchange_ids: List[str]) -> None:
+        self._open.update(exchange_ids)
+
+
+class AsyncBackpackAdapter(BackpackAdapter):
+    """
+    并发下单的 Backpack 适配器
+
+    每次 flush 的整批订单通过 AsyncBpxClient 的批量下单接口并发提交, 撤单也并发发送,
+    由适配器自己的事件循环驱动, 成交检测沿用 BackpackAdapter 的挂单轮询
+    """
+
+    def __init__(self, client, symbol: str, time_in_force: str = 'GTC', poll_interval: float = 1.0,
+                 history_depth: int = 1000):
+        super().__init__(client, symbol, time_in_force, poll_interval, history_depth)
+        self._loop = asyncio.new_event_loop()
+
+    def place_orders(self, orders: List[GridOrder]) -> List[Optional[str]]:
+        params = [order_params(self.symbol, self.SIDES[o.side], o.amount, o.price, time_in_force=self.time_in_force)
+                  for o in orders]
+        results = self._loop.run_until_complete(self.client.place_orders(params))
+        exchange_ids = []
+        for order, result in zip(orders, results):
+            if is_error(result):
+                logger.error(f"下单失败: {order}, {result}")
+                exchange_ids.append(None)
+            else:
+                self._open.add(result['id'])
+                exchange_ids.append(result['id'])
+        return exchange_ids
+
+    def cancel_orders(self, exchange_ids: List[str]) -> None:
+        results = self._loop.run_until_complete(self.client.cancel_orders(self.symbol, exchange_ids))
+        for exchange_id, result in zip(exchange_ids, results):
+            if is_error(result):
+                logger.error(f"撤单失败: {exchange_id}, {result}")
+            self._open.discard(exchange_id)
+
+    def close(self) -> None:
+        self._loop.run_until_complete(self.client.close())
+        self._loop.close()
+
+
+class SimulatedExchange(ExchangeAdapter):
+    """
+    进程内撮合模拟器
+
+    买单放在按价格降序的堆里, 卖单放在按价格升序的堆里, 每个 tick 只弹出被穿越的订单,
+    撤单采用惰性删除, 堆里已撤销的条目多于挂单时重建堆, 用于本地测试和压测
+    """
+
+    def __init__(self):
+        self._bids: List[Tuple[float, int, str]] = []
+        self._asks: List[Tuple[float, int, str]] = []
+        self._open: Dict[str, GridOrder] = {}
+        self._seq = itertools.count(1)
+        self.placed = 0
+        self.cancelled = 0
+        self.filled = 0
+
+    def place_orders(self, orders: List[GridOrder]) -> List[Optional[str]]:
+        exchange_ids = []
+        for order in orders:
+            seq = next(self._seq)
+            exchange_id = f"sim-{seq}"
+            if order.side == BUY:
+                heapq.heappush(self._bids, (-order.price, seq, exchange_id))
+            else:
+                heapq.heappush(self._asks, (order.price, seq, exchange_id))
+            self._open[exchange_id] = order
+            exchange_ids.append(exchange_id)
+        self.placed += len(orders)
+        return exchange_ids
+
+    def cancel_orders(self, exchange_ids: List[str]) -> None:
+        for exchange_id in exchange_ids:
+            if self._open.pop(exchange_id, None) is not None:
+                self.cancelled += 1
+        if len(self._bids) + len(self._asks) > 2 * len(self._open):
+            self._compact()
+
+    def _compact(self) -> None:
+        """丢弃堆里已撤销的订单, 网格反复重建时堆不会无限增长"""
+        self._bids = [e for e in self._bids if e[2] in self._open]
+        self._asks = [e for e in self._asks if e[2] in self._open]
+        heapq.heapify(self._bids)
+        heapq.heapify(self._asks)
+
+    def on_tick(self, price: float) -> List[str]:
+        filled = []
+        while self._bids and -self._bids[0][0] >= price:
+            _, _, exchange_id = heapq.heappop(self._bids)
+            if self._open.pop(exchange_id, None) is not None:
+                filled.append(exchange_id)
+        while self._asks and self._asks[0][0] <= price:
+            _, _, exchange_id = heapq.heappop(self._asks)
+            if self._open.pop(exchange_id, None) is not None:
+                filled.append(exchange_id)
+        self.filled += len(filled)
+        return filled
+
+    def open_order_ids(self) -> List[str]:
+        return list(self._open)
+
+    def open_orders(self) -> List[GridOrder]:
+        return list(self._open.values())
@@ -0,0 +1,96 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from strategy.grid_layout import build_layout
+from strategy.grid_trading import GridConfig
+
+
+@dataclass
+class GridBacktestResult:
+    """网格回测结果"""
+    total_return: float        # 总收益率
+    max_drawdown: float        # 最大回撤(正数)
+    turnover: float            # 成交额 / 总投资额
+    trades: int                # 成交笔数
+    final_equity: float        # 期末权益
+
+
+def candles_to_array(df: pd.DataFrame) -> np.ndarray:
+    """把K线DataFrame转换成 (4, n) 的 open/high/low/close 连续数组"""
+    return np.ascontiguousarray(
+        df.loc[:, ['open', 'high', 'low', 'close']].astype(float).to_numpy().T
+    )
+
+
+def backtest_grid(config: GridConfig, candles: np.ndarray) -> GridBacktestResult:
+    """
+    基于K线的网格回测
+
+    支持 GridConfig.grid_type 的所有网格类型 (不做自动重建),
+    每个网格 i 对应区间 [p_i, p_{i+1}], 空仓时在 p_i 挂买单, 持仓时在 p_{i+1} 挂卖单;
+    开盘价上方的网格在第一根K线开盘时按开盘价建仓, 与 GridTrading.place_grid_orders 的挂单方式对应。
+    阳线按 开->低->高->收 撮合, 阴线按 开->高->低->收 撮合。
+
+    :param config: 网格配置
+    :param candles: (4, n) 的 open/high/low/close 数组, 见 candles_to_array
+    :return: GridBacktestResult
+    """
+    opens, highs, lows, closes = candles
+    prices = build_layout(config).prices
+    buy_prices = prices[:-1]
+    sell_prices = prices[1:]
+    amounts = np.round(config.total_invest / config.grid_number / buy_prices, config.size_precision)
+
+    # 持仓的网格总是一段后缀 [k, grid_number), 只需维护 k 和前缀和即可 O(1) 结算每根K线
+    cum_qty = np.concatenate(([0.0], np.cumsum(amounts))).tolist()
+    cum_buy = np.concatenate(([0.0], np.cumsum(amounts * buy_prices))).tolist()
+    cum_sell = np.concatenate(([0.0], np.cumsum(amounts * sell_prices))).tolist()
+    buy_idx = np.searchsorted(buy_prices, lows, side='left').tolist()
+    sell_idx = np.searchsorted(sell_prices, highs, side='right').tolist()
+    bullish = (closes >= opens).tolist()
+
+    n = config.grid_number
+    k = int(np.searchsorted(buy_prices, opens[0], side='right')) if len(opens) else n
+    position = cum_qty[n] - cum_qty[k]
+    cash = config.total_invest - position * float(opens[0]) if len(opens) else config.total_invest
+    traded = config.total_invest - cash
+    trades = n - k
+
+    cash_curve = np.empty(len(closes))
+    position_curve = np.empty(len(closes))
+    for t in range(len(closes)):
+        for is_buy in ((True, False) if bullish[t] else (False, True)):
+            if is_buy:
+                lo = buy_idx[t]
+                if lo < k:
+                    notional = cum_buy[k] - cum_buy[lo]
+                    cash -= notional
+                    position += cum_qty[k] - cum_qty[lo]
+                    traded += notional
+                    trades += k - lo
+                    k = lo
+            else:
+                hi = sell_idx[t]
+                if hi > k:
+                    notional = cum_sell[hi] - cum_sell[k]
+                    cash += notional
+                    position -= cum_qty[hi] - cum_qty[k]
+                    traded += notional
+                    trades += hi - k
+                    k = hi
+        cash_curve[t] = cash
+        position_curve[t] = position
+
+    equity = cash_curve + position_curve * closes
+    peak = np.maximum.accumulate(np.maximum(equity, config.total_invest))
+    max_drawdown = float(np.max(1 - equity / peak)) if len(equity) else 0.0
+    final_equity = float(equity[-1]) if len(equity) else config.total_invest
+    return GridBacktestResult(
+        total_return=final_equity / config.total_invest - 1,
+        max_drawdown=max_drawdown,
+        turnover=traded / config.total_invest,
+        trades=trades,
+        final_equity=final_equity,
+    )
@@ -0,0 +1,153 @@
+import logging
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List
+
+import numpy as np
+
+from strategy.exchange_adapter import ExchangeAdapter
+from strategy.grid_trading import GridTrading
+from strategy.order_book import GridOrder, PENDING, CANCELLED
+
+logger = logging.getLogger("GridExecutor")
+
+
+class GridExecutor:
+    """
+    tick 驱动的网格执行循环
+
+    订阅 GridTrading 订单簿的事件, 每个 tick 先把成交回报同步到 GridTrading,
+    再把本 tick 内新增的挂单和撤单一次性批量提交给交易所适配器, 并记录每个 tick 的处理耗时
+    """
+
+    def __init__(self, grid: GridTrading, adapter: ExchangeAdapter, latency_window: int = 100000):
+        self.grid = grid
+        self.adapter = adapter
+        self.exchange_ids: Dict[int, str] = {}  # 本地订单号 -> 交易所订单号
+        self._local_ids: Dict[str, int] = {}    # 交易所订单号 -> 本地订单号
+        self._to_place: List[GridOrder] = []
+        self._to_cancel: List[GridOrder] = []
+        self.latencies: Deque[float] = deque(maxlen=latency_window)
+        self.ticks = 0
+        self.started = False
+        self._ack_listeners: List[Callable[[int, str], None]] = []
+        grid.orders.subscribe(self._on_order_event)
+
+    def subscribe_ack(self, listener: Callable[[int, str], None]) -> None:
+        """注册交易所确认下单的回调 listener(order_id, exchange_id)"""
+        self._ack_listeners.append(listener)
+
+    def _on_order_event(self, status: str, order: GridOrder) -> None:
+        if status == PENDING:
+            self._to_place.append(order)
+        elif status == CANCELLED:
+            self._to_cancel.append(order)
+
+    def flush(self) -> None:
+        """批量提交待撤和待挂订单"""
+        if self._to_cancel:
+            cancels, self._to_cancel = self._to_cancel, []
+            exchange_ids = [self.exchange_ids.pop(o.order_id) for o in cancels if o.order_id in self.exchange_ids]
+            for exchange_id in exchange_ids:
+                del self._local_ids[exchange_id]
+            if exchange_ids:
+                self.adapter.cancel_orders(exchange_ids)
+
+        if self._to_place:
+            places, self._to_place = self._to_place, []
+            orders = [o for o in places if o.status == PENDING]
+            for order, exchange_id in zip(orders, self.adapter.place_orders(orders)):
+                if exchange_id is None:
+                    logger.warning(f"订单未被交易所接受, 本地撤销: {order}")
+                    self.grid.orders.cancel(order.order_id)
+                    continue
+                self.exchange_ids[order.order_id] = exchange_id
+                self._local_ids[exchange_id] = order.order_id
+                for listener in self._ack_listeners:
+                    listener(order.order_id, exchange_id)
+
+    def reconcile(self, exchange_ids: Dict[int, str]) -> None:
+        """
+        重启后与交易所对账
+
+        exchange_ids 为持久化的 本地订单号 -> 交易所订单号, 只查询一次当前挂单:
+        已确认的订单继续跟踪, 其中不在挂单列表里的可能已成交, 也可能已在外部撤销或过期,
+        交给适配器在下一个 tick 确认, 不直接按成交处理; 未确认的订单重新提交
+        """
+        open_ids = set(self.adapter.open_order_ids())
+        missing = 0
+        for order in list(self.grid.orders.active_orders()):
+            exchange_id = exchange_ids.get(order.order_id)
+            if exchange_id is None:
+                self._to_place.append(order)
+                continue
+            missing += exchange_id not in open_ids
+            self.exchange_ids[order.order_id] = exchange_id
+            self._local_ids[exchange_id] = order.order_id
+        if missing:
+            logger.info(f"{missing} 个已确认订单不在挂单列表里, 等待下一个 tick 确认状态")
+        self.adapter.resume(list(self._local_ids))
+        self.started = len(self.grid.orders) > 0
+        self.flush()
+
+    def on_tick(self, price: float) -> None:
+        """处理一个价格 tick"""
+        start = time.perf_counter()
+        if not self.started:
+            # 价格不在网格范围内时不会挂单, 等待下一个 tick 再初始化
+            self.grid.place_grid_orders(price)
+            self.started = len(self.grid.orders) > 0
+        else:
+            for exchange_id in self.adapter.on_tick(price):
+                order_id = self._local_ids.pop(exchange_id, None)
+                if order_id is None:
+                    continue
+                del self.exchange_ids[order_id]
+                self.grid.handle_order_filled(order_id)
+            if self.grid.config.auto_recenter and self.grid.current_grid(price) is None:
+                self.grid.recenter(price)
+        self.flush()
+        self.ticks += 1
+        self.latencies.append(time.perf_counter() - start)
+
+    def run(self, ticks: Iterable[float]) -> None:
+        """消费价格流直到结束"""
+        for price in ticks:
+            self.on_tick(price)
+
+    def stop(self) -> None:
+        """撤销所有挂单"""
+        self.grid.cancel_all_orders()
+        self.flush()
+
+    def latency_stats(self) -> Dict:
+        """每个 tick 处理耗时统计 (毫秒)"""
+        if not self.latencies:
+            return {"ticks": self.ticks}
+        ms = np.fromiter(self.latencies, dtype=float) * 1000
+        p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+        return {
+            "ticks": self.ticks,
+            "mean_ms": float(ms.mean()),
+            "p50_ms": float(p50),
+            "p90_ms": float(p90),
+            "p99_ms": float(p99),
+            "max_ms": float(ms.max()),
+        }
+
+
+if __name__ == "__main__":
+    from strategy.exchange_adapter import SimulatedExchange
+    from strategy.grid_trading import GridConfig
+
+    rng = np.random.default_rng(0)
+    prices = 150 * np.exp(np.cumsum(rng.normal(0, 0.002, 100000)))
+    grid = GridTrading(GridConfig('SOL_USDC', 200, 100, 200, 10000))
+    grid.logger.setLevel(logging.WARNING)
+    exchange = SimulatedExchange()
+    executor = GridExecutor(grid, exchange)
+    executor.run(prices)
+    executor.stop()
+    print(executor.latency_stats())
+    print(f"placed={exchange.placed}, filled={exchange.filled}, cancelled={exchange.cancelled}, "
+          f"position={grid.position}")
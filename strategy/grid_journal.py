@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Optional
+
+from strategy.grid_executor import GridExecutor
+from strategy.grid_trading import GridConfig, GridTrading
+from strategy.order_book import GridOrder, BUY, FILLED, PENDING
+
+logger = logging.getLogger("GridJournal")
+
+ACK = "ack"
+CONFIG = "config"
+
+
+@dataclass
+class GridState:
+    """从快照和日志恢复出的网格状态"""
+    seq: int = 0
+    config: Optional[Dict] = None
+    position: float = 0.0
+    next_id: int = 1
+    orders: Dict[int, Dict] = field(default_factory=dict)
+    exchange_ids: Dict[int, str] = field(default_factory=dict)
+
+    def apply(self, event: Dict) -> None:
+        """按顺序应用一条日志事件"""
+        self.seq = event["seq"]
+        kind = event["event"]
+        if kind == CONFIG:
+            self.config = event["config"]
+        elif kind == ACK:
+            if event["order_id"] in self.orders:
+                self.exchange_ids[event["order_id"]] = event["exchange_id"]
+        elif kind == PENDING:
+            order = event["order"]
+            self.orders[order["order_id"]] = order
+            self.next_id = max(self.next_id, order["order_id"] + 1)
+        else:
+            order = self.orders.pop(event["order"]["order_id"], None)
+            self.exchange_ids.pop(event["order"]["order_id"], None)
+            if order is not None and kind == FILLED:
+                self.position += order["amount"] if order["type"] == BUY else -order["amount"]
+
+
+class GridJournal:
+    """
+    网格状态的追加写日志
+
+    订单事件逐行追加到 journal.jsonl, 每 snapshot_every 条事件把完整状态压缩写入 snapshot.json 并清空日志。
+    启动时读取快照并重放其后的日志即可恢复 GridTrading, 与交易所只需对账一次当前挂单
+    """
+
+    def __init__(self, directory: str, snapshot_every: int = 1000, fsync: bool = False):
+        os.makedirs(directory, exist_ok=True)
+        self.journal_path = os.path.join(directory, "journal.jsonl")
+        self.snapshot_path = os.path.join(directory, "snapshot.json")
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.state = GridState()
+        self._file = None
+        self._grid: Optional[GridTrading] = None
+        self._config: Optional[GridConfig] = None
+        self._since_snapshot = 0
+
+    def load(self) -> GridState:
+        """读取快照并重放其后的日志"""
+        state = GridState()
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            state = GridState(
+                seq=snapshot["seq"],
+                config=snapshot["config"],
+                position=snapshot["position"],
+                next_id=snapshot["next_id"],
+                orders={o["order_id"]: o for o in snapshot["orders"]},
+                exchange_ids={int(k): v for k, v in snapshot["exchange_ids"].items()},
+            )
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 崩溃时最后一行可能没写完
+                        logger.warning(f"忽略不完整的日志行: {line!r}")
+                        break
+                    if event["seq"] > state.seq:
+                        state.apply(event)
+                        replayed += 1
+        logger.info(f"恢复网格状态: seq={state.seq}, 挂单={len(state.orders)}, 重放日志 {replayed} 条")
+        return state
+
+    def restore(self, grid: GridTrading, executor: Optional[GridExecutor] = None) -> bool:
+        """
+        把持久化状态恢复到 grid, 并开始记录后续事件
+
+        :param grid: 新建的 GridTrading
+        :param executor: 可选, 传入时会与交易所对账并恢复订单号映射
+        :return: 是否找到了持久化状态
+        """
+        state = self.load()
+        found = state.config is not None
+        if found:
+            grid.apply_config(GridConfig(**state.config))
+            grid.position = state.position
+            grid.orders.restore([GridOrder.from_dict(o) for o in state.orders.values()], state.next_id)
+        self.state = state
+        self.attach(grid, executor)
+        if found and executor is not None:
+            executor.reconcile(state.exchange_ids)
+        return found
+
+    def attach(self, grid: GridTrading, executor: Optional[GridExecutor] = None) -> None:
+        """开始记录 grid 的订单事件 (以及 executor 的下单确认)"""
+        self._grid = grid
+        self.state.position = grid.position
+        self.state.orders = {o.order_id: o.to_dict() for o in grid.orders.active_orders()}
+        self.state.next_id = grid.orders.next_id
+        self._file = open(self.journal_path, "a", encoding="utf-8")
+        grid.orders.subscribe(self._on_order_event)
+        if executor is not None:
+            executor.subscribe_ack(self._on_ack)
+        self.snapshot()
+
+    def _write(self, event: Dict) -> None:
+        self.state.seq += 1
+        event["seq"] = self.state.seq
+        event["ts"] = time.time()
+        self.state.apply(event)
+        self._file.write(json.dumps(event, separators=(",", ":")) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._since_snapshot += 1
+        if self._since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def _on_order_event(self, status: str, order: GridOrder) -> None:
+        if self._grid.config is not self._config:
+            self._config = self._grid.config
+            self._write({"event": CONFIG, "config": asdict(self._config)})
+        self._write({"event": status, "order": order.to_dict()})
+
+    def _on_ack(self, order_id: int, exchange_id: str) -> None:
+        self._write({"event": ACK, "order_id": order_id, "exchange_id": exchange_id})
+
+    def snapshot(self) -> None:
+        """写入压缩快照 (先写临时文件再原子替换), 然后清空日志"""
+        self._config = self._grid.config
+        self.state.config = asdict(self._config)
+        snapshot = {
+            "seq": self.state.seq,
+            "config": self.state.config,
+            "position": self.state.position,
+            "next_id": max(self.state.next_id, self._grid.orders.next_id),
+            "orders": [o.to_dict() for o in self._grid.orders.active_orders()],
+            "exchange_ids": self.state.exchange_ids,
+        }
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self._file.close()
+        self._file = open(self.journal_path, "w", encoding="utf-8")
+        self._since_snapshot = 0
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,100 @@
+import math
+from typing import List, Optional
+
+import numpy as np
+
+ARITHMETIC = "arithmetic"   # 等差网格
+GEOMETRIC = "geometric"     # 等比网格
+VOLATILITY = "volatility"   # 按 ATR 缩放间距的等差网格
+
+GRID_TYPES = (ARITHMETIC, GEOMETRIC, VOLATILITY)
+
+
+def average_true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int = 14) -> float:
+    """计算最近 period 根K线的平均真实波幅 (ATR)"""
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+    close = np.asarray(close, dtype=float)
+    prev_close = np.concatenate((close[:1], close[:-1]))
+    true_range = np.maximum(high, prev_close) - np.minimum(low, prev_close)
+    return float(true_range[-period:].mean())
+
+
+class GridLayout:
+    """
+    网格价格布局
+
+    价格用 NumPy 一次性生成, level() 通过直接计算下标 (等差) 或对数空间下标 (等比) 定位价格所在网格,
+    只用相邻两个价格修正精度舍入带来的误差, 与网格数量无关
+    """
+
+    def __init__(self, kind: str, lower_price: float, upper_price: float, grid_number: int,
+                 price_precision: int = 8):
+        if kind not in GRID_TYPES:
+            raise ValueError(f"未知网格类型: {kind}")
+        if lower_price <= 0:
+            raise ValueError(f"网格下限价格必须大于0: {lower_price}")
+        self.kind = kind
+        self.lower_price = lower_price
+        self.upper_price = upper_price
+        self.grid_number = grid_number
+        if kind == GEOMETRIC:
+            self._log_lower = math.log(lower_price)
+            self._step = (math.log(upper_price) - self._log_lower) / grid_number
+            prices = lower_price * np.exp(np.arange(grid_number + 1) * self._step)
+        else:
+            self._step = (upper_price - lower_price) / grid_number
+            prices = lower_price + np.arange(grid_number + 1) * self._step
+        self.prices: np.ndarray = np.round(prices, price_precision)
+
+    @classmethod
+    def around(cls, kind: str, center: float, step: float, grid_number: int,
+               price_precision: int = 8) -> "GridLayout":
+        """以 center 为中心、按等差间距 step (等比时为比例) 生成网格,
+        等差网格的下限不大于0时整体上移, 使最低一格价格为 step"""
+        if center <= 0:
+            raise ValueError(f"网格中心价格必须大于0: {center}")
+        if kind == GEOMETRIC:
+            half = step ** (grid_number / 2)
+            return cls(kind, center / half, center * half, grid_number, price_precision)
+        lower = max(center - step * grid_number / 2, step)
+        return cls(kind, lower, lower + step * grid_number, grid_number, price_precision)
+
+    @property
+    def step(self) -> float:
+        """等差网格的价格间距, 等比网格的相邻价格比例"""
+        return math.exp(self._step) if self.kind == GEOMETRIC else self._step
+
+    def to_list(self) -> List[float]:
+        return self.prices.tolist()
+
+    def level(self, price: float) -> Optional[int]:
+        """O(1) 定位价格所在网格 i (prices[i] <= price < prices[i+1]), 超出范围返回 None"""
+        if price <= 0 and self.kind == GEOMETRIC:
+            return None
+        if self.kind == GEOMETRIC:
+            i = int(math.floor((math.log(price) - self._log_lower) / self._step))
+        else:
+            i = int(math.floor((price - self.lower_price) / self._step))
+        prices = self.prices
+        if 0 <= i <= self.grid_number and price < prices[i]:
+            i -= 1
+        elif 0 <= i + 1 <= self.grid_number and price >= prices[i + 1]:
+            i += 1
+        if 0 <= i < self.grid_number:
+            return i
+        return None
+
+    def recenter(self, price: float, price_precision: int = 8) -> "GridLayout":
+        """保持网格宽度和网格数量不变, 以 price 为中心重新生成网格"""
+        return GridLayout.around(self.kind, price, self.step, self.grid_number, price_precision)
+
+
+def build_layout(config) -> GridLayout:
+    """根据 GridConfig 生成网格布局"""
+    if config.grid_type == VOLATILITY:
+        center = (config.upper_price + config.lower_price) / 2
+        return GridLayout.around(VOLATILITY, center, config.atr * config.atr_multiplier,
+                                 config.grid_number, config.price_precision)
+    return GridLayout(config.grid_type, config.lower_price, config.upper_price,
+                      config.grid_number, config.price_precision)
@@ -0,0 +1,122 @@
+import itertools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from strategy.grid_backtest import backtest_grid, candles_to_array
+from strategy.grid_trading import GridConfig
+
+logger = logging.getLogger("GridSweep")
+
+RANK_COLUMNS = ['total_return', 'max_drawdown', 'turnover']
+RANK_ASCENDING = [False, True, False]
+
+# 子进程内共享的K线数组, 由 _init_worker 挂载
+_worker_shm: Optional[shared_memory.SharedMemory] = None
+_worker_candles: Optional[np.ndarray] = None
+
+
+def _init_worker(shm_name: str, shape: Tuple[int, int]) -> None:
+    """子进程初始化: 挂载共享内存中的K线, 避免每个任务重复序列化"""
+    global _worker_shm, _worker_candles
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_candles = np.ndarray(shape, dtype=np.float64, buffer=_worker_shm.buf)
+
+
+def _run_batch(symbol: str, total_invest: float, price_precision: int, size_precision: int, grid_type: str,
+               params: List[Tuple[float, float, int]]) -> List[tuple]:
+    """在子进程中回测一批参数组合"""
+    rows = []
+    for upper_price, lower_price, grid_number in params:
+        config = GridConfig(symbol, upper_price, lower_price, grid_number, total_invest,
+                            price_precision=price_precision, size_precision=size_precision,
+                            grid_type=grid_type)
+        r = backtest_grid(config, _worker_candles)
+        rows.append((upper_price, lower_price, grid_number,
+                     r.total_return, r.max_drawdown, r.turnover, r.trades, r.final_equity))
+    return rows
+
+
+def grid_param_combinations(upper_prices: Iterable[float], lower_prices: Iterable[float],
+                            grid_numbers: Iterable[int]) -> List[Tuple[float, float, int]]:
+    """生成所有合法的 (upper_price, lower_price, grid_number) 组合"""
+    return [(float(u), float(l), int(n))
+            for u, l, n in itertools.product(upper_prices, lower_prices, grid_numbers)
+            if u > l and n > 0]
+
+
+def sweep_grid(
+        candles: pd.DataFrame,
+        symbol: str,
+        upper_prices: Sequence[float],
+        lower_prices: Sequence[float],
+        grid_numbers: Sequence[int],
+        total_invest: float,
+        price_precision: int = 8,
+        size_precision: int = 8,
+        grid_type: str = "arithmetic",
+        processes: Optional[int] = None,
+        batch_size: int = 64,
+) -> pd.DataFrame:
+    """
+    网格参数扫描
+
+    对 upper_price / lower_price / grid_number 的所有组合并行回测,
+    K线放在共享内存中供各进程直接读取, 结果按 收益率(降序) / 最大回撤(升序) / 换手率(降序) 排序
+
+    :param candles: 包含 open/high/low/close 列的K线
+    :param symbol: 交易对
+    :param upper_prices: 网格上限候选值
+    :param lower_prices: 网格下限候选值
+    :param grid_numbers: 网格数量候选值
+    :param total_invest: 总投资额
+    :param price_precision: 价格精度
+    :param size_precision: 数量精度
+    :param grid_type: 网格类型 arithmetic / geometric
+    :param processes: 进程数, 默认 os.cpu_count()
+    :param batch_size: 每个任务包含的参数组合数
+    :return: 排序后的回测结果
+    """
+    params = grid_param_combinations(upper_prices, lower_prices, grid_numbers)
+    columns = ['upper_price', 'lower_price', 'grid_number'] + RANK_COLUMNS + ['trades', 'final_equity']
+    if not params:
+        return pd.DataFrame(columns=columns)
+
+    data = candles_to_array(candles)
+    shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    try:
+        np.ndarray(data.shape, dtype=np.float64, buffer=shm.buf)[:] = data
+        batches = [params[i:i + batch_size] for i in range(0, len(params), batch_size)]
+        logger.info(f"网格参数扫描: {len(params)} 组参数, {len(batches)} 个任务")
+        rows = []
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count(),
+                                 initializer=_init_worker, initargs=(shm.name, data.shape)) as executor:
+            futures = [executor.submit(_run_batch, symbol, total_invest, price_precision, size_precision,
+                                       grid_type, batch)
+                       for batch in batches]
+            for future in futures:
+                rows.extend(future.result())
+    finally:
+        shm.close()
+        shm.unlink()
+
+    df = pd.DataFrame(rows, columns=columns)
+    df = df.sort_values(RANK_COLUMNS, ascending=RANK_ASCENDING)
+    return df.reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    from utils.cex.binance import get_spot_candlesticks
+
+    df = get_spot_candlesticks('ETH', interval='1h', limit=1000)
+    result = sweep_grid(df, 'ETH_USDC',
+                        upper_prices=np.linspace(3000, 5000, 21),
+                        lower_prices=np.linspace(1500, 3000, 16),
+                        grid_numbers=range(5, 105, 5),
+                        total_invest=10000)
+    print(result.head(20))
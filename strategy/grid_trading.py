@@ -1,8 +1,13 @@
 from typing import List, Dict, Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from decimal import Decimal
 import logging
 
+import numpy as np
+
+from strategy.grid_layout import GridLayout, build_layout, GRID_TYPES, VOLATILITY
+from strategy.order_book import GridOrderBook, GridOrder, BUY, SELL
+
 @dataclass
 class GridConfig:
     """网格交易配置类"""
@@ -13,6 +18,11 @@ class GridConfig:
     total_invest: float        # 总投资额
     price_precision: int = 8   # 价格精度
     size_precision: int = 8    # 数量精度
+    history_size: int = 10000  # 保留的历史订单数量
+    grid_type: str = "arithmetic"  # 网格类型: arithmetic / geometric / volatility
+    atr: Optional[float] = None    # volatility 网格使用的 ATR
+    atr_multiplier: float = 1.0    # volatility 网格间距 = atr * atr_multiplier
+    auto_recenter: bool = False    # 价格离开网格范围时自动以当前价格为中心重建网格
 
     def __post_init__(self):
         if self.upper_price <= self.lower_price:
@@ -21,15 +31,20 @@ class GridConfig:
             raise ValueError("网格数量必须大于0")
         if self.total_invest <= 0:
             raise ValueError("总投资额必须大于0")
+        if self.grid_type not in GRID_TYPES:
+            raise ValueError(f"网格类型必须是 {GRID_TYPES} 之一")
+        if self.grid_type == VOLATILITY and (self.atr is None or self.atr <= 0):
+            raise ValueError("volatility 网格需要大于0的 atr")
 
 class GridTrading:
     """网格交易策略实现类"""
     def __init__(self, config: GridConfig):
         self.config = config
-        self.grid_profit = (config.upper_price - config.lower_price) / config.grid_number
+        self.layout: GridLayout = build_layout(config)
+        self.grid_profit = (self.layout.upper_price - self.layout.lower_price) / config.grid_number
         self.grid_prices = self._calculate_grid_prices()
         self.grid_amounts = self._calculate_grid_amounts()
-        self.orders: Dict[str, Dict] = {}  # 订单管理
+        self.orders = GridOrderBook(len(self.grid_prices), config.history_size)  # 订单管理
         self.position = 0.0                # 当前持仓
         self.logger = self._setup_logger()
 
@@ -45,97 +60,93 @@ class GridTrading:
 
     def _calculate_grid_prices(self) -> List[float]:
         """计算网格价格列表"""
-        prices = []
-        for i in range(self.config.grid_number + 1):
-            price = self.config.lower_price + i * self.grid_profit
-            price = round(price, self.config.price_precision)
-            prices.append(price)
-        return prices
+        return self.layout.to_list()
 
     def _calculate_grid_amounts(self) -> List[float]:
         """计算每个网格的交易数量"""
         grid_invest = self.config.total_invest / self.config.grid_number
-        amounts = []
-        for price in self.grid_prices[:-1]:  # 最后一个价格不需要计算数量
-            amount = grid_invest / price
-            amount = round(amount, self.config.size_precision)
-            amounts.append(amount)
-        return amounts
+        # 最后一个价格不需要计算数量
+        return np.round(grid_invest / self.layout.prices[:-1], self.config.size_precision).tolist()
+
+    def current_grid(self, price: float) -> Optional[int]:
+        """O(1) 定位价格所在的网格, 超出范围返回 None"""
+        return self.layout.level(price)
+
+    def apply_config(self, config: GridConfig) -> None:
+        """切换网格配置 (网格数量不变), 重新计算网格价格和数量"""
+        self.config = config
+        self.layout = build_layout(config)
+        self.grid_prices = self._calculate_grid_prices()
+        self.grid_amounts = self._calculate_grid_amounts()
+
+    def recenter(self, current_price: float) -> None:
+        """撤销所有挂单, 以当前价格为中心重建网格并重新挂单, 持仓保持不变"""
+        self.cancel_all_orders()
+        layout = self.layout.recenter(current_price, self.config.price_precision)
+        self.apply_config(replace(self.config, lower_price=layout.lower_price, upper_price=layout.upper_price))
+        self.logger.info(f"网格重建: {self.layout.lower_price} - {self.layout.upper_price}")
+        self.place_grid_orders(current_price)
 
     def place_grid_orders(self, current_price: float) -> None:
         """根据当前价格放置网格订单"""
         try:
             # 找到当前价格所在的网格
-            current_grid = None
-            for i in range(len(self.grid_prices) - 1):
-                if self.grid_prices[i] <= current_price < self.grid_prices[i + 1]:
-                    current_grid = i
-                    break
-
+            current_grid = self.current_grid(current_price)
+            if current_grid is None and self.config.auto_recenter and len(self.orders) == 0:
+                self.recenter(current_price)
+                return
             if current_grid is None:
                 self.logger.warning(f"当前价格 {current_price} 不在网格范围内")
                 return
 
             # 放置买单
             for i in range(current_grid):
-                self._place_buy_order(self.grid_prices[i], self.grid_amounts[i])
+                self._place_buy_order(i, self.grid_amounts[i])
 
             # 放置卖单
             for i in range(current_grid + 1, len(self.grid_prices) - 1):
-                self._place_sell_order(self.grid_prices[i], self.grid_amounts[i-1])
+                self._place_sell_order(i, self.grid_amounts[i-1])
 
         except Exception as e:
             self.logger.error(f"放置网格订单失败: {str(e)}")
 
-    def _place_buy_order(self, price: float, amount: float) -> None:
+    def _place_buy_order(self, level: int, amount: float) -> Optional[GridOrder]:
         """放置买单"""
-        order_id = f"buy_{price}"
-        order = {
-            "type": "buy",
-            "price": price,
-            "amount": amount,
-            "status": "pending"
-        }
-        self.orders[order_id] = order
-        self.logger.info(f"放置买单: 价格={price}, 数量={amount}")
+        order = self.orders.add(BUY, level, self.grid_prices[level], amount)
+        if order is not None:
+            self.logger.info(f"放置买单: 价格={order.price}, 数量={amount}")
+        return order
 
-    def _place_sell_order(self, price: float, amount: float) -> None:
+    def _place_sell_order(self, level: int, amount: float) -> Optional[GridOrder]:
         """放置卖单"""
-        order_id = f"sell_{price}"
-        order = {
-            "type": "sell",
-            "price": price,
-            "amount": amount,
-            "status": "pending"
-        }
-        self.orders[order_id] = order
-        self.logger.info(f"放置卖单: 价格={price}, 数量={amount}")
+        order = self.orders.add(SELL, level, self.grid_prices[level], amount)
+        if order is not None:
+            self.logger.info(f"放置卖单: 价格={order.price}, 数量={amount}")
+        return order
 
-    def handle_order_filled(self, order_id: str) -> None:
+    def handle_order_filled(self, order_id: int) -> None:
         """处理订单成交"""
-        if order_id not in self.orders:
+        order = self.orders.fill(order_id)
+        if order is None:
             self.logger.warning(f"未找到订单: {order_id}")
             return
 
-        order = self.orders[order_id]
-        if order["type"] == "buy":
-            self.position += order["amount"]
+        if order.side == BUY:
+            self.position += order.amount
             # 在买单成交价格上方放置卖单
-            self._place_sell_order(order["price"] + self.grid_profit, order["amount"])
+            self._place_sell_order(order.level + 1, order.amount)
         else:  # sell
-            self.position -= order["amount"]
+            self.position -= order.amount
             # 在卖单成交价格下方放置买单
-            self._place_buy_order(order["price"] - self.grid_profit, order["amount"])
+            if order.level > 0:
+                self._place_buy_order(order.level - 1, order.amount)
 
-        order["status"] = "filled"
-        self.logger.info(f"订单成交: {order_id}, 当前持仓: {self.position}")
+        self.logger.info(f"订单成交: {order}, 当前持仓: {self.position}")
 
     def cancel_all_orders(self) -> None:
         """取消所有未成交订单"""
-        for order_id, order in self.orders.items():
-            if order["status"] == "pending":
-                order["status"] = "cancelled"
-                self.logger.info(f"取消订单: {order_id}")
+        for order in self.orders.cancel_all():
+            self.logger.info(f"取消订单: {order}")
 
     def get_grid_status(self) -> Dict:
         """获取网格状态"""
@@ -143,5 +154,5 @@ class GridTrading:
             "symbol": self.config.symbol,
             "grid_profit": self.grid_profit,
             "position": self.position,
-            "orders": self.orders
-        }
\ No newline at end of file
+            "orders": [order.to_dict() for order in self.orders.active_orders()]
+        }
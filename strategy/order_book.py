@@ -0,0 +1,126 @@
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional
+
+BUY = "buy"
+SELL = "sell"
+
+PENDING = "pending"
+FILLED = "filled"
+CANCELLED = "cancelled"
+
+
+class GridOrder:
+    """网格订单记录"""
+    __slots__ = ["order_id", "side", "level", "price", "amount", "status"]
+
+    def __init__(self, order_id: int, side: str, level: int, price: float, amount: float,
+                 status: str = PENDING):
+        self.order_id = order_id
+        self.side = side
+        self.level = level
+        self.price = price
+        self.amount = amount
+        self.status = status
+
+    def to_dict(self) -> Dict:
+        return {
+            "order_id": self.order_id,
+            "type": self.side,
+            "level": self.level,
+            "price": self.price,
+            "amount": self.amount,
+            "status": self.status,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "GridOrder":
+        return cls(data["order_id"], data["type"], data["level"], data["price"], data["amount"],
+                   data.get("status", PENDING))
+
+    def __str__(self):
+        return f"{self.side}#{self.order_id}(level={self.level}, price={self.price}, amount={self.amount})"
+
+
+class GridOrderBook:
+    """
+    按网格层级索引的订单簿
+
+    挂单按 (方向, 层级) 放在定长数组里, 同时按订单号建索引;
+    成交和撤销的订单移入定长历史队列, 内存占用与网格数量和 history_size 成正比。
+    订单状态变化 (PENDING / FILLED / CANCELLED) 会通知 subscribe 注册的回调
+    """
+
+    def __init__(self, levels: int, history_size: int = 10000):
+        self._slots: Dict[str, List[Optional[GridOrder]]] = {
+            BUY: [None] * levels,
+            SELL: [None] * levels,
+        }
+        self._active: Dict[int, GridOrder] = {}
+        self.history: Deque[GridOrder] = deque(maxlen=history_size)
+        self._next_id = 1
+        self._listeners: List[Callable[[str, GridOrder], None]] = []
+
+    def __len__(self):
+        return len(self._active)
+
+    def __contains__(self, order_id: int):
+        return order_id in self._active
+
+    @property
+    def next_id(self) -> int:
+        return self._next_id
+
+    def subscribe(self, listener: Callable[[str, GridOrder], None]) -> None:
+        """注册订单事件回调 listener(status, order)"""
+        self._listeners.append(listener)
+
+    def _notify(self, status: str, order: GridOrder) -> None:
+        for listener in self._listeners:
+            listener(status, order)
+
+    def get(self, order_id: int) -> Optional[GridOrder]:
+        return self._active.get(order_id)
+
+    def at(self, side: str, level: int) -> Optional[GridOrder]:
+        """查询某个层级上的挂单"""
+        return self._slots[side][level]
+
+    def active_orders(self) -> Iterable[GridOrder]:
+        return self._active.values()
+
+    def add(self, side: str, level: int, price: float, amount: float) -> Optional[GridOrder]:
+        """在层级上挂单, 已有同向挂单时返回 None"""
+        if self._slots[side][level] is not None:
+            return None
+        order = GridOrder(self._next_id, side, level, price, amount)
+        self._next_id += 1
+        self._slots[side][level] = order
+        self._active[order.order_id] = order
+        self._notify(PENDING, order)
+        return order
+
+    def _close(self, order_id: int, status: str) -> Optional[GridOrder]:
+        order = self._active.pop(order_id, None)
+        if order is None:
+            return None
+        self._slots[order.side][order.level] = None
+        order.status = status
+        self.history.append(order)
+        self._notify(status, order)
+        return order
+
+    def restore(self, orders: Iterable[GridOrder], next_id: int) -> None:
+        """从持久化状态恢复挂单, 不触发事件回调"""
+        for order in orders:
+            self._slots[order.side][order.level] = order
+            self._active[order.order_id] = order
+        self._next_id = max(self._next_id, next_id)
+
+    def fill(self, order_id: int) -> Optional[GridOrder]:
+        return self._close(order_id, FILLED)
+
+    def cancel(self, order_id: int) -> Optional[GridOrder]:
+        return self._close(order_id, CANCELLED)
+
+    def cancel_all(self) -> List[GridOrder]:
+        return [self._close(order_id, CANCELLED) for order_id in list(self._active)]
@@ -0,0 +1,32 @@
+from eth_abi import encode
+
+from utils.log_decoder import EventRegistry
+
+TRANSFER_BATCH = ("event TransferBatch(address indexed operator, address indexed from, address indexed to, "
+                  "uint256[] ids, uint256[] values)")
+
+
+def _topic(address: str) -> str:
+    return '0x' + '00' * 12 + address[2:]
+
+
+def test_array_data_is_decoded_with_eth_abi():
+    registry = EventRegistry([])
+    spec = registry.register(TRANSFER_BATCH)
+    operator, sender, receiver = '0x' + '11' * 20, '0x' + '22' * 20, '0x' + '33' * 20
+    log = {'topics': ['0x' + spec.topic0.hex(), _topic(operator), _topic(sender), _topic(receiver)],
+           'data': '0x' + encode(['uint256[]', 'uint256[]'], [[1, 2, 3], [10, 20, 30]]).hex()}
+    args = registry.decode_log(log)
+    assert args['event'] == 'TransferBatch'
+    assert list(args['ids']) == [1, 2, 3]
+    assert list(args['values']) == [10, 20, 30]
+    assert args['from'] == sender
+
+
+def test_static_words_take_the_fast_path():
+    registry = EventRegistry()
+    sync = registry.register("event Sync(uint112 reserve0, uint112 reserve1)")
+    assert sync._word_decoders is not None
+    args = registry.decode_log({'topics': ['0x' + sync.topic0.hex()],
+                                'data': '0x' + encode(['uint112', 'uint112'], [5, 7]).hex()})
+    assert (args['reserve0'], args['reserve1']) == (5, 7)
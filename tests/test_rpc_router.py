@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from utils.rpc import RpcError, RpcRouter, batch_call
+from utils.rpc_mock import MockRpcServer
+
+HEAD = 1_000
+
+
+@pytest.fixture
+def nodes():
+    servers = [MockRpcServer(head=HEAD).start() for _ in range(3)]
+    yield servers
+    for server in servers:
+        server.stop()
+
+
+def _block_number(rpc: RpcRouter) -> int:
+    return int(batch_call(rpc, [('eth_blockNumber', [])])[0], 16)
+
+
+def test_requests_fail_over_from_a_node_that_is_down(nodes):
+    nodes[0].down = True
+    rpc = RpcRouter([n.url for n in nodes], timeout=5, max_failures=1, cooldown=60)
+    try:
+        assert all(_block_number(rpc) == HEAD for _ in range(30))
+        down = rpc.stats()[0]
+        assert down['down'] and down['errors'] >= 1
+        # out of rotation after its first failure
+        assert nodes[0].requests == down['requests'] == 1
+        assert nodes[1].requests + nodes[2].requests >= 30
+    finally:
+        rpc.close()
+
+
+def test_all_nodes_down_raises(nodes):
+    for node in nodes:
+        node.down = True
+    rpc = RpcRouter([n.url for n in nodes], timeout=5)
+    try:
+        with pytest.raises(RpcError):
+            batch_call(rpc, [('eth_blockNumber', [])])
+        assert all(node.requests == 1 for node in nodes)
+    finally:
+        rpc.close()
+
+
+def test_slow_node_is_hedged(nodes):
+    slow, fast = nodes[0], nodes[1]
+    rpc = RpcRouter([slow.url, fast.url], timeout=5, hedge_percentile=95)
+    try:
+        # both nodes answered quickly so far, and the slow one looks slightly faster so it is asked first
+        for endpoint, latency in zip(rpc.endpoints, (0.001, 0.01)):
+            endpoint.latency = latency
+            endpoint.samples.extend([0.01] * 20)
+        slow.latency = 1.0
+        start = time.perf_counter()
+        assert _block_number(rpc) == HEAD
+        assert time.perf_counter() - start < slow.latency
+        assert rpc.hedged > 0
+        assert slow.requests == 1 and fast.requests == 1
+    finally:
+        rpc.close()
@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+
+from utils.chain import Chain
+from utils.env import getenv
+from utils.metrics import cache_lookup
+from utils.rpc import batch_call
+
+DEFAULT_BLOCK_INDEX = os.path.join(os.path.expanduser('~'), '.cache', 'web3-analytics', 'blocks.sqlite')
+
+# the head moves, the latest block is asked again after this many seconds
+HEAD_TTL = 10
+
+# rounds of interpolation search before giving up on a timestamp
+MAX_ROUNDS = 64
+
+
+def _fetch(chain: Chain, tags: Sequence[str]) -> List[Optional[Tuple[int, int]]]:
+    results = batch_call(chain, [('eth_getBlockByNumber', [tag, False]) for tag in tags])
+    return [None if r is None else (int(r['number'], 16), int(r['timestamp'], 16)) for r in results]
+
+
+class BlockIndex:
+    """
+    block number <-> unix timestamp index of a chain
+
+    every (block, timestamp) point ever fetched is kept in memory as two sorted arrays and on disk, since block
+    timestamps never change. block_at answers with the points around the timestamp first and runs an
+    interpolation search on the rest: block times are close to constant, so the guess between two known points
+    usually lands within a few blocks, and a bisection step is mixed in whenever a guess does not halve the
+    range. lookups of many timestamps search side by side, each round fetches the guesses of all of them in one
+    json-rpc batch, so n timestamps cost a few batches rather than n * log(blocks) calls
+    """
+    _defaults: Dict[Chain, 'BlockIndex'] = {}
+
+    def __init__(self, chain: Chain = Chain.ETH, path: str = DEFAULT_BLOCK_INDEX,
+                 fetch: Optional[Callable[[Sequence[str]], List[Optional[Tuple[int, int]]]]] = None):
+        """
+        :param fetch: fetch(block tags such as '0x10' or 'latest') returning (number, timestamp) or None per tag,
+                      default eth_getBlockByNumber batches on the rpc router of chain
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.chain = chain
+        self.fetch = fetch if fetch is not None else (lambda tags: _fetch(chain, tags))
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._head: Optional[Tuple[int, int, float]] = None
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS blocks ('
+                           'chain TEXT NOT NULL, block_number INTEGER NOT NULL, timestamp INTEGER NOT NULL, '
+                           'PRIMARY KEY (chain, block_number))')
+        self._conn.commit()
+        rows = self._conn.execute('SELECT block_number, timestamp FROM blocks WHERE chain = ? ORDER BY block_number',
+                                  (chain.value,)).fetchall()
+        self._blocks = np.array([r[0] for r in rows], dtype=np.int64)
+        self._timestamps = np.array([r[1] for r in rows], dtype=np.int64)
+
+    @classmethod
+    def default(cls, chain: Chain = Chain.ETH) -> 'BlockIndex':
+        """ process-wide index of chain at $BLOCK_INDEX_PATH, or ~/.cache/web3-analytics/blocks.sqlite """
+        if chain not in cls._defaults:
+            cls._defaults[chain] = cls(chain, getenv('BLOCK_INDEX_PATH', DEFAULT_BLOCK_INDEX))
+        return cls._defaults[chain]
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def _add(self, points: Iterable[Tuple[int, int]]) -> None:
+        points = {b: t for b, t in points if b is not None}
+        if not points:
+            return
+        blocks = np.fromiter(points.keys(), dtype=np.int64, count=len(points))
+        timestamps = np.fromiter(points.values(), dtype=np.int64, count=len(points))
+        with self._lock:
+            new = ~np.isin(blocks, self._blocks)
+            if not new.any():
+                return
+            self._conn.executemany('INSERT OR REPLACE INTO blocks VALUES (?, ?, ?)',
+                                   [(self.chain.value, int(b), int(t)) for b, t in zip(blocks[new], timestamps[new])])
+            self._conn.commit()
+            all_blocks = np.concatenate([self._blocks, blocks[new]])
+            order = np.argsort(all_blocks, kind='stable')
+            self._blocks = all_blocks[order]
+            self._timestamps = np.concatenate([self._timestamps, timestamps[new]])[order]
+
+    def _request(self, tags: Sequence[str]) -> List[Optional[Tuple[int, int]]]:
+        self.calls += len(tags)
+        return self.fetch(tags)
+
+    def head(self) -> Tuple[int, int]:
+        """ :return: (latest block, its timestamp), refreshed every HEAD_TTL seconds """
+        if self._head is None or time.time() - self._head[2] > HEAD_TTL:
+            point = self._request(['latest'])[0]
+            if point is None:
+                raise ValueError(f"latest block of {self.chain.value} not available")
+            self._head = (point[0], point[1], time.time())
+            self._add([point])
+        return self._head[0], self._head[1]
+
+    # timestamp -> block
+
+    def block_at(self, timestamp: int) -> int:
+        """ :return: the last block with block timestamp <= timestamp (unix seconds) """
+        return int(self.blocks_at([timestamp])[0])
+
+    def blocks_at(self, timestamps: Iterable[int]) -> np.ndarray:
+        """ vectorised block_at, timestamps before the first block give block 0
+
+        :return: int64 array of block numbers, in the order of timestamps
+        """
+        targets = np.asarray(list(timestamps) if not isinstance(timestamps, np.ndarray) else timestamps,
+                             dtype=np.int64)
+        if len(targets) == 0:
+            return np.zeros(0, dtype=np.int64)
+        head_block, head_ts = self.head()
+        if not len(self._blocks) or self._blocks[0] != 0:
+            self._add(p for p in self._request(['0x0']) if p is not None)
+        unique, inverse = np.unique(targets, return_inverse=True)
+        answer = np.full(len(unique), -1, dtype=np.int64)
+        answer[unique >= head_ts] = head_block
+        answer[unique < self._timestamps[0]] = 0
+        # the distance between successive guesses of a target bounds the error of the next guess, so probes at
+        # guess +- a quarter of it close the bracket from both sides; bisect where a round did not halve it
+        previous = np.full(len(unique), -1, dtype=np.int64)
+        last_span = np.full(len(unique), np.iinfo(np.int64).max, dtype=np.int64)
+        for _ in range(MAX_ROUNDS):
+            positions = np.flatnonzero(answer < 0)
+            if len(positions) == 0:
+                break
+            pending = unique[positions]
+            blocks, stamps = self._blocks, self._timestamps
+            # bracket: blocks[lo] has timestamp <= target < blocks[hi]
+            hi = np.searchsorted(stamps, pending, side='right')
+            lo = hi - 1
+            lo_b, hi_b, lo_t, hi_t = blocks[lo], blocks[hi], stamps[lo], stamps[hi]
+            span = hi_b - lo_b
+            done = span <= 1
+            answer[positions[done]] = lo_b[done]
+            keep = ~done
+            if not keep.any():
+                break
+            positions, pending, span = positions[keep], pending[keep], span[keep]
+            lo_b, hi_b, lo_t, hi_t = lo_b[keep], hi_b[keep], lo_t[keep], hi_t[keep]
+            guess = lo_b + (pending - lo_t) * span // (hi_t - lo_t)
+            slow = 2 * span > last_span[positions]
+            guess[slow] = lo_b[slow] + span[slow] // 2
+            last = previous[positions]
+            radius = np.where(last < 0, 1, np.abs(guess - last) // 4 + 1)
+            previous[positions] = guess
+            last_span[positions] = span
+            probes = np.concatenate([guess - radius, guess, guess + 1, guess + radius])
+            probes = probes[(probes > np.tile(lo_b, 4)) & (probes < np.tile(hi_b, 4))]
+            wanted = np.unique(probes)
+            points = self._request([hex(int(b)) for b in wanted])
+            failed = sum(p is None for p in points)
+            if failed:
+                raise ValueError(f"{failed} of {len(points)} {self.chain.value} blocks not fetched")
+            self._add(points)
+        else:
+            raise ValueError(f"interpolation search of {self.chain.value} did not converge")
+        logger.debug('{} {} timestamps resolved, {} blocks indexed', len(unique), self.chain.value, len(self._blocks))
+        return answer[inverse]
+
+    # block -> timestamp
+
+    def timestamps(self, blocks: Iterable[int], batch_size: int = 100) -> Dict[int, int]:
+        """ exact block timestamps, only blocks not in the index are fetched
+
+        :return: block number -> unix timestamp, blocks that could not be fetched are left out
+        """
+        blocks = np.unique(np.asarray(list(blocks), dtype=np.int64))
+        missing = blocks[~np.isin(blocks, self._blocks)]
+        cache_lookup('blocks', len(blocks) - len(missing), len(missing))
+        for start in range(0, len(missing), batch_size):
+            chunk = missing[start:start + batch_size]
+            self._add(p for p in self._request([hex(int(b)) for b in chunk]) if p is not None)
+        known = np.isin(self._blocks, blocks)
+        return dict(zip(self._blocks[known].tolist(), self._timestamps[known].tolist()))
+
+    def estimate_timestamps(self, blocks: Iterable[int]) -> np.ndarray:
+        """ timestamps of blocks interpolated between the indexed points, no rpc calls """
+        if not len(self._blocks):
+            raise ValueError("empty block index")
+        return np.interp(np.asarray(list(blocks), dtype=float), self._blocks, self._timestamps).astype(np.int64)
+
+
+if __name__ == "__main__":
+    from datetime import datetime, timedelta
+
+    index = BlockIndex.default(Chain.ETH)
+    days = [int((datetime.now() - timedelta(days=d)).timestamp()) for d in range(365)]
+    start = time.time()
+    found = index.blocks_at(days)
+    print(f'{len(days)} timestamps in {time.time() - start:.1f}s, {index.calls} blocks fetched')
+    print(found[:5])
@@ -0,0 +1,183 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from utils.env import getenv
+from utils.interval import INTERVAL_MS, align, normalize_interval
+from utils.metrics import cache_lookup
+from utils.stream.base import CANDLE_COLUMNS, unified_frame
+
+DEFAULT_CANDLE_STORE = os.path.join(os.path.expanduser('~'), '.cache', 'web3-analytics', 'candles.sqlite')
+
+# candles per rest request, 100 works for every cex in utils.token_price
+PAGE_SIZE = 100
+
+
+def _utc(ms: int) -> datetime:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+def _naive_utc(dt: datetime) -> pd.Timestamp:
+    ts = pd.Timestamp(dt)
+    return ts.tz_convert('UTC').tz_localize(None) if ts.tzinfo else ts
+
+
+def _fetch(token: str, interval: str, start_time: datetime, end_time: datetime, limit: int):
+    from utils.token_price import get_token_spot_candlesticks
+    return get_token_spot_candlesticks(token, interval=interval, start_time=start_time, end_time=end_time,
+                                       limit=limit)
+
+
+class CandleStore:
+    """
+    on-disk store of closed spot candles per (token, interval), shared by Pair and the analytics engines
+
+    only closed candles are stored since they never change, each read first fetches the candles closed since
+    the last stored one (nothing when it is up to date), then serves the rows from an in-memory frame cache
+    """
+    _default: Optional['CandleStore'] = None
+
+    def __init__(self, path: str = DEFAULT_CANDLE_STORE,
+                 fetch: Callable[[str, str, datetime, datetime, int], Optional[pd.DataFrame]] = _fetch,
+                 page_size: int = PAGE_SIZE):
+        """
+        :param fetch: fetch(token, interval, start_time, end_time, limit) returning a get_spot_candlesticks
+                      dataframe, default utils.token_price.get_token_spot_candlesticks
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.fetch = fetch
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._frames: Dict[Tuple[str, str], pd.DataFrame] = {}
+        self._history_start: Dict[Tuple[str, str], int] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS candles ('
+                           'token TEXT NOT NULL, interval TEXT NOT NULL, ts INTEGER NOT NULL, '
+                           'open REAL, high REAL, low REAL, close REAL, volume REAL, '
+                           'PRIMARY KEY (token, interval, ts))')
+        self._conn.commit()
+
+    @classmethod
+    def default(cls) -> 'CandleStore':
+        """ process-wide store at $CANDLE_STORE_PATH, or ~/.cache/web3-analytics/candles.sqlite """
+        if cls._default is None:
+            cls._default = cls(getenv('CANDLE_STORE_PATH', DEFAULT_CANDLE_STORE))
+        return cls._default
+
+    def _key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def put(self, token: str, interval: str, df: pd.DataFrame) -> int:
+        """ store unified candles, :return: number of rows written """
+        df = unified_frame(df)
+        ts = df['timestamp'].to_numpy(dtype='datetime64[ms]').astype(np.int64)
+        rows = list(zip([token] * len(df), [interval] * len(df), ts.tolist(), df['open'].tolist(),
+                        df['high'].tolist(), df['low'].tolist(), df['close'].tolist(), df['volume'].tolist()))
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self._conn.commit()
+            self._frames.pop((token, interval), None)
+        return len(rows)
+
+    def _read(self, token: str, interval: str) -> pd.DataFrame:
+        key = (token, interval)
+        with self._lock:
+            frame = self._frames.get(key)
+            cache_lookup('candle_frames', frame is not None, frame is None)
+            if frame is None:
+                rows = self._conn.execute(
+                    'SELECT ts, open, high, low, close, volume FROM candles WHERE token = ? AND interval = ? '
+                    'ORDER BY ts', key).fetchall()
+                frame = pd.DataFrame(rows, columns=CANDLE_COLUMNS)
+                frame['timestamp'] = pd.to_datetime(frame['timestamp'].astype(np.int64), unit='ms')
+                frame = frame.astype({c: float for c in CANDLE_COLUMNS[1:]})
+                self._frames[key] = frame
+            return frame
+
+    def update(self, token: str, interval: str, start_time: Optional[datetime] = None,
+               limit: int = 1000) -> int:
+        """ fetch candles closed since the last stored one
+
+        :param start_time: first candle wanted, default limit candles back from now,
+                           older candles are fetched when the store starts later
+        :return: number of new candles
+        """
+        token, interval = token.upper(), normalize_interval(interval)
+        step = INTERVAL_MS[interval]
+        key = (token, interval)
+        with self._key_lock(key):
+            stored = self._read(token, interval)
+            # the candle that is still forming is not stored
+            end = align(int(time.time() * 1000), interval)
+            first = align(int(_naive_utc(start_time).value // 1_000_000), interval) if start_time \
+                else end - limit * step
+            # (start, stop, older than the stored candles)
+            ranges = []
+            if len(stored):
+                stored_first = int(stored['timestamp'].iloc[0].value // 1_000_000)
+                # before the listing date the exchange has nothing, do not ask again
+                if first < stored_first and first < self._history_start.get(key, stored_first):
+                    ranges.append((first, stored_first, True))
+                ranges.append((int(stored['timestamp'].iloc[-1].value // 1_000_000) + step, end, False))
+            else:
+                ranges.append((first, end, False))
+            frames = []
+            pages = sum(len(range(start, stop, step * self.page_size)) for start, stop, _ in ranges)
+            cache_lookup('candles', not pages, pages)
+            for start, stop, older in ranges:
+                fetched, complete = [], True
+                for page in range(start, stop, step * self.page_size):
+                    page_end = min(page + step * self.page_size, stop)
+                    df = self.fetch(token, interval, _utc(page), _utc(page_end - 1), self.page_size)
+                    if df is None:
+                        # every source failed, stop here so the next update retries from this page
+                        logger.warning('failed to fetch {} {} candles from {}', token, interval, _utc(page))
+                        complete = False
+                        break
+                    df = unified_frame(df)
+                    ts = df['timestamp'].to_numpy(dtype='datetime64[ms]').astype(np.int64)
+                    fetched.append(df[(ts >= page) & (ts < page_end)])
+                if older:
+                    # older history is stored all or nothing, part of it would leave a gap before the stored
+                    # candles that no later update looks at. it is only marked as fetched once complete
+                    if not complete:
+                        continue
+                    self._history_start[key] = first
+                frames.extend(fetched)
+            if not frames:
+                return 0
+            new = pd.concat(frames, ignore_index=True)
+            logger.debug('{} {} candles fetched for {}', len(new), interval, token)
+            return self.put(token, interval, new) if len(new) else 0
+
+    def candles(self, token: str, interval: str = '1d', limit: Optional[int] = None,
+                start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                refresh: bool = True) -> pd.DataFrame:
+        """ closed candles of token in the unified candle format
+
+        :param limit: only the last limit candles
+        :param start_time: only candles opening at or after start_time, also where an empty store starts fetching
+        :param end_time: only candles opening before end_time
+        :param refresh: fetch candles closed since the last stored one first
+        """
+        token, interval = token.upper(), normalize_interval(interval)
+        if refresh:
+            self.update(token, interval, start_time=start_time, limit=limit or 1000)
+        df = self._read(token, interval)
+        if start_time is not None:
+            df = df[df['timestamp'] >= _naive_utc(start_time)]
+        if end_time is not None:
+            df = df[df['timestamp'] < _naive_utc(end_time)]
+        if limit is not None:
+            df = df.iloc[-limit:]
+        return df.reset_index(drop=True)
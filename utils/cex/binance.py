@@ -1,9 +1,15 @@
-import requests
-import pandas as pd
 from loguru import logger
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 from datetime import datetime
 
+from utils.http_session import exchange_session
+from utils.interval import exchange_interval
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+_http = exchange_session('binance')
+
 
 def get_current_price(token_name: str):
     """
@@ -15,7 +21,7 @@ def get_current_price(token_name: str):
 
     api_url = 'https://api.binance.com/api/v3/ticker/price'
     params = {'symbol': symbol}
-    response = requests.get(api_url, params=params)
+    response = _http.get(api_url, params=params, weight=2)
     data = response.json()
     if data.get('code',0) == 0:
         return data['price']
@@ -29,10 +35,10 @@ def get_spot_candlesticks(
         start_time: Optional[datetime] = None,
         end_time: Optional[datetime] = None,
         limit: Optional[int] = None
-) -> pd.DataFrame:
+) -> 'pd.DataFrame':
     """
     @param symbol: crypto token name, "BTC" "ETH" etc
-    @param interval: [1s/1m/3m/5m/15m/30m/1h/2h/4h/6h/8h/12h/1d/3d/1w/1M]
+    @param interval: [1m/3m/5m/15m/30m/1h/2h/4h/6h/8h/12h/1d/1w], any spelling of utils.interval
     @param start_time: Optional, UTC timezone
     @param end_time: Optional, UTC timezone
     @param limit:Optional, Default 500; max 1000
@@ -44,7 +50,7 @@ def get_spot_candlesticks(
     api_url = 'https://api.binance.com/api/v3/klines'
     params = {
         'symbol': symbol,
-        'interval': interval,
+        'interval': exchange_interval('binance', interval),
     }
     if start_time is not None and end_time is not None:
         params['startTime'] = 1000 * int(start_time.timestamp())
@@ -52,12 +58,14 @@ def get_spot_candlesticks(
     if limit is not None:
         params['limit'] = 1000 if limit > 1000 or limit < 0 else limit
 
-    response = requests.get(api_url, params=params)
+    response = _http.get(api_url, params=params, weight=2)
     data = response.json()
     if isinstance(data, dict):
         logger.error(data['msg'])
         raise Exception(data['msg'])
 
+    import pandas as pd
+
     # 解析响应数据为DataFrame
     df = pd.DataFrame(data, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time',
                                      'quote_asset_volume', 'trades', 'taker_buy_base', 'taker_buy_quote', 'ignore'])
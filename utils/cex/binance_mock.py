@@ -0,0 +1,162 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+from requests.adapters import HTTPAdapter
+
+from utils.http_session import exchange_session
+from utils.interval import INTERVAL_MS, normalize_interval
+
+BINANCE_URL = 'https://api.binance.com'
+
+
+class MockBinanceServer:
+    """
+    in-process binance spot api for tests and benchmarks
+
+    serves /api/v3/ticker/price and /api/v3/klines from klines fixtures (symbol -> interval -> binance kline
+    rows), klines are filtered by startTime / endTime and cut to limit like the real api, the price of a symbol
+    is the close of its last 1m (or shortest) kline. latency seconds are slept per request to mimic a remote
+    api. route() points utils.cex.binance at the server
+
+    usage:
+        with MockBinanceServer({'BTCUSDT': {'1h': rows}}, latency=0.02) as server, server.route():
+            get_spot_candlesticks('BTC', '1h')
+    """
+
+    def __init__(self, klines: Optional[Dict[str, Dict[str, List[list]]]] = None,
+                 prices: Optional[Dict[str, float]] = None, latency: float = 0.0,
+                 host: str = '127.0.0.1', port: int = 0):
+        """
+        :param klines: symbol (BTCUSDT) -> interval (binance spelling) -> kline rows sorted by open time
+        :param prices: symbol -> ticker price, default the last close of the symbol's klines
+        """
+        self.klines = {s: {normalize_interval(i): rows for i, rows in by_interval.items()}
+                       for s, by_interval in (klines or {}).items()}
+        self.prices = dict(prices or {})
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'MockBinanceServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'MockBinanceServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def route(self, name: str = 'binance') -> 'Redirect':
+        """ send the requests of exchange_session(name) to this server until the returned context exits """
+        return Redirect(name, BINANCE_URL, self.url)
+
+    def price(self, symbol: str) -> Optional[float]:
+        if symbol in self.prices:
+            return self.prices[symbol]
+        by_interval = self.klines.get(symbol)
+        if not by_interval:
+            return None
+        rows = by_interval[min(by_interval, key=INTERVAL_MS.get)]
+        return float(rows[-1][4]) if rows else None
+
+    def get_klines(self, query: dict) -> List[list]:
+        rows = self.klines.get(query.get('symbol'), {}).get(normalize_interval(query.get('interval', '1d')), [])
+        limit = min(int(query.get('limit', 500)), 1000)
+        if 'startTime' in query:
+            start = int(query['startTime'])
+            end = int(query.get('endTime', 2 ** 62))
+            return [r for r in rows if start <= r[0] <= end][:limit]
+        if 'endTime' in query:
+            rows = [r for r in rows if r[0] <= int(query['endTime'])]
+        return rows[-limit:]
+
+    def handle(self, path: str, query: dict):
+        """ :return: (http status, json payload) """
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+        if path == '/api/v3/ticker/price':
+            price = self.price(query.get('symbol'))
+            if price is None:
+                return 400, {'code': -1121, 'msg': 'Invalid symbol.'}
+            return 200, {'symbol': query['symbol'], 'price': f'{price:.8f}'}
+        if path == '/api/v3/klines':
+            if query.get('symbol') not in self.klines:
+                return 400, {'code': -1121, 'msg': 'Invalid symbol.'}
+            return 200, self.get_klines(query)
+        return 404, {'code': -1, 'msg': f'{path} not found'}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                if server.latency:
+                    time.sleep(server.latency)
+                status, payload = server.handle(parts.path, dict(parse_qsl(parts.query)))
+                raw = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class _RedirectAdapter(HTTPAdapter):
+    def __init__(self, source: str, target: str, **kwargs):
+        super().__init__(**kwargs)
+        self.source = source
+        self.target = target
+
+    def send(self, request, **kwargs):
+        request.url = self.target + request.url[len(self.source):]
+        return super().send(request, **kwargs)
+
+
+class Redirect:
+    """ context mounting an adapter on an exchange session that rewrites source urls to target """
+
+    def __init__(self, name: str, source: str, target: str):
+        self.session = exchange_session(name).session
+        self.source = source
+        self.adapter = _RedirectAdapter(source, target, pool_maxsize=16)
+
+    def __enter__(self) -> 'Redirect':
+        self.session.mount(self.source, self.adapter)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.session.adapters.pop(self.source, None)
+        self.adapter.close()
+
+
+if __name__ == "__main__":
+    from benchmarks.fixtures import synthetic_market
+    from utils.cex.binance import get_current_price, get_spot_candlesticks
+
+    with MockBinanceServer(synthetic_market(['BTCUSDT', 'ETHUSDT'])) as server, server.route():
+        print(get_current_price('btc'))
+        print(get_spot_candlesticks('eth', '1h', limit=5))
@@ -1,9 +1,11 @@
-import requests
-import pandas as pd
 from loguru import logger
 from typing import Optional
 from datetime import datetime
 
+from utils.http_session import exchange_session
+
+_http = exchange_session('bitget')
+
 
 def get_current_price(token_name: str):
     """
@@ -15,7 +17,7 @@ def get_current_price(token_name: str):
 
     url = "https://api.bitget.com/api/v2/spot/market/tickers"
     params = {"symbol": symbol}
-    response = requests.get(url, params=params)
+    response = _http.get(url, params=params)
     data = response.json()
     if data.get("code") == "00000":
         ticker_data = data.get("data", [])[0]
@@ -1,9 +1,15 @@
-import requests
-import pandas as pd
 from loguru import logger
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 from datetime import datetime
 
+from utils.http_session import exchange_session
+from utils.interval import exchange_interval
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+_http = exchange_session('gate')
+
 
 def get_current_price(token_name: str):
     """
@@ -14,7 +20,7 @@ def get_current_price(token_name: str):
     symbol = token_name if token_name[-5:] == '_usdt' else token_name + '_usdt'
 
     url = f'https://data.gateapi.io/api2/1/ticker/{symbol}'
-    response = requests.get(url)
+    response = _http.get(url)
     data = response.json()
     if data.get('code', 0) == 0:
         return data['last']
@@ -24,7 +30,7 @@ def get_current_price(token_name: str):
 
 def get_spot_candlesticks(
         token_name: str,
-        interval='1D',
+        interval='1d',
         start_time: Optional[datetime] = None,
         end_time: Optional[datetime] = None,
         limit: Optional[int] = None
@@ -32,7 +38,7 @@ def get_spot_candlesticks(
     """
     https://www.gate.io/docs/developers/apiv4/zh_CN/#%E5%B8%82%E5%9C%BA-k-%E7%BA%BF%E5%9B%BE
     @param token_name: crypto token name, "BTC" "ETH" etc, token-usdt pair by default
-    @param interval: default 1m, [1m/3m/5m/15m/30m/1H/2H/4H],HKT：[6H/12H/1D/1W/1M],[/6Hutc/12Hutc/1Dutc/1Wutc/1Mutc]
+    @param interval: [1m/5m/15m/30m/1h/4h/8h/1d/1w], any spelling of utils.interval
     @param end_time: Optional, end_time of spot candlesticks
     @param start_time: Optional, default end_time - 100 * intervals
     @param limit: max 1000
@@ -45,7 +51,7 @@ def get_spot_candlesticks(
     url = f'https://api.gateio.ws/api/v4/spot/candlesticks'
     params = {
         'currency_pair': symbol,
-        'interval': interval,
+        'interval': exchange_interval('gate', interval),
     }
     if start_time is not None and end_time is not None:
         params['from'] = int(start_time.timestamp())
@@ -53,11 +59,12 @@ def get_spot_candlesticks(
     if limit is not None:
         params['limit'] = 1000 if limit > 1000 or limit < 0 else limit
     # request api
-    response = requests.request('GET', url, headers=headers, params=params)
+    response = _http.get(url, headers=headers, params=params)
     data = response.json()
     # parse data
     if isinstance(data, dict):
         raise Exception(data['message'])
+    import pandas as pd
     df = pd.DataFrame(data, columns=[
         'timestamp', 'quote_volume', 'close', 'high', 'low', 'open', 'base_volume', 'confirmed'
     ])
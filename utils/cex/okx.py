@@ -1,9 +1,15 @@
-import requests
-import pandas as pd
 from loguru import logger
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 from datetime import datetime
 
+from utils.http_session import exchange_session
+from utils.interval import exchange_interval
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+_http = exchange_session('okx')
+
 
 def get_current_price(token_name: str):
     """
@@ -14,7 +20,7 @@ def get_current_price(token_name: str):
     token_name = token_name[:-4] if token_name[-4:] == "USDT" else token_name
 
     url = f"https://www.okx.com/api/v5/market/ticker?instId={token_name}-USDT"
-    response = requests.get(url)
+    response = _http.get(url, bucket='ticker')
     data = response.json()
     if data.get('code') == '0':
         return data["data"][0]["last"]
@@ -32,7 +38,8 @@ def get_spot_candlesticks(
     """
     https://www.okx.com/docs-v5/en/?python#public-data-rest-api-get-index-candlesticks-history
     @param token_name: crypto token name, "BTC" "ETH" etc, token-usdt pair by default
-    @param interval: default 1m, [1m/3m/5m/15m/30m/1H/2H/4H],HKT：[6H/12H/1D/1W/1M],[/6Hutc/12Hutc/1Dutc/1Wutc/1Mutc]
+    @param interval: [1m/3m/5m/15m/30m/1h/2h/4h/6h/12h/1d/1w], any spelling of utils.interval,
+                     6h and longer are utc candles
     @param end_time: Optional, end_time of spot candlesticks
     @param start_time: Optional, start_time of spot candlesticks
     @param limit: default 100, max 100
@@ -42,22 +49,20 @@ def get_spot_candlesticks(
     symbol = symbol[:-4] if symbol[-4:] == "USDT" else symbol
     symbol = symbol[:-4] if symbol[-1] in ("-", "_") else symbol
 
-    if interval not in ('1m', '3m', '5m', '15m', '30m'):
-        interval = interval.upper()
-
     url = f'https://www.okx.com/api/v5/market/history-index-candles'
     params = {
         'instId': symbol + '-USDT',
-        'bar': interval,
+        'bar': exchange_interval('okx', interval),
     }
     if start_time is not None and end_time is not None:
         params['before'] = str(1000 * int(start_time.timestamp()))
         params['after'] = str(1000 * int(end_time.timestamp()))
     if limit is not None:
         params['limit'] = 100 if limit > 100 or limit < 0 else limit
-    response = requests.get(url, params=params)
+    response = _http.get(url, params=params, bucket='history-index-candles')
     if response.json()['code'] == '0':
         data = response.json()['data']
+        import pandas as pd
         df = pd.DataFrame(data, columns=['timestamp', 'open', 'high', 'low', 'close', 'confirmed'])
         df['timestamp'] = pd.to_numeric(df['timestamp'])
         df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
@@ -1,10 +1,9 @@
-import os
 from enum import Enum
+from typing import List
 
 from loguru import logger
-from dotenv import load_dotenv
 
-load_dotenv()
+from utils.env import getenv
 
 
 class Chain(Enum):
@@ -37,19 +36,26 @@ class Chain(Enum):
     
     @classmethod
     def from_env(cls):
-        return cls.from_string(os.getenv("CHAIN"))
+        return cls.from_string(getenv("CHAIN"))
     
     @property
-    def url(self) -> str:
+    def urls(self) -> List[str]:
+        """ rpc urls of the chain, *_CHAIN_URL may list several nodes separated by commas """
         env_name = '{}_CHAIN_URL'.format(self.value.upper())
-        chain_url = os.getenv(env_name, '')
-        if not chain_url:
+        urls = [u.strip() for u in getenv(env_name, '').split(',') if u.strip()]
+        if not urls:
             logger.warning('chain {} url not found in environment', self.value)
-        return chain_url
+        return urls
+
+    @property
+    def url(self) -> str:
+        """ first rpc url of the chain, use utils.rpc.router(chain) to spread requests over all of them """
+        urls = self.urls
+        return urls[0] if urls else ''
 
     @property
     def valid(self) -> bool:
-        valid_chain = os.getenv("VALID_CHAIN").split(',')
+        valid_chain = getenv("VALID_CHAIN").split(',')
         return self.value in valid_chain
 
 
@@ -1,28 +1,60 @@
-import os
 import base64
 import json
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Iterator, List, Optional
+
 from cryptography.hazmat.primitives.asymmetric import ed25519
-from dotenv import load_dotenv, find_dotenv
-load_dotenv(find_dotenv())
+
+from utils.env import getenv
+from utils.http_session import ExchangeSession, exchange_session
 
 BP_BASE_URL = ' https://api.backpack.exchange/'
 
-bpx_api_key = os.getenv("BPX_API_KEY")
-bpx_api_secret = os.getenv("BPX_API_SECRET")
+# max limit of the history endpoints
+PAGE_SIZE = 1000
+# max orders per batch order request
+BATCH_SIZE = 20
+
+
+@lru_cache(maxsize=64)
+def _instruction_prefix(instruction: str) -> str:
+    return f"instruction={instruction}" if instruction else ""
+
+
+def _param_value(value) -> str:
+    # booleans are signed lowercase, as serialised in query strings and json bodies
+    if value is True or value is False:
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def signing_string(instruction: str, params: dict) -> str:
+    """ instruction and params part of the string to sign, without timestamp and window """
+    prefix = _instruction_prefix(instruction)
+    if not params:
+        return prefix
+    body = "&".join(f"{key}={_param_value(params[key])}" for key in sorted(params))
+    return f"{prefix}&{body}" if prefix else body
 
 
 class BpxClient:
     url = 'https://api.backpack.exchange/'
     private_key: ed25519.Ed25519PrivateKey
 
-    def __init__(self, api_key, api_secret):
+    def __init__(self, api_key, api_secret, url: Optional[str] = None, http: Optional[ExchangeSession] = None):
+        """
+        :param url: api base url, default the public api, point it at MockBackpackServer.url in tests
+        :param http: session to send requests with, default the shared rate-limited backpack session
+        """
         self.debug = False
         self.proxies = {
             'http': '',
             'https': ''
         }
+        if url is not None:
+            self.url = url if url.endswith('/') else url + '/'
         self.api_key = api_key
         self.api_secret = api_secret
         self.private_key = ed25519.Ed25519PrivateKey.from_private_bytes(
@@ -30,39 +62,89 @@ class BpxClient:
         )
         self.debugTs = 0
         self.window = 5000
+        self.http = http if http is not None else exchange_session('backpack')
+
+    @property
+    def window(self) -> int:
+        return self._window
+
+    @window.setter
+    def window(self, window: int):
+        # headers and the signing suffix only change with the window, build them once
+        self._window = window
+        self._window_suffix = f"&window={window}"
+        self._header_template = {
+            "X-API-Key": self.api_key,
+            "X-Window": str(window),
+            "Content-Type": "application/json; charset=utf-8",
+        }
+
+    def _get(self, path: str, instruction: str, params: dict):
+        return self.http.get(url=self.url + path, proxies=self.proxies, params=params,
+                             headers=self.sign(instruction, params)).json()
 
     # capital
     def balances(self):
-        return requests.get(url=f'{self.url}api/v1/capital', proxies=self.proxies,
-                            headers=self.sign('balanceQuery', {})).json()
-    
+        return self._get('api/v1/capital', 'balanceQuery', {})
+
     def deposits(self):
-        return requests.get(url=f'{self.url}wapi/v1/capital/deposits', proxies=self.proxies,
-                            headers=self.sign('depositQueryAll', {})).json()
+        return self._get('wapi/v1/capital/deposits', 'depositQueryAll', {})
 
     def depositAddress(self, chain: str):
-        params = {'blockchain': chain}
-        return requests.get(url=f'{self.url}wapi/v1/capital/deposit/address', proxies=self.proxies, params=params,
-                            headers=self.sign('depositAddressQuery', params)).json()
+        return self._get('wapi/v1/capital/deposit/address', 'depositAddressQuery', {'blockchain': chain})
 
     def withdrawals(self, limit: int, offset: int):
         params = {'limit': limit, 'offset': offset}
-        return requests.get(url=f'{self.url}wapi/v1/capital/withdrawals', proxies=self.proxies, params=params,
-                            headers=self.sign('withdrawalQueryAll', params)).json()
+        return self._get('wapi/v1/capital/withdrawals', 'withdrawalQueryAll', params)
 
     # history
 
     def orderHistoryQuery(self, symbol: str, limit: int, offset: int):
         params = {'symbol': symbol, 'limit': limit, 'offset': offset}
-        return requests.get(url=f'{self.url}wapi/v1/history/orders', proxies=self.proxies, params=params,
-                            headers=self.sign('orderHistoryQueryAll', params)).json()
+        return self._get('wapi/v1/history/orders', 'orderHistoryQueryAll', params)
 
     def fillHistoryQuery(self, symbol: str, limit: int, offset: int):
         params = {'limit': limit, 'offset': offset}
         if len(symbol) > 0:
             params['symbol'] = symbol
-        return requests.get(url=f'{self.url}wapi/v1/history/fills', proxies=self.proxies, params=params,
-                            headers=self.sign('fillHistoryQueryAll', params)).json()
+        return self._get('wapi/v1/history/fills', 'fillHistoryQueryAll', params)
+
+    # auto pagination
+
+    def paginate(self, query: Callable[[int, int], list], page_size: int = PAGE_SIZE,
+                 prefetch: bool = True) -> Iterator[dict]:
+        """ iterate over every row of a limit / offset query
+
+        the next page is requested in a background thread while the current page is consumed,
+        iteration stops at the first page shorter than page_size
+
+        :param query: function of (limit, offset) returning one page as a list
+        :param page_size: rows per request
+        :param prefetch: request the next page before the current one is consumed
+        """
+        offset = 0
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(query, page_size, offset)
+            while future is not None:
+                page = future.result()
+                if not isinstance(page, list):
+                    raise ValueError(f'unexpected page at offset {offset}: {page}')
+                offset += page_size
+                future = None
+                if len(page) == page_size and prefetch:
+                    future = pool.submit(query, page_size, offset)
+                yield from page
+                if len(page) == page_size and not prefetch:
+                    future = pool.submit(query, page_size, offset)
+
+    def iterOrderHistory(self, symbol: str, page_size: int = PAGE_SIZE) -> Iterator[dict]:
+        return self.paginate(lambda limit, offset: self.orderHistoryQuery(symbol, limit, offset), page_size)
+
+    def iterFillHistory(self, symbol: str = '', page_size: int = PAGE_SIZE) -> Iterator[dict]:
+        return self.paginate(lambda limit, offset: self.fillHistoryQuery(symbol, limit, offset), page_size)
+
+    def iterWithdrawals(self, page_size: int = PAGE_SIZE) -> Iterator[dict]:
+        return self.paginate(self.withdrawals, page_size)
 
     # order
 
@@ -72,8 +154,7 @@ class BpxClient:
             params['orderId'] = orderId
         if clientId > -1:
             params['clientId'] = clientId
-        return requests.get(url=f'{self.url}api/v1/order', proxies=self.proxies, params=params,
-                            headers=self.sign('orderQuery', params)).json()
+        return self._get('api/v1/order', 'orderQuery', params)
 
     def ExeOrder(self, symbol, side, orderType, timeInForce, quantity, price):
         params = {
@@ -88,8 +169,8 @@ class BpxClient:
             params['postOnly'] = True
         else:
             params['timeInForce'] = timeInForce
-        return requests.post(url=f'{self.url}api/v1/order', proxies=self.proxies, data=json.dumps(params),
-                             headers=self.sign('orderExecute', params))
+        return self.http.post(url=f'{self.url}api/v1/order', proxies=self.proxies, data=json.dumps(params),
+                              headers=self.sign('orderExecute', params))
 
     def orderCancel(self, symbol: str, orderId: str, clientId: int = -1):
         params = {'symbol': symbol}
@@ -97,57 +178,59 @@ class BpxClient:
             params['orderId'] = orderId
         if clientId > -1:
             params['clientId'] = clientId
-        return requests.delete(url=f'{self.url}api/v1/order', proxies=self.proxies, data=json.dumps(params),
-                               headers=self.sign('orderCancel', params)).json()
+        return self.http.delete(url=f'{self.url}api/v1/order', proxies=self.proxies, data=json.dumps(params),
+                                headers=self.sign('orderCancel', params)).json()
 
     def ordersQuery(self, symbol: str):
         params = {}
         if len(symbol) > 0:
             params['symbol'] = symbol
-
-        return requests.get(url=f'{self.url}api/v1/orders', proxies=self.proxies, params=params,
-                            headers=self.sign('orderQueryAll', params)).json()
+        return self._get('api/v1/orders', 'orderQueryAll', params)
 
     def ordersCancel(self, symbol: str):
         params = {'symbol': symbol}
-        return requests.delete(url=f'{self.url}api/v1/orders', proxies=self.proxies, data=json.dumps(params),
-                               headers=self.sign('orderCancelAll', params)).json()
+        return self.http.delete(url=f'{self.url}api/v1/orders', proxies=self.proxies, data=json.dumps(params),
+                                headers=self.sign('orderCancelAll', params)).json()
+
+    def ExeOrders(self, orders: List[dict]):
+        """ place up to BATCH_SIZE orders in one request
+
+        :param orders: order params as in ExeOrder, such as
+                       {'symbol': 'SOL_USDC', 'side': 'Bid', 'orderType': 'Limit', 'quantity': '0.5',
+                        'price': '111.2', 'timeInForce': 'GTC'}
+        :return: response, its json is one result per order (the order, or an error with code and message)
+        """
+        return self.http.post(url=f'{self.url}api/v1/orders', proxies=self.proxies, data=json.dumps(orders),
+                              headers=self.sign_batch('orderExecute', orders))
 
     def sign(self, instruction: str, params: dict):
-        sign_str = f"instruction={instruction}" if instruction else ""
-        if 'postOnly' in params:
-            params = params.copy()
-            params['postOnly'] = str(params['postOnly']).lower()
-        sorted_params = "&".join(
-            f"{key}={value}" for key, value in sorted(params.items())
-        )
-        if sorted_params:
-            sign_str += "&" + sorted_params
+        return self._signed_headers(signing_string(instruction, params))
+
+    def sign_batch(self, instruction: str, params_list: List[dict]):
+        """ batch requests sign the instruction and params of every item, joined by & """
+        return self._signed_headers("&".join(signing_string(instruction, p) for p in params_list))
+
+    def _signed_headers(self, sign_str: str):
         ts = int(time.time() * 1e3)
 
         if self.debug and self.debugTs > 0:
             ts = self.debugTs
 
-        sign_str += f"&timestamp={ts}&window={self.window}"
-        signature_bytes = self.private_key.sign(sign_str.encode())
-        encoded_signature = base64.b64encode(signature_bytes).decode()
+        sign_str += f"&timestamp={ts}{self._window_suffix}"
+        encoded_signature = base64.b64encode(self.private_key.sign(sign_str.encode())).decode()
 
         if self.debug:
             print(f'Waiting Sign Str: {sign_str}')
             print(f"Signature: {encoded_signature}")
 
-        headers = {
-            "X-API-Key": self.api_key,
-            "X-Signature": encoded_signature,
-            "X-Timestamp": str(ts),
-            "X-Window": str(self.window),
-            "Content-Type": "application/json; charset=utf-8",
-        }
+        headers = self._header_template.copy()
+        headers["X-Signature"] = encoded_signature
+        headers["X-Timestamp"] = str(ts)
         return headers
 
 
 def main():
-    my_bpx = BpxClient(bpx_api_key,bpx_api_secret)
+    my_bpx = BpxClient(getenv("BPX_API_KEY"), getenv("BPX_API_SECRET"))
     my_balance = my_bpx.balances()
     print(my_balance)
     # order_test = my_bpx.ExeOrder(symbol="SOL_USDC",side="Ask",orderType="Limit",timeInForce="GTC",quantity=0.5,price=111.3)
@@ -0,0 +1,200 @@
+import asyncio
+import json
+from typing import List, Optional, Tuple
+
+import aiohttp
+from loguru import logger
+
+from utils.dex.backpack import BATCH_SIZE, BpxClient
+from utils.http_session import ExchangeSession, TokenBucket, exchange_session
+
+
+def order_params(symbol: str, side: str, quantity, price, order_type: str = 'Limit', time_in_force: str = 'GTC',
+                 client_id: Optional[int] = None) -> dict:
+    """ order params as signed and sent by BpxClient.ExeOrder, an empty time_in_force places a post only order """
+    params = {'symbol': symbol, 'side': side, 'orderType': order_type, 'quantity': str(quantity), 'price': str(price)}
+    if len(time_in_force) < 1:
+        params['postOnly'] = True
+    else:
+        params['timeInForce'] = time_in_force
+    if client_id is not None:
+        params['clientId'] = client_id
+    return params
+
+
+def _error(code: str, message) -> dict:
+    return {'code': code, 'message': str(message)}
+
+
+def is_error(result: dict) -> bool:
+    """ per-order results are either the order or an error dict with code and message """
+    return 'id' not in result and 'code' in result
+
+
+class AsyncBpxClient(BpxClient):
+    """
+    asyncio Backpack client for placing and cancelling many orders at once
+
+    shares signing with BpxClient and the rate limit bucket of the shared backpack session, so sync and async
+    requests of one process stay under the same limit. orders are sent through the batch order endpoint in
+    chunks of batch_size, at most max_concurrency requests are in flight, and every helper returns one result
+    per input order instead of raising on the first failure
+
+    usage:
+        async with AsyncBpxClient(api_key, api_secret) as client:
+            results = await client.place_orders([order_params('SOL_USDC', 'Bid', 0.5, 111.2), ...])
+    """
+
+    def __init__(self, api_key, api_secret, url: Optional[str] = None, max_concurrency: int = 10,
+                 batch_size: int = BATCH_SIZE, use_batch: bool = True, timeout: float = 30,
+                 bucket: Optional[TokenBucket] = None):
+        """
+        :param max_concurrency: max requests in flight
+        :param batch_size: orders per batch request
+        :param use_batch: send orders through the batch endpoint, otherwise one concurrent request per order
+        :param bucket: rate limit bucket, default the bucket of the shared backpack session
+        """
+        super().__init__(api_key, api_secret, url=url)
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.use_batch = use_batch
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.bucket = bucket if bucket is not None else exchange_session('backpack').buckets['default']
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> 'AsyncBpxClient':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method: str, path: str, instruction: str, params: Optional[dict] = None,
+                       body=None) -> Tuple[int, object]:
+        # session and semaphore belong to the running loop, create them on first use
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=self.timeout, connector=aiohttp.TCPConnector(limit=self.max_concurrency))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            wait = self.bucket.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            # sign after the rate limit wait so queued requests do not outlive the signing window
+            if isinstance(body, list):
+                headers = self.sign_batch(instruction, body)
+            else:
+                headers = self.sign(instruction, params if params is not None else body)
+            async with self._session.request(method, self.url + path, params=params, headers=headers,
+                                             data=None if body is None else json.dumps(body)) as resp:
+                try:
+                    data = await resp.json(content_type=None)
+                except ValueError:
+                    data = _error(str(resp.status), await resp.text())
+                return resp.status, data
+
+    async def _call(self, method: str, path: str, instruction: str, params: Optional[dict] = None, body=None):
+        try:
+            status, data = await self._request(method, path, instruction, params, body)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return _error('REQUEST_FAILED', repr(e))
+        if status >= 400 and not (isinstance(data, dict) and 'code' in data):
+            return _error(str(status), data)
+        return data
+
+    # query
+
+    async def open_orders(self, symbol: str) -> List[dict]:
+        params = {'symbol': symbol}
+        data = await self._call('GET', 'api/v1/orders', 'orderQueryAll', params=params)
+        if isinstance(data, dict) and is_error(data):
+            raise ValueError(f'open orders query failed: {data}')
+        return data
+
+    # order
+
+    async def place_order(self, params: dict) -> dict:
+        """ :param params: see order_params, :return: the order or an error dict """
+        return await self._call('POST', 'api/v1/order', 'orderExecute', body=params)
+
+    async def _place_batch(self, orders: List[dict]) -> List[dict]:
+        data = await self._call('POST', 'api/v1/orders', 'orderExecute', body=orders)
+        if isinstance(data, list) and len(data) == len(orders):
+            return data
+        logger.error('batch order of {} failed: {}', len(orders), data)
+        return [data if isinstance(data, dict) else _error('BATCH_FAILED', data)] * len(orders)
+
+    async def place_orders(self, orders: List[dict]) -> List[dict]:
+        """ place many orders concurrently
+
+        :param orders: order params, see order_params
+        :return: one result per order in the same order, the order or an error dict (see is_error)
+        """
+        if not orders:
+            return []
+        if not self.use_batch:
+            return list(await asyncio.gather(*(self.place_order(o) for o in orders)))
+        chunks = [orders[i:i + self.batch_size] for i in range(0, len(orders), self.batch_size)]
+        results = await asyncio.gather(*(self._place_batch(chunk) for chunk in chunks))
+        return [r for chunk in results for r in chunk]
+
+    async def cancel_order(self, symbol: str, order_id: str) -> dict:
+        params = {'symbol': symbol, 'orderId': order_id}
+        return await self._call('DELETE', 'api/v1/order', 'orderCancel', body=params)
+
+    async def cancel_orders(self, symbol: str, order_ids: List[str]) -> List[dict]:
+        """ cancel many orders concurrently (backpack has no cancel by ids batch endpoint)
+
+        :return: one result per order id, the cancelled order or an error dict
+        """
+        return list(await asyncio.gather(*(self.cancel_order(symbol, i) for i in order_ids)))
+
+    async def cancel_all(self, symbol: str) -> List[dict]:
+        params = {'symbol': symbol}
+        data = await self._call('DELETE', 'api/v1/orders', 'orderCancelAll', body=params)
+        return data if isinstance(data, list) else [data]
+
+    async def replace_orders(self, symbol: str, order_ids: List[str],
+                             orders: List[dict]) -> Tuple[List[dict], List[dict]]:
+        """ cancel order_ids and place orders, new orders are only sent after every cancel has returned
+        so the account never holds both grids at once
+
+        :return: (cancel results, place results)
+        """
+        cancelled = await self.cancel_orders(symbol, order_ids)
+        placed = await self.place_orders(orders)
+        return cancelled, placed
+
+
+if __name__ == '__main__':
+    import time
+
+    from utils.dex.backpack_mock import MockBackpackServer, generate_keys
+
+    key, secret = generate_keys()
+    grid = [order_params('SOL_USDC', 'Bid', '0.1', f'{100 + i * 0.1:.1f}') for i in range(200)]
+
+    async def bench(server: MockBackpackServer, use_batch: bool):
+        async with AsyncBpxClient(key, secret, url=server.url, use_batch=use_batch,
+                                  bucket=TokenBucket(1000, 1)) as client:
+            start = time.perf_counter()
+            placed = await client.place_orders(grid)
+            elapsed = time.perf_counter() - start
+            await client.cancel_all('SOL_USDC')
+        return sum(not is_error(r) for r in placed), elapsed
+
+    with MockBackpackServer(latency=0.05) as mock:
+        sync_client = BpxClient(key, secret, url=mock.url, http=ExchangeSession('mock', {'default': (1000, 1)}))
+        start = time.perf_counter()
+        for params in grid:
+            sync_client.ExeOrder(params['symbol'], params['side'], 'Limit', 'GTC', params['quantity'], params['price'])
+        print(f'sequential: {len(grid)} orders in {time.perf_counter() - start:.2f}s')
+        sync_client.ordersCancel('SOL_USDC')
+        for batch in (False, True):
+            ok, seconds = asyncio.run(bench(mock, batch))
+            print(f'async use_batch={batch}: {ok} orders in {seconds:.2f}s')
@@ -0,0 +1,248 @@
+import base64
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from utils.dex.backpack import signing_string
+
+# (method, path) -> signing instruction
+ROUTES = {
+    ('GET', '/api/v1/capital'): 'balanceQuery',
+    ('GET', '/wapi/v1/capital/deposits'): 'depositQueryAll',
+    ('GET', '/wapi/v1/capital/deposit/address'): 'depositAddressQuery',
+    ('GET', '/wapi/v1/capital/withdrawals'): 'withdrawalQueryAll',
+    ('GET', '/wapi/v1/history/orders'): 'orderHistoryQueryAll',
+    ('GET', '/wapi/v1/history/fills'): 'fillHistoryQueryAll',
+    ('GET', '/api/v1/order'): 'orderQuery',
+    ('POST', '/api/v1/order'): 'orderExecute',
+    ('POST', '/api/v1/orders'): 'orderExecute',
+    ('DELETE', '/api/v1/order'): 'orderCancel',
+    ('GET', '/api/v1/orders'): 'orderQueryAll',
+    ('DELETE', '/api/v1/orders'): 'orderCancelAll',
+}
+
+
+def generate_keys() -> Tuple[str, str]:
+    """ :return: (api_key, api_secret) of a new ed25519 key pair, base64 encoded like real backpack keys """
+    private_key = ed25519.Ed25519PrivateKey.generate()
+    secret = private_key.private_bytes(serialization.Encoding.Raw, serialization.PrivateFormat.Raw,
+                                       serialization.NoEncryption())
+    public = private_key.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    return base64.b64encode(public).decode(), base64.b64encode(secret).decode()
+
+
+class MockBackpackServer:
+    """
+    in-process Backpack api for tests and benchmarks
+
+    serves the endpoints used by BpxClient on a local port, checks the ed25519 signature of every request
+    against X-API-Key, keeps open orders in memory and pages fills / order history / withdrawals newest first by
+    limit / offset, latency seconds are slept per request to mimic a remote api
+
+    usage:
+        with MockBackpackServer(fills=10000, latency=0.05) as server:
+            client = BpxClient(api_key, api_secret, url=server.url)
+    """
+
+    def __init__(self, fills: int = 0, symbol: str = 'SOL_USDC', latency: float = 0.0, verify: bool = True,
+                 host: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self.verify = verify
+        self.lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self._ids = itertools.count(1)
+        self.open_orders: Dict[str, dict] = {}
+        self.order_history: List[dict] = []
+        self.fills: List[dict] = [
+            {'tradeId': i, 'orderId': str(100000 + i), 'symbol': symbol, 'side': 'Bid' if i % 2 else 'Ask',
+             'price': f'{100 + i % 50:.2f}', 'quantity': '0.1', 'fee': '0.0001', 'feeSymbol': 'USDC',
+             'isMaker': True, 'timestamp': f'2024-01-01T00:00:{i % 60:02d}'}
+            for i in range(fills)]
+        self.withdrawals: List[dict] = []
+        self.balances = {'USDC': {'available': '10000', 'locked': '0', 'staked': '0'}}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self) -> 'MockBackpackServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'MockBackpackServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def fill(self, order_id: str) -> Optional[dict]:
+        """ fill an open order completely, it disappears from open orders and is added to fills """
+        with self.lock:
+            order = self.open_orders.pop(order_id, None)
+            if order is None:
+                return None
+            order['status'] = 'Filled'
+            order['executedQuantity'] = order['quantity']
+            self.fills.append({'tradeId': len(self.fills), 'orderId': order_id, 'symbol': order['symbol'],
+                               'side': order['side'], 'price': order['price'], 'quantity': order['quantity'],
+                               'fee': '0', 'feeSymbol': 'USDC', 'isMaker': True, 'timestamp': _now()})
+            return order
+
+    # request handling
+
+    def _check_signature(self, signed: str, headers) -> Optional[str]:
+        try:
+            api_key = headers['X-API-Key']
+            ts = int(headers['X-Timestamp'])
+            window = int(headers['X-Window'])
+            signature = base64.b64decode(headers['X-Signature'])
+        except (KeyError, TypeError, ValueError):
+            return 'missing signature headers'
+        message = f"{signed}&timestamp={ts}&window={window}"
+        try:
+            ed25519.Ed25519PublicKey.from_public_bytes(base64.b64decode(api_key)).verify(signature, message.encode())
+        except (InvalidSignature, ValueError):
+            return 'invalid signature'
+        return None
+
+    def handle(self, method: str, path: str, params: dict) -> Tuple[int, object]:
+        """ :return: (http status, json body) of one verified request """
+        instruction = ROUTES[(method, path)]
+        with self.lock:
+            self.requests[instruction] = self.requests.get(instruction, 0) + 1
+            if instruction in ('fillHistoryQueryAll', 'orderHistoryQueryAll', 'withdrawalQueryAll'):
+                rows = {'fillHistoryQueryAll': self.fills, 'orderHistoryQueryAll': self.order_history,
+                        'withdrawalQueryAll': self.withdrawals}[instruction]
+                # stored oldest first, served newest first like the real api
+                rows = [r for r in reversed(rows) if 'symbol' not in params or r.get('symbol') == params['symbol']]
+                offset = int(params.get('offset', 0))
+                return 200, rows[offset:offset + int(params.get('limit', 100))]
+            if instruction == 'balanceQuery':
+                return 200, self.balances
+            if instruction == 'depositQueryAll':
+                return 200, []
+            if instruction == 'depositAddressQuery':
+                return 200, {'address': '0x' + '00' * 20}
+            if instruction == 'orderExecute':
+                try:
+                    if float(params['quantity']) <= 0 or float(params['price']) <= 0:
+                        raise ValueError('quantity and price must be positive')
+                except (KeyError, TypeError, ValueError) as e:
+                    return 400, {'code': 'INVALID_ORDER', 'message': str(e)}
+                order_id = str(next(self._ids))
+                order = {'id': order_id, 'symbol': params['symbol'], 'side': params['side'],
+                         'orderType': params['orderType'], 'quantity': str(params['quantity']),
+                         'price': str(params['price']), 'executedQuantity': '0', 'status': 'New',
+                         'timeInForce': params.get('timeInForce', 'GTC'), 'createdAt': _now()}
+                self.open_orders[order_id] = order
+                self.order_history.append(order)
+                return 200, order
+            if instruction == 'orderQueryAll':
+                return 200, [o for o in self.open_orders.values()
+                             if 'symbol' not in params or o['symbol'] == params['symbol']]
+            if instruction == 'orderQuery':
+                order = self.open_orders.get(params.get('orderId'))
+                return (200, order) if order else (404, {'code': 'RESOURCE_NOT_FOUND', 'message': 'Order not found'})
+            if instruction == 'orderCancel':
+                order = self.open_orders.pop(params.get('orderId'), None)
+                if order is None:
+                    return 404, {'code': 'RESOURCE_NOT_FOUND', 'message': 'Order not found'}
+                order['status'] = 'Cancelled'
+                return 200, order
+            if instruction == 'orderCancelAll':
+                cancelled = [o for o in self.open_orders.values() if o['symbol'] == params['symbol']]
+                for order in cancelled:
+                    order['status'] = 'Cancelled'
+                    del self.open_orders[order['id']]
+                return 200, cancelled
+        return 404, {'code': 'NOT_FOUND', 'message': path}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _serve(self, method: str):
+                parts = urlsplit(self.path)
+                params = dict(parse_qsl(parts.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length)) if length else {}
+                # batch endpoints take a list body and sign every item
+                batch = payload if isinstance(payload, list) else None
+                if batch is None:
+                    params.update(payload)
+                instruction = ROUTES.get((method, parts.path))
+                if instruction is None:
+                    status, body = 404, {'code': 'NOT_FOUND', 'message': parts.path}
+                else:
+                    signed = "&".join(signing_string(instruction, p) for p in batch) if batch is not None \
+                        else signing_string(instruction, params)
+                    error = server._check_signature(signed, self.headers) if server.verify else None
+                    if error:
+                        status, body = 401, {'code': 'UNAUTHORIZED', 'message': error}
+                    elif batch is not None:
+                        status, body = 200, [server.handle(method, parts.path, p)[1] for p in batch]
+                    else:
+                        status, body = server.handle(method, parts.path, params)
+                if server.latency > 0:
+                    time.sleep(server.latency)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._serve('GET')
+
+            def do_POST(self):
+                self._serve('POST')
+
+            def do_DELETE(self):
+                self._serve('DELETE')
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def _now() -> str:
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())
+
+
+if __name__ == '__main__':
+    from utils.dex.backpack import BpxClient
+
+    key, secret = generate_keys()
+    with MockBackpackServer(fills=20000, latency=0.05) as mock:
+        bpx = BpxClient(key, secret, url=mock.url)
+        for prefetch in (False, True):
+            start = time.perf_counter()
+            rows = []
+            for i, fill in enumerate(bpx.paginate(lambda limit, offset: bpx.fillHistoryQuery('', limit, offset),
+                                                  prefetch=prefetch)):
+                if i % 1000 == 0:
+                    # stands in for writing a page to disk
+                    time.sleep(0.05)
+                rows.append(fill)
+            print(f'prefetch={prefetch}: {len(rows)} fills in {time.perf_counter() - start:.2f}s')
@@ -0,0 +1,19 @@
+import os
+from typing import Optional
+
+_loaded = False
+
+
+def load_env() -> None:
+    """ read the .env file into os.environ on first use instead of at import, variables already set win """
+    global _loaded
+    if not _loaded:
+        _loaded = True
+        from dotenv import find_dotenv, load_dotenv
+        load_dotenv(find_dotenv())
+
+
+def getenv(name: str, default: Optional[str] = None) -> Optional[str]:
+    """ os.getenv after the .env file is loaded """
+    load_env()
+    return os.getenv(name, default)
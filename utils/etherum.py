@@ -1,10 +1,12 @@
 import json
 import re
-import time
-from functools import wraps
-from typing import Any, List, Optional, Iterable, NewType
+from typing import Any, Dict, List, Optional, Iterable, NewType
 
-from eth_abi import encode_abi, decode_abi
+try:
+    from eth_abi import encode_abi, decode_abi
+except ImportError:
+    # eth_abi >= 4 renamed encode_abi / decode_abi
+    from eth_abi import encode as encode_abi, decode as decode_abi
 from eth_abi.exceptions import DecodingError
 from eth_utils import event_abi_to_log_topic, encode_hex, function_abi_to_4byte_selector
 from eth_utils.abi import collapse_if_tuple
@@ -13,7 +15,10 @@ from loguru import logger
 from web3 import Web3
 from web3.types import LogReceipt, EventData
 
-from chain import Chain
+from utils.chain import Chain
+from utils.metrics import MULTICALL_BATCH_SIZE, MULTICALL_SPLITS, RPC_RETRIES, timed
+from utils.rpc import RpcError, RpcRouter, batch_call
+from utils.rpc_provider import RouterProvider
 
 Address = NewType('Address', str)
 ZERO_ADDRESS = Address('0x0000000000000000000000000000000000000000')
@@ -21,14 +26,8 @@ ETH_ADDRESS = Address('0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee')
 
 
 def analysis_time_cost(fn):
-    @wraps(fn)
-    def wrap(*args, **kwargs):
-        start = time.time()
-        r = fn(*args, **kwargs)
-        logger.debug('{} cost {} seconds', fn.__name__, time.time() - start)
-        return r
-
-    return wrap
+    """ kept for old imports, use utils.metrics.timed """
+    return timed()(fn)
 
 
 def byte32_to_address(byte32_hex: str, strict: bool = True) -> Address:
@@ -199,6 +198,44 @@ class OutOfGasException(ValueError):
     pass
 
 
+AGGREGATE3 = 'function aggregate3(tuple(address target,bool allowFailure,bytes callData)[]) ' \
+             'payable returns (tuple(bool success,bytes returnDate)[])'
+
+
+def aggregate3_args(calls: List[Call]) -> List[dict]:
+    """ aggregate3 call structs, invalid addresses are replaced by the zero address """
+    for i, x_call in enumerate(calls):
+        try:
+            Web3.to_checksum_address(x_call.address)
+        except Exception as e:
+            logger.error(e)
+            calls[i].address = ZERO_ADDRESS
+    return [{'target': Web3.to_checksum_address(x_call.address),
+             'allowFailure': x_call.allow_failure,
+             'callData': encode_by_solidity(x_call.params, x_call.solidity)} for x_call in calls]
+
+
+def decode_aggregate3(calls: List[Call], result: List[Any]) -> List[Any]:
+    """ decode aggregate3 (success, returnData) results by the solidity of each call, failed calls give None """
+    result = list(result)
+    for i, call in enumerate(calls):
+        try:
+            x = decode_by_solidity(result[i][1], call.solidity)
+            if isinstance(x, tuple) and len(x) == 1:
+                x = x[0]
+            result[i] = x
+        except (OverflowError, DecodingError) as e:
+            logger.warning("error: {}, i in batch: {}, call: {}", e, i, call)
+            result[i] = None
+        except Exception as e:
+            logger.error(json.dumps(solidity_to_abi(call.solidity)))
+            logger.error(i)
+            logger.error(call.params)
+            logger.error(result[i][1])
+            raise e
+    return result
+
+
 class Client:
     @staticmethod
     def from_chain(chain: Chain = Chain.ETH, **kwargs):
@@ -206,31 +243,44 @@ class Client:
 
     def __init__(self, url: str, multicall_address: Address = '0xca11bde05977b3631167028862be2a173976ca11',
                  event_from_doris: bool = True, chain: Optional[Chain] = None):
+        """
+        :param url: node rpc url, comma separated for several nodes, from_chain uses every url of the chain
+        """
         logger.info('new eth client: {}', url)
-        self.w3 = Web3(Web3.HTTPProvider(url, request_kwargs={'timeout': (60, 60)}))
+        # the router is looked up on the first request, a chain without a configured url only fails when used
+        self.w3 = Web3(RouterProvider(chain if chain is not None and url == chain.url else url))
         self.multicall_address = multicall_address
         self.event_from_doris = event_from_doris
         self.chain = chain
 
-    def __call_contract_function(self, address: Address, abi_str: str, function_name: str, *params) -> Any:
-        contract_address = self.w3.toChecksumAddress(address)
+    @property
+    def rpc(self) -> RpcRouter:
+        """ router behind self.w3, created on the first request """
+        return self.w3.provider.router
+
+    def __call_contract_function(self, address: Address, abi_str: str, function_name: str, *params,
+                                 block_identifier: int | str = 'latest') -> Any:
+        contract_address = Web3.to_checksum_address(address)
         contract = self.w3.eth.contract(address=contract_address, abi=abi_str)
         final_e = Exception()
         for i in range(10):
             try:
                 contract_function = getattr(contract.functions, function_name)
                 contract_function = contract_function(*params)
-                result = contract_function.call()  # {'gas': 2 ** 64 - 1}
+                result = contract_function.call(block_identifier=block_identifier)  # {'gas': 2 ** 64 - 1}
                 logger.debug('called rpc address: {}, function_name: {}',
                              address, function_name)
                 return result
-            except (ConnectionError, IOError) as e:
+            except (ConnectionError, IOError, RpcError) as e:
+                # the router already failed over to every node, try again once some are back in rotation
+                RPC_RETRIES.inc('connection')
                 logger.warning("retry call rpc: {}", e)
                 final_e = e
                 continue
             except ValueError as e:
                 # ValueError: {'code': -32000, 'message': 'execution aborted (timeout = 5s)'}
                 if e.args[0] == {'code': -32000, 'message': 'execution aborted (timeout = 5s)'}:
+                    RPC_RETRIES.inc('timeout')
                     logger.warning("retry call rpc: {}", e)
                     continue
                 if e.args[0] == {'code': -32000, 'message': 'out of gas'}:
@@ -239,7 +289,7 @@ class Client:
         logger.warning('call rpc failed, params: {}', params)
         raise final_e
 
-    @analysis_time_cost
+    @timed()
     def call_contract_function_by_abi(self, address: Address, abi_str: str, function_name: str, *params) -> Any:
         """ call contract by abi
 
@@ -254,7 +304,7 @@ class Client:
         logger.debug('calling contract function address: {}, function_name: {}', address, function_name)
         return self.__call_contract_function(address, abi_str, function_name, *params)
 
-    @analysis_time_cost
+    @timed()
     def call_contract_function(self, address: Address, solidity: str, *params) -> Any:
         """ call contract by solidity
 
@@ -274,7 +324,7 @@ class Client:
         abi_str = json.dumps([abi])
         return self.__call_contract_function(address, abi_str, function_name, *params)
 
-    @analysis_time_cost
+    @timed()
     def get_storage_at(self, address: Address, position: int) -> str:
         """ web3.eth.get_storage_at
 
@@ -283,7 +333,7 @@ class Client:
         :return: hex string at the position of storage
         """
         logger.debug('getting storage at address: {}, position: {}', address, position)
-        contract_address = self.w3.toChecksumAddress(address)
+        contract_address = Web3.to_checksum_address(address)
         r = self.w3.eth.get_storage_at(contract_address, position)
         return r.hex()
 
@@ -296,7 +346,7 @@ class Client:
         assert abi.get('type', '') == 'event'
         event_name = abi.get('name')
         topic = encode_hex(event_abi_to_log_topic(abi))
-        contract_address = self.w3.toChecksumAddress(address)
+        contract_address = Web3.to_checksum_address(address)
         abi_str = json.dumps([abi])
         r = self.w3.eth.get_logs({"fromBlock": from_block,
                                   "toBlock": to_block,
@@ -304,7 +354,7 @@ class Client:
         contract = self.w3.eth.contract(address=contract_address, abi=abi_str)
         contract_event = getattr(contract.events, event_name)
         contract_event.abi = abi
-        return map(lambda x: contract_event.processLog(x), r)
+        return map(lambda x: contract_event.process_log(x), r)
 
     def iterate_contract_logs(self, address: Address, solidity: str,
                               from_block: int | str = 'latest',
@@ -345,65 +395,40 @@ class Client:
         """
         return list(self.iterate_contract_logs(address, solidity, from_block, to_block))
 
-    def __call_and_check_out_of_gas(self, abi_str: str, function_name: str, calls: List[dict]) -> List[Any]:
+    def __call_and_check_out_of_gas(self, abi_str: str, function_name: str, calls: List[dict],
+                                    block_identifier: int | str = 'latest') -> List[Any]:
         if len(calls) == 0:
             return []
         try:
-            result = self.__call_contract_function(self.multicall_address, abi_str, function_name, calls)
+            result = self.__call_contract_function(self.multicall_address, abi_str, function_name, calls,
+                                                   block_identifier=block_identifier)
             return result
         except OutOfGasException as e:
             if len(calls) == 1:
                 logger.error(calls[0])
                 raise e
+            MULTICALL_SPLITS.inc()
             mid = len(calls) // 2
-            result0 = self.__call_and_check_out_of_gas(abi_str, function_name, calls[:mid])
-            result1 = self.__call_and_check_out_of_gas(abi_str, function_name, calls[mid:])
+            result0 = self.__call_and_check_out_of_gas(abi_str, function_name, calls[:mid], block_identifier)
+            result1 = self.__call_and_check_out_of_gas(abi_str, function_name, calls[mid:], block_identifier)
             return result0 + result1
 
-    def __multicall_by_batch(self, calls: List[Call]) -> Iterable[Any]:
+    def __multicall_by_batch(self, calls: List[Call], block_identifier: int | str = 'latest') -> Iterable[Any]:
         logger.debug('multicall calls[0]: {} {} {}', calls[0].address, calls[0].solidity, calls[0].params)
-        solidity = 'function aggregate3(tuple(address target,bool allowFailure,bytes callData)[]) ' \
-                   'payable returns (tuple(bool success,bytes returnDate)[])'
-        abi = solidity_to_abi(solidity)
-        assert abi.get('type', '') == 'function'
+        MULTICALL_BATCH_SIZE.observe(len(calls))
+        abi = solidity_to_abi(AGGREGATE3)
         function_name = abi.get('name')
         abi_str = json.dumps([abi])
-        for i, x_call in enumerate(calls):
-            try:
-                self.w3.toChecksumAddress(x_call.address)
-            except Exception as e:
-                logger.error(e)
-                calls[i].address = '0x0000000000000000000000000000000000000000'
-        result = self.__call_and_check_out_of_gas(abi_str, function_name,
-                                                  list(map(lambda x_call: {
-                                                      'target': self.w3.toChecksumAddress(x_call.address),
-                                                      'allowFailure': x_call.allow_failure,
-                                                      'callData': encode_by_solidity(x_call.params, x_call.solidity)},
-                                                           calls))
-                                                  )
-        for i, call in enumerate(calls):
-            try:
-                x = decode_by_solidity(result[i][1], call.solidity)
-                if isinstance(x, tuple) and len(x) == 1:
-                    x = x[0]
-                result[i] = x
-            except (OverflowError, DecodingError) as e:
-                logger.warning("error: {}, i in batch: {}, call: {}", e, i, call)
-                result[i] = None
-            except Exception as e:
-                logger.error(json.dumps(solidity_to_abi(call.solidity)))
-                logger.error(i)
-                logger.error(call.params)
-                logger.error(result[i][1])
-                raise e
-        return result
+        result = self.__call_and_check_out_of_gas(abi_str, function_name, aggregate3_args(calls), block_identifier)
+        return decode_aggregate3(calls, result)
 
-    def iterate_multicall(self, calls: List[Call], batch_size: int = 100) -> Iterable[Any]:
+    def iterate_multicall(self, calls: List[Call], batch_size: int = 100,
+                          block_identifier: int | str = 'latest') -> Iterable[Any]:
         for start in range(0, len(calls), batch_size):
-            yield from self.__multicall_by_batch(calls[start:start + batch_size])
+            yield from self.__multicall_by_batch(calls[start:start + batch_size], block_identifier)
 
-    @analysis_time_cost
-    def multicall(self, calls: List[Call], batch_size: int = 100) -> List[Any]:
+    @timed()
+    def multicall(self, calls: List[Call], batch_size: int = 100, block_identifier: int | str = 'latest') -> List[Any]:
         """ easy multicall
 
         easy multicall using default multicall3 address: 0xca11bde05977b3631167028862be2a173976ca11,
@@ -411,7 +436,43 @@ class Client:
 
         :param calls: class with attributes: address: str, solidity: str, params: list, allow_failure: bool = True
         :param batch_size: default 1000. if batch size is too big, node will return "out of gas"
+        :param block_identifier: block number or tag the calls are made at
         :return: a result list, each of which is same as web3.eth.contract.function.call()
         """
         logger.debug('multicall len(calls): {}', len(calls))
-        return list(self.iterate_multicall(calls, batch_size))
+        return list(self.iterate_multicall(calls, batch_size, block_identifier))
+
+    @timed()
+    def multicall_at_blocks(self, calls: List[Call], blocks: Iterable[int], batch_size: int = 100,
+                            max_workers: int = 4) -> Dict[int, List[Any]]:
+        """ the same multicall pinned at many blocks
+
+        one aggregate3 eth_call per block, sent as concurrent json-rpc batch requests,
+        so n blocks cost n / batch_size http posts instead of n round trips.
+        multicall3 is deployed at block 14353601 on ethereum, earlier blocks fail
+
+        :param calls: calls made at every block, each call should allow failure
+        :param blocks: block numbers
+        :param batch_size: eth_calls per http post
+        :param max_workers: concurrent http posts
+        :return: block -> result list as multicall, missing when the eth_call of that block failed
+        """
+        blocks = sorted(set(int(b) for b in blocks))
+        if not calls or not blocks:
+            return {}
+        abi = solidity_to_abi(AGGREGATE3)
+        structs = [(x['target'], x['allowFailure'], HexBytes(x['callData'])) for x in aggregate3_args(calls)]
+        data = encode_by_solidity([structs], AGGREGATE3)
+        tx = {'to': Web3.to_checksum_address(self.multicall_address), 'data': data}
+        raw = batch_call(self.rpc, [('eth_call', [tx, hex(b)]) for b in blocks],
+                         batch_size=batch_size, max_workers=max_workers)
+        output_types = [collapse_if_tuple(arg) for arg in abi['outputs']]
+        results = {}
+        for block, value in zip(blocks, raw):
+            if value is None:
+                continue
+            try:
+                results[block] = decode_aggregate3(calls, list(decode_abi(output_types, HexBytes(value))[0]))
+            except DecodingError as e:
+                logger.warning('multicall at block {} not decoded: {}', block, e)
+        return results
@@ -0,0 +1,166 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.metrics import CEX_RATE_LIMIT_SECONDS, CEX_REQUEST_SECONDS, CEX_REQUESTS
+from utils.metrics import enabled as metrics_enabled
+
+DEFAULT_TIMEOUT = (5, 30)
+# 418 is binance's ip ban after ignored 429s, it is returned to the caller and never retried
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    """ seconds asked for by the Retry-After header of a response, in seconds or as an http date """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """ thread-safe token bucket, capacity tokens are refilled evenly over period seconds """
+
+    def __init__(self, capacity: float, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, weight: float = 1) -> float:
+        """ take weight tokens now, going into debt if needed, :return: seconds to wait before sending
+
+        reservations are served in order, so sync and async callers can share one bucket
+        """
+        weight = min(weight, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= weight
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self, weight: float = 1) -> float:
+        """ block until weight tokens are available, :return: seconds waited """
+        wait = self.reserve(weight)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class ExchangeSession:
+    """
+    pooled keep-alive session of one exchange host
+
+    every request takes tokens from a named rate limit bucket (such as binance request weight or an okx
+    endpoint limit) before it is sent. idempotent requests are retried on 429 / 5xx after Retry-After or an
+    exponential backoff, and every retry goes through the bucket again. connection errors are retried by urllib3
+    """
+
+    def __init__(self, name: str, limits: Dict[str, Tuple[float, float]], timeout=DEFAULT_TIMEOUT,
+                 retries: int = 3, backoff_factor: float = 0.5, pool_maxsize: int = 16):
+        """
+        :param name: exchange name, used in logs
+        :param limits: bucket name -> (capacity, period seconds), must contain "default"
+        :param timeout: default (connect, read) timeout
+        :param retries: retries on connection errors, and on 429 / 5xx of idempotent requests
+        :param backoff_factor: sleep backoff_factor * 2 ** (retry - 1) seconds between retries without Retry-After
+        :param pool_maxsize: keep-alive connections kept per host
+        """
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.buckets = {k: TokenBucket(*v) for k, v in limits.items()}
+        # status retries are done in request() so they are rate limited too
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status=0, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method: str, url: str, weight: float = 1, bucket: str = 'default',
+                **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        retry = 0
+        while True:
+            response = self._send(method, url, weight, bucket, **kwargs)
+            if (response.status_code not in RETRY_STATUS or retry >= self.retries
+                    or method.upper() not in Retry.DEFAULT_ALLOWED_METHODS):
+                if response.status_code == 418:
+                    logger.error('{} banned this ip: {}', self.name, response.text[:200])
+                return response
+            retry += 1
+            wait = retry_after(response)
+            wait = self.backoff_factor * 2 ** (retry - 1) if wait is None else wait
+            logger.warning('{} {} {} returned {}, retry {} in {:.2f}s', self.name, method, url,
+                           response.status_code, retry, wait)
+            response.close()
+            time.sleep(wait)
+
+    def _send(self, method: str, url: str, weight: float, bucket: str, **kwargs) -> requests.Response:
+        waited = self.buckets[bucket].acquire(weight)
+        if waited > 0:
+            logger.debug('{} rate limit [{}] waited {:.3f}s', self.name, bucket, waited)
+            CEX_RATE_LIMIT_SECONDS.observe(waited, self.name, bucket)
+        if not metrics_enabled():
+            return self.session.request(method, url, **kwargs)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            CEX_REQUESTS.inc(self.name, bucket, 'error')
+            raise
+        CEX_REQUEST_SECONDS.observe(time.perf_counter() - start, self.name)
+        CEX_REQUESTS.inc(self.name, bucket, str(response.status_code))
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+
+# public rate limits per ip, see each exchange's api docs
+EXCHANGE_LIMITS: Dict[str, Dict[str, Tuple[float, float]]] = {
+    # 6000 request weight per minute
+    'binance': {'default': (6000, 60)},
+    # market/ticker 20 requests / 2s, history-index-candles 10 requests / 2s
+    'okx': {'default': (20, 2), 'ticker': (20, 2), 'history-index-candles': (10, 2)},
+    # public endpoints 200 requests / 10s
+    'gate': {'default': (200, 10)},
+    # market endpoints 20 requests / 1s
+    'bitget': {'default': (20, 1)},
+    'backpack': {'default': (20, 1)},
+    # 300 requests / minute
+    'dexscreener': {'default': (300, 60)},
+}
+
+_sessions: Dict[str, ExchangeSession] = {}
+_sessions_lock = threading.Lock()
+
+
+def exchange_session(name: str, limits: Optional[Dict[str, Tuple[float, float]]] = None) -> ExchangeSession:
+    """ process-wide shared session of an exchange """
+    with _sessions_lock:
+        if name not in _sessions:
+            _sessions[name] = ExchangeSession(name, limits or EXCHANGE_LIMITS.get(name, {'default': (10, 1)}))
+        return _sessions[name]
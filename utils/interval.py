@@ -0,0 +1,64 @@
+import re
+
+# canonical interval -> milliseconds, all candles are aligned to utc
+INTERVAL_MS = {
+    '1m': 60_000, '3m': 180_000, '5m': 300_000, '15m': 900_000, '30m': 1_800_000,
+    '1h': 3_600_000, '2h': 7_200_000, '4h': 14_400_000, '6h': 21_600_000, '8h': 28_800_000,
+    '12h': 43_200_000, '1d': 86_400_000, '1w': 604_800_000,
+}
+
+# weekly candles open on monday 00:00 utc, 1970-01-01 was a thursday
+_WEEK_OFFSET_MS = 4 * 86_400_000
+
+_UNIT_MS = {'s': 1_000, 'm': 60_000, 'h': 3_600_000, 'd': 86_400_000, 'w': 604_800_000}
+_MS_INTERVAL = {v: k for k, v in INTERVAL_MS.items()}
+
+# canonical interval -> exchange spelling, intervals missing here are not offered by the exchange
+EXCHANGE_INTERVALS = {
+    'binance': {i: i for i in INTERVAL_MS},
+    'backpack': {i: i for i in INTERVAL_MS},
+    # okx hour bars are upper case, 6h and longer are hong kong time unless suffixed with utc
+    'okx': {'1m': '1m', '3m': '3m', '5m': '5m', '15m': '15m', '30m': '30m', '1h': '1H', '2h': '2H', '4h': '4H',
+            '6h': '6Hutc', '12h': '12Hutc', '1d': '1Dutc', '1w': '1Wutc'},
+    'gate': {'1m': '1m', '5m': '5m', '15m': '15m', '30m': '30m', '1h': '1h', '4h': '4h', '8h': '8h', '1d': '1d',
+             '1w': '7d'},
+}
+
+
+def normalize_interval(interval: str) -> str:
+    """ canonical spelling of an interval
+
+    accepts the spellings of every supported exchange, such as "1d", "1D", "1Dutc", "1H", "60m" or "7d",
+    upper case M is month on binance and okx and is rejected
+
+    :return: key of INTERVAL_MS
+    """
+    match = re.fullmatch(r'(\d+)([smhdwHDW])(utc|UTC)?', interval.strip())
+    if match is None:
+        raise ValueError(f"unsupported interval: {interval}")
+    ms = int(match.group(1)) * _UNIT_MS[match.group(2).lower()]
+    if ms not in _MS_INTERVAL:
+        raise ValueError(f"unsupported interval: {interval}, must be one of {list(INTERVAL_MS)}")
+    return _MS_INTERVAL[ms]
+
+
+def interval_ms(interval: str) -> int:
+    return INTERVAL_MS[normalize_interval(interval)]
+
+
+def align(ts: int, interval: str) -> int:
+    """ open time (unix ms) of the interval candle containing ts """
+    ms = INTERVAL_MS[interval]
+    if interval == '1w':
+        return (ts - _WEEK_OFFSET_MS) // ms * ms + _WEEK_OFFSET_MS
+    return ts // ms * ms
+
+
+def exchange_interval(exchange: str, interval: str) -> str:
+    """ spelling of interval on exchange, such as exchange_interval('okx', '1d') == '1Dutc' """
+    canonical = normalize_interval(interval)
+    spelling = EXCHANGE_INTERVALS[exchange].get(canonical)
+    if spelling is None:
+        raise ValueError(f"{exchange} does not support interval {interval}, "
+                         f"must be one of {list(EXCHANGE_INTERVALS[exchange])}")
+    return spelling
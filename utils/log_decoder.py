@@ -0,0 +1,193 @@
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+from eth_utils import event_abi_to_log_topic
+from eth_utils.abi import collapse_if_tuple
+from loguru import logger
+
+from utils.etherum import decode_abi, solidity_to_abi
+
+DEFAULT_EVENTS = [
+    # ERC-20
+    "event Transfer(address indexed from, address indexed to, uint256 value)",
+    "event Approval(address indexed owner, address indexed spender, uint256 value)",
+    # ERC-721, same topic0 as ERC-20 Transfer but tokenId is indexed
+    "event Transfer(address indexed from, address indexed to, uint256 indexed tokenId)",
+    # WETH
+    "event Deposit(address indexed dst, uint256 wad)",
+    "event Withdrawal(address indexed src, uint256 wad)",
+    # Uniswap V2
+    "event Swap(address indexed sender, uint256 amount0In, uint256 amount1In, uint256 amount0Out, "
+    "uint256 amount1Out, address indexed to)",
+    "event Sync(uint112 reserve0, uint112 reserve1)",
+    "event Mint(address indexed sender, uint256 amount0, uint256 amount1)",
+    "event Burn(address indexed sender, uint256 amount0, uint256 amount1, address indexed to)",
+    # Uniswap V3
+    "event Swap(address indexed sender, address indexed recipient, int256 amount0, int256 amount1, "
+    "uint160 sqrtPriceX96, uint128 liquidity, int24 tick)",
+]
+
+LOG_COLUMNS = ['block_number', 'transaction_hash', 'log_index', 'address', 'event']
+
+# indexed dynamic types are stored as keccak hash in topics, keep them as raw hex
+_HASHED_TOPIC_TYPES = ('string', 'bytes')
+# static integer scalars, arrays such as uint256[] are encoded as offsets and go through eth_abi
+_UINT = re.compile(r'uint\d*')
+_INT = re.compile(r'int\d*')
+
+
+def _to_bytes(value) -> bytes:
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith('0x') else value)
+    return bytes(value)
+
+
+def _to_int(value) -> int:
+    return int(value, 16) if isinstance(value, str) else int(value)
+
+
+def _word_decoder(abi_type: str):
+    """ decoder of a single 32-byte static word, None for types that need eth_abi """
+    if abi_type == 'address':
+        return lambda word: '0x' + word[-20:].hex()
+    if _UINT.fullmatch(abi_type):
+        return lambda word: int.from_bytes(word, 'big')
+    if _INT.fullmatch(abi_type):
+        return lambda word: int.from_bytes(word, 'big', signed=True)
+    if abi_type == 'bool':
+        return lambda word: word[-1] == 1
+    if abi_type == 'bytes32':
+        return lambda word: '0x' + word.hex()
+    return None
+
+
+def _decode_topic(abi_type: str, topic: bytes) -> Any:
+    decoder = _word_decoder(abi_type)
+    if decoder is not None:
+        return decoder(topic)
+    if abi_type.endswith(']') or abi_type.startswith(_HASHED_TOPIC_TYPES) or abi_type.startswith('tuple'):
+        return '0x' + topic.hex()
+    return decode_abi([abi_type], topic)[0]
+
+
+class EventSpec:
+    """
+    compiled event signature: topic0, indexed and data types are resolved once at registration
+    """
+    __slots__ = ["name", "topic0", "topic_count", "indexed_types", "indexed_names", "data_types", "data_names",
+                 "_word_decoders"]
+
+    def __init__(self, solidity: str):
+        abi = solidity_to_abi(solidity)
+        assert abi.get('type', '') == 'event'
+        self.name = abi['name']
+        self.topic0 = event_abi_to_log_topic(abi)
+        indexed = [x for x in abi['inputs'] if x.get('indexed')]
+        data = [x for x in abi['inputs'] if not x.get('indexed')]
+        self.topic_count = len(indexed) + 1
+        self.indexed_types = [collapse_if_tuple(x) for x in indexed]
+        self.indexed_names = [x.get('name', f'arg{i}') for i, x in enumerate(indexed)]
+        self.data_types = [collapse_if_tuple(x) for x in data]
+        self.data_names = [x.get('name', f'arg{i + len(indexed)}') for i, x in enumerate(data)]
+        # events whose data is only static words are sliced directly instead of going through eth_abi
+        decoders = [_word_decoder(t) for t in self.data_types]
+        self._word_decoders = decoders if all(d is not None for d in decoders) else None
+
+    def decode(self, topics: List[bytes], data: bytes) -> Dict[str, Any]:
+        args = {name: _decode_topic(t, topic)
+                for name, t, topic in zip(self.indexed_names, self.indexed_types, topics[1:])}
+        if self._word_decoders is not None:
+            if len(data) < 32 * len(self._word_decoders):
+                raise ValueError(f'{self.name} data too short: {len(data)} bytes')
+            args.update((name, decoder(data[32 * i:32 * i + 32]))
+                        for i, (name, decoder) in enumerate(zip(self.data_names, self._word_decoders)))
+        elif self.data_types:
+            args.update(zip(self.data_names, decode_abi(self.data_types, data)))
+        return args
+
+
+class EventRegistry:
+    """
+    topic0 -> event signature index for decoding mixed logs,
+    events sharing topic0 (such as ERC-20 / ERC-721 Transfer) are told apart by topic count
+    """
+
+    def __init__(self, events: Iterable[str] = DEFAULT_EVENTS):
+        self._specs: Dict[Tuple[bytes, int], EventSpec] = {}
+        for solidity in events:
+            self.register(solidity)
+
+    def register(self, solidity: str) -> EventSpec:
+        """ :param solidity: event solidity, such as "event Sync(uint112 reserve0, uint112 reserve1)" """
+        spec = EventSpec(solidity)
+        self._specs[(spec.topic0, spec.topic_count)] = spec
+        return spec
+
+    def __contains__(self, topic0) -> bool:
+        topic0 = _to_bytes(topic0)
+        return any(k[0] == topic0 for k in self._specs)
+
+    def lookup(self, topics: List[bytes]) -> Optional[EventSpec]:
+        if not topics:
+            return None
+        return self._specs.get((topics[0], len(topics)))
+
+    def decode_log(self, log: dict) -> Optional[Dict[str, Any]]:
+        """ :return: event name and decoded args of a single log, None for unknown events """
+        topics = [_to_bytes(t) for t in log['topics']]
+        spec = self.lookup(topics)
+        if spec is None:
+            return None
+        args = spec.decode(topics, _to_bytes(log['data']))
+        args['event'] = spec.name
+        return args
+
+    def decode_logs(self, logs: Iterable[dict]) -> pd.DataFrame:
+        """ decode mixed logs in one pass into a flat table
+
+        unknown topics are skipped without decoding, columns of all decoded events are unioned
+
+        :param logs: web3 formatted or raw json-rpc logs
+        :return: dataframe with columns block_number, transaction_hash, log_index, address, event
+                 and one column per event argument
+        """
+        columns: Dict[str, List[Any]] = {c: [] for c in LOG_COLUMNS}
+        n = 0
+        skipped = 0
+        for log in logs:
+            topics = [_to_bytes(t) for t in log['topics']]
+            spec = self.lookup(topics)
+            if spec is None:
+                skipped += 1
+                continue
+            try:
+                args = spec.decode(topics, _to_bytes(log['data']))
+            except Exception as e:
+                logger.warning('failed to decode {} log: {}', spec.name, e)
+                skipped += 1
+                continue
+            columns['block_number'].append(_to_int(log['blockNumber']))
+            columns['transaction_hash'].append('0x' + _to_bytes(log['transactionHash']).hex())
+            columns['log_index'].append(_to_int(log['logIndex']))
+            columns['address'].append(str(log['address']).lower())
+            columns['event'].append(spec.name)
+            for key, value in args.items():
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = [None] * n
+                column.append(value)
+            n += 1
+            for column in columns.values():
+                if len(column) < n:
+                    column.append(None)
+        logger.debug('decoded {} logs, skipped {}', n, skipped)
+        # event args stay as python objects so uint256 values keep full precision
+        return pd.DataFrame({k: v if k in LOG_COLUMNS else pd.Series(v, dtype=object) for k, v in columns.items()})
+
+    def decode_receipts(self, receipts: Iterable[dict]) -> pd.DataFrame:
+        """ decode the logs of many receipts in one pass, see decode_logs """
+        return self.decode_logs(log for receipt in receipts if receipt is not None for log in receipt['logs'])
+
+
+default_registry = EventRegistry()
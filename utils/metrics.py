@@ -0,0 +1,336 @@
+import bisect
+import json
+import os
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from utils.env import getenv
+
+# latency buckets in seconds, 1ms ~ 60s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# size buckets, such as calls per multicall or json-rpc batch
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# None until the first check, $METRICS_ENABLED is read then rather than at import
+_enabled: Optional[bool] = None
+
+
+def enabled() -> bool:
+    if _enabled is None:
+        enable(getenv('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes'))
+    return _enabled
+
+
+def enable(on: bool = True) -> None:
+    """ turn collection on or off for the whole process, off by default unless $METRICS_ENABLED is set """
+    global _enabled
+    _enabled = on
+
+
+class Counter:
+    """ monotonically increasing count per label values """
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, value: float = 1) -> None:
+        if not enabled():
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + value
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            return [(self.name, dict(zip(self.labels, k)), v) for k, v in sorted(self._values.items())]
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return [{'labels': dict(zip(self.labels, k)), 'value': v} for k, v in sorted(self._values.items())]
+
+
+class Histogram:
+    """
+    bucketed distribution per label values, quantiles are interpolated inside the bucket they fall in,
+    so p50 / p99 cost O(buckets) and memory does not grow with the number of observations
+    """
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts (+inf last), count, sum, max]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, amount: float, *label_values) -> None:
+        if not enabled():
+            return
+        i = bisect.bisect_left(self.buckets, amount)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0, 0.0, amount]
+            state[0][i] += 1
+            state[1] += 1
+            state[2] += amount
+            if amount > state[3]:
+                state[3] = amount
+
+    def time(self, *label_values) -> '_Timer':
+        """ context manager observing the seconds spent inside it """
+        return _Timer(self, label_values) if enabled() else _NULL_TIMER
+
+    def count(self, *label_values) -> int:
+        state = self._values.get(label_values)
+        return state[1] if state else 0
+
+    def quantile(self, q: float, *label_values) -> Optional[float]:
+        """ :return: estimated q quantile (0 ~ 1), None without observations """
+        with self._lock:
+            state = self._values.get(label_values)
+            if not state or not state[1]:
+                return None
+            counts, total, _, largest = state[0], state[1], state[2], state[3]
+        rank = q * total
+        seen = 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else largest
+                return min(lower + (upper - lower) * (rank - seen) / c, largest)
+            seen += c
+        return largest
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        result = []
+        with self._lock:
+            items = sorted((k, [list(v[0]), v[1], v[2], v[3]]) for k, v in self._values.items())
+        for key, (counts, total, amount, _) in items:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, c in zip(list(self.buckets) + ['+Inf'], counts):
+                cumulative += c
+                result.append((self.name + '_bucket', {**labels, 'le': str(bound)}, cumulative))
+            result.append((self.name + '_count', labels, total))
+            result.append((self.name + '_sum', labels, amount))
+        return result
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            keys = sorted(self._values)
+        result = []
+        for key in keys:
+            state = self._values[key]
+            result.append({'labels': dict(zip(self.labels, key)), 'count': state[1], 'sum': state[2],
+                           'max': state[3], 'p50': self.quantile(0.5, *key), 'p99': self.quantile(0.99, *key)})
+        return result
+
+
+class _Timer:
+    __slots__ = ["histogram", "label_values", "start"]
+
+    def __init__(self, histogram: Histogram, label_values: tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class _NullTimer:
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Registry:
+    """ named counters and histograms of the process, exported as prometheus text or json snapshots """
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, labels: Sequence[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labels, **kwargs)
+            elif not isinstance(metric, cls) or metric.labels != tuple(labels):
+                raise ValueError(f"metric {name} already registered with another type or labels")
+            return metric
+
+    def counter(self, name: str, help: str = '', labels: Sequence[str] = ()) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def histogram(self, name: str, help: str = '', labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def reset(self) -> None:
+        for metric in list(self._metrics.values()):
+            metric.reset()
+
+    def prometheus(self) -> str:
+        """ :return: all metrics in the prometheus text exposition format """
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            kind = 'counter' if isinstance(metric, Counter) else 'histogram'
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample, labels, value in metric.samples():
+                label_text = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                      for k, v in labels.items())
+                lines.append(f'{sample}{{{label_text}}} {value:g}' if label_text else f'{sample} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict:
+        """ :return: json-able dict of every metric, histograms with count, sum, max, p50 and p99 """
+        return {'timestamp': time.time(),
+                'metrics': {name: {'type': 'counter' if isinstance(m, Counter) else 'histogram', 'help': m.help,
+                                   'values': m.snapshot()}
+                            for name, m in sorted(self._metrics.items())}}
+
+    def write_json(self, path: str) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2, default=str)
+
+    def serve(self, port: int = 9108, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+        """ serve /metrics (prometheus) and /metrics.json on a daemon thread """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/metrics.json'):
+                    body, kind = json.dumps(registry.snapshot(), default=str).encode(), 'application/json'
+                elif self.path.startswith('/metrics'):
+                    body, kind = registry.prometheus().encode(), 'text/plain; version=0.0.4'
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', kind)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str = '', labels: Sequence[str] = ()) -> Counter:
+    return REGISTRY.counter(name, help, labels)
+
+
+def histogram(name: str, help: str = '', labels: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.histogram(name, help, labels, buckets)
+
+
+FUNCTION_SECONDS = histogram('function_seconds', 'wall time of instrumented functions', ['function'])
+
+# hot paths, the modules doing the work observe these
+RPC_CALLS = counter('rpc_calls_total', 'json-rpc requests by method', ['method'])
+RPC_BATCH_SIZE = histogram('rpc_batch_size', 'json-rpc requests per http post', buckets=SIZE_BUCKETS)
+RPC_REQUEST_SECONDS = histogram('rpc_request_seconds', 'http post latency per rpc node', ['endpoint'])
+RPC_ERRORS = counter('rpc_errors_total', 'failed http posts per rpc node', ['endpoint'])
+RPC_HEDGES = counter('rpc_hedges_total', 'requests sent to a second node after the hedge deadline')
+RPC_RETRIES = counter('rpc_retries_total', 'contract call retries by reason', ['reason'])
+MULTICALL_BATCH_SIZE = histogram('multicall_batch_size', 'calls per aggregate3 multicall', buckets=SIZE_BUCKETS)
+MULTICALL_SPLITS = counter('multicall_out_of_gas_splits_total', 'multicalls split in half after running out of gas')
+CEX_REQUESTS = counter('cex_requests_total', 'exchange http requests by status', ['exchange', 'bucket', 'status'])
+CEX_REQUEST_SECONDS = histogram('cex_request_seconds', 'exchange http request latency', ['exchange'])
+CEX_RATE_LIMIT_SECONDS = histogram('cex_rate_limit_wait_seconds', 'time spent waiting for rate limit tokens',
+                                   ['exchange', 'bucket'])
+CACHE_LOOKUPS = counter('cache_lookups_total', 'cache lookups by cache and result (hit / miss)', ['cache', 'result'])
+
+
+def cache_lookup(cache: str, hits: int, misses: int) -> None:
+    """ count hits and misses of a bulk cache lookup """
+    if not enabled():
+        return
+    if hits:
+        CACHE_LOOKUPS.inc(cache, 'hit', value=hits)
+    if misses:
+        CACHE_LOOKUPS.inc(cache, 'miss', value=misses)
+
+
+def hit_ratio(cache: str) -> Optional[float]:
+    hits, misses = CACHE_LOOKUPS.value(cache, 'hit'), CACHE_LOOKUPS.value(cache, 'miss')
+    return hits / (hits + misses) if hits + misses else None
+
+
+def timed(name: Optional[str] = None) -> Callable:
+    """ decorator observing the wall time of every call in function_seconds{function=name}
+
+    :param name: label value, default the function's qualified name
+    """
+
+    def decorator(fn):
+        label = name or fn.__qualname__
+
+        @wraps(fn)
+        def wrap(*args, **kwargs):
+            if not enabled():
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                FUNCTION_SECONDS.observe(time.perf_counter() - start, label)
+
+        return wrap
+
+    return decorator
+
+
+if __name__ == "__main__":
+    enable()
+    for i in range(1000):
+        RPC_REQUEST_SECONDS.observe(0.01 + (i % 100) / 1000, 'http://node')
+        RPC_CALLS.inc('eth_call')
+    cache_lookup('receipts', 90, 10)
+    print(REGISTRY.prometheus())
+    print(json.dumps(REGISTRY.snapshot()['metrics']['rpc_request_seconds'], indent=2))
+    print(hit_ratio('receipts'))
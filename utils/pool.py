@@ -1,9 +1,14 @@
-from web3 import Web3
 from loguru import logger
 from decimal import Decimal
-from typing import Optional
+from typing import List, Optional, Sequence, Tuple
 
 from utils.chain import Chain
+from utils.etherum import Call, Client
+from utils.rpc_provider import web3_for
+
+V2_GET_RESERVES = 'function getReserves() view returns (uint112 _reserve0, uint112 _reserve1, uint32 _blockTimestampLast)'
+V3_SLOT0 = ('function slot0() view returns (uint160 sqrtPriceX96, int24 tick, uint16 observationIndex, '
+            'uint16 observationCardinality, uint16 observationCardinalityNext, uint8 feeProtocol, bool unlocked)')
 
 
 def get_uniswap_v2_price(pair_address: str, chain: Chain = Chain.ETH) -> Optional[float]:
@@ -15,7 +20,7 @@ def get_uniswap_v2_price(pair_address: str, chain: Chain = Chain.ETH) -> Optiona
         token1/token0的价格，如果出错返回None
     """
     try:
-        w3 = Web3(Web3.HTTPProvider(chain.url))
+        w3 = web3_for(chain)
         if not w3.is_connected():
             logger.error(f"Failed to connect to {chain.value} network")
             return None
@@ -48,7 +53,7 @@ def get_uniswap_v3_price(pool_address: str, chain: Chain = Chain.ETH) -> Optiona
         token1/token0的价格，如果出错返回None
     """
     try:
-        w3 = Web3(Web3.HTTPProvider(chain.url))
+        w3 = web3_for(chain)
         if not w3.is_connected():
             logger.error(f"Failed to connect to {chain.value} network")
             return None
@@ -68,6 +73,35 @@ def get_uniswap_v3_price(pool_address: str, chain: Chain = Chain.ETH) -> Optiona
         return None
 
 
+def get_pool_prices(client: Client, pools: Sequence[Tuple[str, str]],
+                    block_identifier: int | str = 'latest') -> List[Optional[float]]:
+    """批量获取池子价格, 所有池子的 getReserves / slot0 在同一个 multicall 中读取
+    Args:
+        client: 池子所在链的 Client
+        pools: (池子合约地址, 'v2' 或 'v3') 列表
+        block_identifier: 读取价格的区块
+    Returns:
+        与 pools 顺序一致的 token1/token0 价格, 计算方式同 get_uniswap_v2_price / get_uniswap_v3_price,
+        调用失败或 reserve0 为 0 时为 None
+    """
+    calls = [Call(address, V3_SLOT0 if version == 'v3' else V2_GET_RESERVES, allow_failure=True)
+             for address, version in pools]
+    prices = []
+    for (address, version), result in zip(pools, client.multicall(calls, block_identifier=block_identifier)):
+        if result is None:
+            logger.warning(f"Failed to read {version} pool {address}")
+            prices.append(None)
+        elif version == 'v3':
+            sqrt_price_x96 = Decimal(result[0])
+            prices.append(float(sqrt_price_x96 * sqrt_price_x96 * Decimal(10**18) / Decimal(2**192)))
+        elif result[0] == 0:
+            logger.warning(f"Zero reserve0 in pool {address}")
+            prices.append(None)
+        else:
+            prices.append(float(Decimal(result[1]) / Decimal(result[0])))
+    return prices
+
+
 def main():
     # Test Uniswap V2 pool price
     v2_pair_address = '0x5de4EF4879F4C7Eff28B504A2f442bfCB086E2c4'
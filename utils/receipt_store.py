@@ -0,0 +1,77 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional
+
+from web3 import Web3
+from web3._utils.method_formatters import receipt_formatter
+from web3.datastructures import AttributeDict
+
+from utils.chain import Chain
+from utils.env import getenv
+from utils.metrics import cache_lookup
+
+DEFAULT_RECEIPT_STORE = os.path.join(os.path.expanduser('~'), '.cache', 'web3-analytics', 'receipts.sqlite')
+
+
+def format_receipt(raw: dict) -> AttributeDict:
+    """ format a raw json-rpc receipt the same way as web3.eth.get_transaction_receipt """
+    return AttributeDict.recursive(receipt_formatter(raw))
+
+
+def _hash_key(transaction_hash) -> str:
+    if isinstance(transaction_hash, str):
+        return transaction_hash.lower()
+    return Web3.to_hex(transaction_hash).lower()
+
+
+class ReceiptStore:
+    """
+    on-disk receipt store shared by all Transaction objects,
+    only receipts of finalised transactions should be put here since they never change
+    """
+    _default: Optional['ReceiptStore'] = None
+
+    def __init__(self, path: str = DEFAULT_RECEIPT_STORE):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS receipts ('
+                           'chain TEXT NOT NULL, hash TEXT NOT NULL, receipt TEXT NOT NULL, '
+                           'PRIMARY KEY (chain, hash))')
+        self._conn.commit()
+
+    @classmethod
+    def default(cls) -> 'ReceiptStore':
+        """ process-wide store at $RECEIPT_STORE_PATH, or ~/.cache/web3-analytics/receipts.sqlite """
+        if cls._default is None:
+            cls._default = cls(getenv('RECEIPT_STORE_PATH', DEFAULT_RECEIPT_STORE))
+        return cls._default
+
+    def get(self, chain: Chain, transaction_hash: str) -> Optional[AttributeDict]:
+        return self.get_many(chain, [transaction_hash]).get(transaction_hash.lower())
+
+    def get_many(self, chain: Chain, hashes: Iterable[str]) -> Dict[str, AttributeDict]:
+        """ :return: lower-case hash -> formatted receipt, for hashes found in store """
+        keys = [h.lower() for h in hashes]
+        result = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    'SELECT hash, receipt FROM receipts WHERE chain = ? AND hash IN ({})'.format(
+                        ','.join('?' * len(chunk))),
+                    [chain.value] + chunk,
+                ).fetchall()
+                result.update({h: format_receipt(json.loads(r)) for h, r in rows})
+        cache_lookup('receipts', len(result), len(set(keys)) - len(result))
+        return result
+
+    def put_many(self, chain: Chain, receipts: Iterable[dict]) -> None:
+        """ :param receipts: raw json-rpc receipts or web3 formatted receipts """
+        rows = [(chain.value, _hash_key(r['transactionHash']), Web3.to_json(r)) for r in receipts]
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO receipts VALUES (?, ?, ?)', rows)
+            self._conn.commit()
@@ -0,0 +1,280 @@
+import itertools
+import json
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from utils.chain import Chain
+from utils.metrics import RPC_BATCH_SIZE, RPC_CALLS, RPC_ERRORS, RPC_HEDGES, RPC_REQUEST_SECONDS
+from utils.metrics import enabled as metrics_enabled
+
+_ids = itertools.count(1)
+
+
+class RpcError(ValueError):
+    pass
+
+
+class Endpoint:
+    """ health of one node: ewma latency and error rate, consecutive failures and recent latencies """
+    __slots__ = ["url", "latency", "error_rate", "failures", "down_until", "inflight", "samples", "requests",
+                 "errors"]
+
+    def __init__(self, url: str, samples: int = 200):
+        self.url = url
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.failures = 0
+        self.down_until = 0.0
+        self.inflight = 0
+        self.samples: Deque[float] = deque(maxlen=samples)
+        self.requests = 0
+        self.errors = 0
+
+    def score(self) -> float:
+        """ expected wait, lower is better, nodes without samples score 0 so they are tried first """
+        return self.latency * (1 + self.inflight) / max(1.0 - self.error_rate, 0.05)
+
+    def deadline(self, percentile: float, min_samples: int = 20) -> Optional[float]:
+        """ :return: percentile of recent latencies, None until min_samples requests succeeded """
+        if len(self.samples) < min_samples:
+            return None
+        return float(np.percentile(self.samples, percentile))
+
+    def to_dict(self) -> Dict:
+        return {'url': self.url, 'latency': self.latency, 'error_rate': self.error_rate, 'failures': self.failures,
+                'down': self.down_until > time.time(), 'inflight': self.inflight, 'requests': self.requests,
+                'errors': self.errors}
+
+    def __repr__(self):
+        return f"Endpoint({self.url} {self.latency * 1000:.0f}ms err={self.error_rate:.2f})"
+
+
+class RpcRouter:
+    """
+    json-rpc transport over several nodes of one chain
+
+    every node keeps an ewma of latency and error rate, each request goes to the better of two random healthy
+    nodes (power of two choices), so load spreads over the fast nodes instead of piling onto one. a request
+    still running after the hedge_percentile latency of its node is sent to a second node as well and the first
+    answer wins. transport errors, http 429 and 5xx fail over to the next node right away, a node failing
+    max_failures times in a row is taken out of rotation for cooldown seconds (doubling while it keeps failing)
+
+    json-rpc error objects are answers, not node failures, they are returned as they are
+    """
+
+    def __init__(self, urls: Sequence[str], timeout: float = 60, hedge_percentile: Optional[float] = 95,
+                 alpha: float = 0.2, max_failures: int = 3, cooldown: float = 5.0, max_cooldown: float = 300.0,
+                 max_workers: int = 32):
+        """
+        :param urls: node urls
+        :param timeout: http timeout in seconds
+        :param hedge_percentile: latency percentile of a node after which a request is hedged, None disables it
+        :param alpha: ewma weight of the newest request
+        :param max_failures: consecutive failures that take a node out of rotation
+        :param cooldown: first out-of-rotation period in seconds
+        """
+        urls = list(dict.fromkeys(u.strip() for u in urls if u and u.strip()))
+        if not urls:
+            raise ValueError("no rpc url")
+        self.endpoints = [Endpoint(u) for u in urls]
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.hedged = 0
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(urls), pool_maxsize=max_workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rpc')
+
+    @property
+    def url(self) -> str:
+        return self.endpoints[0].url
+
+    def _pick(self, exclude: Sequence[Endpoint] = ()) -> Optional[Endpoint]:
+        now = time.time()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in exclude]
+            if not candidates:
+                return None
+            healthy = [e for e in candidates if e.down_until <= now]
+            if not healthy:
+                # all down, probe the one that comes back first
+                return min(candidates, key=lambda e: e.down_until)
+            if len(healthy) == 1:
+                return healthy[0]
+            a, b = random.sample(healthy, 2)
+            return a if a.score() <= b.score() else b
+
+    def _record(self, endpoint: Endpoint, elapsed: float, ok: bool) -> None:
+        if ok:
+            RPC_REQUEST_SECONDS.observe(elapsed, endpoint.url)
+        else:
+            RPC_ERRORS.inc(endpoint.url)
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.error_rate += self.alpha * ((0.0 if ok else 1.0) - endpoint.error_rate)
+            if ok:
+                endpoint.latency = elapsed if endpoint.latency == 0 else \
+                    endpoint.latency + self.alpha * (elapsed - endpoint.latency)
+                endpoint.samples.append(elapsed)
+                endpoint.failures = 0
+                endpoint.down_until = 0.0
+                return
+            endpoint.errors += 1
+            endpoint.failures += 1
+            if endpoint.failures >= self.max_failures:
+                backoff = min(self.cooldown * 2 ** (endpoint.failures - self.max_failures), self.max_cooldown)
+                endpoint.down_until = time.time() + backoff
+                logger.warning('rpc node {} out of rotation for {:.0f}s after {} failures', endpoint.url, backoff,
+                               endpoint.failures)
+
+    def _send(self, endpoint: Endpoint, data: bytes, timeout: float) -> bytes:
+        with self._lock:
+            endpoint.inflight += 1
+        start = time.perf_counter()
+        try:
+            response = self._session.post(endpoint.url, data=data, timeout=timeout,
+                                          headers={'Content-Type': 'application/json'})
+            if response.status_code == 429 or response.status_code >= 500:
+                raise RpcError(f"{endpoint.url} http {response.status_code}")
+            response.raise_for_status()
+            content = response.content
+        except (requests.RequestException, RpcError) as e:
+            self._record(endpoint, time.perf_counter() - start, False)
+            raise RpcError(f"{endpoint.url}: {e}") from e
+        finally:
+            with self._lock:
+                endpoint.inflight -= 1
+        self._record(endpoint, time.perf_counter() - start, True)
+        return content
+
+    def post(self, data: bytes, timeout: Optional[float] = None, hedge: bool = True) -> bytes:
+        """ send a raw json-rpc request (single or batch) and return the raw response body
+
+        :param hedge: allow a second node to be asked when the first is slow, never for transaction sends
+        """
+        timeout = timeout or self.timeout
+        hedge = hedge and self.hedge_percentile is not None and len(self.endpoints) > 1 \
+            and b'eth_sendRawTransaction' not in data
+        tried: List[Endpoint] = []
+        running: Dict[Future, Endpoint] = {}
+        errors: List[Exception] = []
+
+        def launch() -> Optional[Endpoint]:
+            endpoint = self._pick(tried)
+            if endpoint is not None:
+                tried.append(endpoint)
+                running[self._executor.submit(self._send, endpoint, data, timeout)] = endpoint
+            return endpoint
+
+        first = launch()
+        deadline = first.deadline(self.hedge_percentile) if hedge else None
+        hedge_at = time.perf_counter() + deadline if deadline is not None else None
+        while running:
+            wait_for = max(hedge_at - time.perf_counter(), 0.0) if hedge_at is not None else None
+            done, _ = wait(list(running), timeout=wait_for, return_when=FIRST_COMPLETED)
+            if not done:
+                hedge_at = None
+                if launch() is not None:
+                    RPC_HEDGES.inc()
+                    with self._lock:
+                        self.hedged += 1
+                continue
+            for future in done:
+                running.pop(future)
+                try:
+                    return future.result()
+                except RpcError as e:
+                    errors.append(e)
+            if not running:
+                launch()
+        raise RpcError(f"all rpc nodes failed: {errors}")
+
+    def stats(self) -> List[Dict]:
+        with self._lock:
+            return [e.to_dict() for e in self.endpoints]
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        self._session.close()
+
+
+_routers: Dict[Tuple[str, ...], RpcRouter] = {}
+_routers_lock = threading.Lock()
+
+
+def router(target: Union[Chain, str, Sequence[str], RpcRouter]) -> RpcRouter:
+    """ process-wide router of a chain (every url of its *_CHAIN_URL), of a url or of a url list """
+    if isinstance(target, RpcRouter):
+        return target
+    if isinstance(target, Chain):
+        urls = tuple(target.urls)
+    elif isinstance(target, str):
+        urls = tuple(u.strip() for u in target.split(',') if u.strip())
+    else:
+        urls = tuple(target)
+    with _routers_lock:
+        if urls not in _routers:
+            _routers[urls] = RpcRouter(urls)
+        return _routers[urls]
+
+
+def _post_batch(rpc: RpcRouter, calls: Sequence[Tuple[str, list]], timeout: float) -> List[Any]:
+    payload = [{"jsonrpc": "2.0", "id": next(_ids), "method": method, "params": params}
+               for method, params in calls]
+    if metrics_enabled():
+        RPC_BATCH_SIZE.observe(len(payload))
+        for method, _ in calls:
+            RPC_CALLS.inc(method)
+    data = json.loads(rpc.post(json.dumps(payload).encode(), timeout=timeout))
+    if isinstance(data, dict):
+        # some nodes answer a whole batch with a single error object
+        raise RpcError(data.get('error', data))
+    by_id = {item['id']: item for item in data}
+    results = []
+    for request in payload:
+        item = by_id.get(request['id'])
+        if item is None or 'error' in item:
+            logger.warning('rpc {} {} failed: {}', request['method'], request['params'],
+                           None if item is None else item['error'])
+            results.append(None)
+        else:
+            results.append(item['result'])
+    return results
+
+
+def batch_call(url: Union[Chain, str, RpcRouter], calls: Sequence[Tuple[str, list]], batch_size: int = 100,
+               max_workers: int = 4, timeout: float = 60) -> List[Optional[Any]]:
+    """ send json-rpc requests in batches
+
+    splits calls into json-rpc batch requests of batch_size and posts them concurrently through the router of
+    url, failed requests inside a batch are returned as None
+
+    :param url: chain, node rpc url (comma separated for several nodes) or RpcRouter
+    :param calls: list of (method, params), such as: [("eth_getTransactionReceipt", ["0x..."])]
+    :param batch_size: requests per http post, most providers limit this to 100 ~ 1000
+    :param max_workers: concurrent http posts
+    :param timeout: http timeout in seconds
+    :return: raw json results, in the same order as calls
+    """
+    rpc = router(url)
+    batches = [calls[i:i + batch_size] for i in range(0, len(calls), batch_size)]
+    if len(batches) <= 1 or max_workers <= 1:
+        return [r for batch in batches for r in _post_batch(rpc, batch, timeout)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda batch: _post_batch(rpc, batch, timeout), batches)
+        return [r for batch in results for r in batch]
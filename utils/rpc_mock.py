@@ -0,0 +1,218 @@
+import bisect
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence
+
+from eth_abi import decode, encode
+
+AGGREGATE3_SELECTOR = '0x82ad56cb'
+DECIMALS_SELECTOR = '0x313ce567'
+
+
+class MockRpcServer:
+    """
+    in-process json-rpc node for tests and benchmarks
+
+    serves a synthetic chain of head + 1 blocks, block b has timestamp genesis_time + b * block_time, answers
+    single and batch requests for eth_chainId, eth_blockNumber, eth_getBlockByNumber, eth_call, eth_getLogs and
+    eth_getTransactionReceipt. an aggregate3 eth_call returns 10 ** 18 + block for every inner call, so rates
+    read at different blocks differ, other eth_calls answer call_results by selector. eth_getLogs filters the
+    fixture logs by block range, address and topics, receipts are looked up by transaction hash.
+    latency (+ random jitter) seconds are slept per http request, fail_rate of the requests answer http 503,
+    and down / rate_limited can be switched at any time to test failover
+
+    usage:
+        with MockRpcServer(latency=0.05) as node:
+            rpc = RpcRouter([node.url])
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, fail_rate: float = 0.0, head: int = 20_000_000,
+                 block_time: int = 12, genesis_time: int = 1_438_269_973, chain_id: int = 1,
+                 logs: Sequence[dict] = (), receipts: Optional[Dict[str, dict]] = None,
+                 call_results: Optional[Dict[str, str]] = None, host: str = '127.0.0.1', port: int = 0):
+        """
+        :param logs: raw json-rpc logs served by eth_getLogs
+        :param receipts: transaction hash -> raw json-rpc receipt
+        :param call_results: 4 byte selector (0x...) -> raw eth_call result, default decimals() = 18
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.head = head
+        self.block_time = block_time
+        self.genesis_time = genesis_time
+        self.chain_id = chain_id
+        self.logs = sorted(logs, key=lambda log: (int(log['blockNumber'], 16), int(log['logIndex'], 16)))
+        self._log_blocks = [int(log['blockNumber'], 16) for log in self.logs]
+        self.receipts = {k.lower(): v for k, v in (receipts or {}).items()}
+        self.call_results = {DECIMALS_SELECTOR: '0x' + encode(['uint8'], [18]).hex()}
+        self.call_results.update(call_results or {})
+        self.down = False
+        self.rate_limited = False
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.calls: Dict[str, int] = {}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self) -> 'MockRpcServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'MockRpcServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def timestamp(self, block: int) -> int:
+        return self.genesis_time + block * self.block_time
+
+    def _block(self, tag) -> Optional[int]:
+        if tag in ('latest', 'safe', 'finalized', 'pending'):
+            return self.head
+        if tag == 'earliest':
+            return 0
+        block = int(tag, 16)
+        return block if 0 <= block <= self.head else None
+
+    def _block_object(self, block: int) -> dict:
+        zero = '0x' + '00' * 32
+        return {'number': hex(block), 'timestamp': hex(self.timestamp(block)), 'hash': '0x' + f'{block:064x}',
+                'parentHash': '0x' + f'{max(block - 1, 0):064x}', 'baseFeePerGas': hex(10 ** 9),
+                'gasLimit': hex(30_000_000), 'gasUsed': hex(15_000_000), 'miner': '0x' + '00' * 20,
+                'difficulty': '0x0', 'totalDifficulty': '0x0', 'extraData': '0x', 'logsBloom': '0x' + '00' * 256,
+                'nonce': '0x' + '00' * 8, 'mixHash': zero, 'receiptsRoot': zero, 'sha3Uncles': zero,
+                'stateRoot': zero, 'transactionsRoot': zero, 'size': '0x1', 'transactions': [], 'uncles': []}
+
+    def _eth_call(self, tx: dict, tag) -> str:
+        block = self._block(tag)
+        if block is None:
+            raise ValueError('header not found')
+        data = tx.get('data') or tx.get('input') or '0x'
+        if data.startswith(AGGREGATE3_SELECTOR):
+            (calls,) = decode(['(address,bool,bytes)[]'], bytes.fromhex(data[10:]))
+            results = [(True, encode(['uint256'], [10 ** 18 + block])) for _ in calls]
+            return '0x' + encode(['(bool,bytes)[]'], [results]).hex()
+        return self.call_results.get(data[:10], '0x' + encode(['uint256'], [10 ** 18]).hex())
+
+    def _get_logs(self, query: dict) -> list:
+        first = self._block(query.get('fromBlock', 'latest'))
+        last = self._block(query.get('toBlock', 'latest'))
+        if first is None or last is None:
+            raise ValueError('invalid block range')
+        addresses = query.get('address')
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        addresses = {a.lower() for a in addresses} if addresses else None
+        topics = query.get('topics') or []
+        result = []
+        for log in self.logs[bisect.bisect_left(self._log_blocks, first):
+                             bisect.bisect_right(self._log_blocks, last)]:
+            if addresses is not None and log['address'].lower() not in addresses:
+                continue
+            matched = True
+            for i, wanted in enumerate(topics):
+                if wanted is None:
+                    continue
+                wanted = [wanted] if isinstance(wanted, str) else wanted
+                if i >= len(log['topics']) or log['topics'][i].lower() not in {w.lower() for w in wanted}:
+                    matched = False
+                    break
+            if matched:
+                result.append(log)
+        return result
+
+    def handle(self, request: dict) -> dict:
+        """ :return: json-rpc response of a single request """
+        method, params = request.get('method'), request.get('params') or []
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        answer = {'jsonrpc': '2.0', 'id': request.get('id')}
+        try:
+            if method == 'eth_chainId':
+                answer['result'] = hex(self.chain_id)
+            elif method == 'eth_blockNumber':
+                answer['result'] = hex(self.head)
+            elif method == 'eth_getBlockByNumber':
+                block = self._block(params[0])
+                answer['result'] = None if block is None else self._block_object(block)
+            elif method == 'eth_call':
+                answer['result'] = self._eth_call(params[0], params[1] if len(params) > 1 else 'latest')
+            elif method == 'eth_getLogs':
+                answer['result'] = self._get_logs(params[0])
+            elif method == 'eth_getTransactionReceipt':
+                answer['result'] = self.receipts.get(params[0].lower())
+            else:
+                answer['error'] = {'code': -32601, 'message': f'method {method} not found'}
+        except Exception as e:
+            answer['error'] = {'code': -32000, 'message': str(e)}
+        return answer
+
+    def _status(self) -> int:
+        if self.down:
+            return 503
+        if self.rate_limited:
+            return 429
+        if self.fail_rate and random.random() < self.fail_rate:
+            return 503
+        return 200
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                with server.lock:
+                    server.requests += 1
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                delay = server.latency + (random.random() * server.jitter if server.jitter else 0.0)
+                if delay:
+                    time.sleep(delay)
+                status = server._status()
+                if status != 200:
+                    payload: object = {'error': 'unavailable'}
+                else:
+                    request = json.loads(body)
+                    payload = [server.handle(r) for r in request] if isinstance(request, list) \
+                        else server.handle(request)
+                raw = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    from utils.rpc import RpcRouter, batch_call
+
+    fast, slow, broken = MockRpcServer(latency=0.01), MockRpcServer(latency=0.2), MockRpcServer()
+    broken.down = True
+    with fast, slow, broken:
+        rpc = RpcRouter([fast.url, slow.url, broken.url])
+        start = time.time()
+        for i in range(200):
+            batch_call(rpc, [('eth_getBlockByNumber', [hex(i), False])])
+        print(f'200 requests in {time.time() - start:.2f}s, hedged {rpc.hedged}')
+        for endpoint in rpc.stats():
+            print(endpoint)
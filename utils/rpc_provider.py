@@ -0,0 +1,48 @@
+from typing import Any, Sequence, Union
+
+from web3 import Web3
+from web3.providers.base import JSONBaseProvider
+from web3.types import RPCEndpoint, RPCResponse
+
+from utils.chain import Chain
+from utils.metrics import RPC_CALLS
+from utils.rpc import RpcRouter, router
+
+# kept out of utils.rpc, importing web3 takes longer than everything else batch_call needs
+
+
+class RouterProvider(JSONBaseProvider):
+    """ web3 provider sending every request through an RpcRouter
+
+    the router of a chain or of urls is looked up on the first request, so a Web3 can be built for a chain
+    without a configured url as long as nothing is requested through it
+    """
+
+    def __init__(self, rpc: Union[Chain, str, Sequence[str], RpcRouter]):
+        super().__init__()
+        self._target = rpc
+        self._router = rpc if isinstance(rpc, RpcRouter) else None
+
+    @property
+    def router(self) -> RpcRouter:
+        if self._router is None:
+            self._router = router(self._target)
+        return self._router
+
+    @property
+    def endpoint_uri(self) -> str:
+        return self.router.url
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        RPC_CALLS.inc(method)
+        return self.decode_rpc_response(self.router.post(self.encode_rpc_request(method, params)))
+
+    def __str__(self):
+        if self._router is None:
+            return f"RPC router of {self._target}"
+        return f"RPC router {[e.url for e in self._router.endpoints]}"
+
+
+def web3_for(target: Union[Chain, str, Sequence[str], RpcRouter]) -> Web3:
+    """ Web3 on the router of a chain or of urls, the router is created on the first request """
+    return Web3(RouterProvider(target))
@@ -0,0 +1,216 @@
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from utils.interval import INTERVAL_MS, align, normalize_interval
+from utils.stream.base import CANDLE_COLUMNS, Candle, MarketStream, Tick, candles_to_frame, unified_frame
+
+DEFAULT_ROLLUPS = ('5m', '15m', '1h', '4h', '1d')
+
+
+class CandleAggregator:
+    """
+    incremental candle builder with multi-interval rollups
+
+    ticks (or closed base candles) update the forming base candle of their symbol, every closed base candle is
+    merged into the forming candle of each rollup interval, so each event costs O(number of intervals)
+    regardless of history length. a rollup candle closes as soon as its last base candle closes, or when a
+    later base candle shows up after a gap. closed candles are kept in a bounded history per (symbol, interval)
+    and pushed to subscribers
+    """
+
+    def __init__(self, intervals: Sequence[str] = DEFAULT_ROLLUPS, base: str = '1m', history: int = 1000):
+        """
+        :param intervals: rollup intervals, each a multiple of base, any spelling of utils.interval
+        :param base: interval of the candles built from ticks
+        :param history: closed candles kept per (symbol, interval)
+        """
+        self.base = normalize_interval(base)
+        base_ms = INTERVAL_MS[self.base]
+        self.intervals = sorted({normalize_interval(i) for i in intervals} - {self.base}, key=INTERVAL_MS.get)
+        for interval in self.intervals:
+            if INTERVAL_MS[interval] % base_ms:
+                raise ValueError(f"{interval} is not a multiple of {self.base}")
+        self.history = history
+        self._forming: Dict[Tuple[str, str], Candle] = {}
+        self._closed: Dict[Tuple[str, str], Deque[Candle]] = {}
+        self._listeners: List[Callable[[Candle], None]] = []
+        self.late = 0
+
+    def subscribe(self, listener: Callable[[Candle], None]) -> None:
+        """ listener(candle) is called for every closed candle of every interval """
+        self._listeners.append(listener)
+
+    # input
+
+    def on_tick(self, tick: Tick) -> List[Candle]:
+        """ :return: candles closed by this tick """
+        key = (tick.symbol, self.base)
+        open_time = align(tick.ts, self.base)
+        current = self._forming.get(key)
+        if current is not None and open_time == current.open_time:
+            if tick.price > current.high:
+                current.high = tick.price
+            elif tick.price < current.low:
+                current.low = tick.price
+            current.close = tick.price
+            current.volume += tick.size
+            return []
+        if current is not None and open_time < current.open_time:
+            # late trade of a base candle that is already closed
+            self.late += 1
+            return []
+        closed = self._close_base(current) if current is not None else []
+        self._forming[key] = Candle(tick.symbol, self.base, open_time, tick.price, tick.price, tick.price,
+                                    tick.price, tick.size, False, tick.source)
+        return closed
+
+    def on_candle(self, candle: Candle) -> List[Candle]:
+        """ feed a base interval candle, forming candles replace the forming base candle
+
+        :return: candles closed by this candle
+        """
+        if candle.interval != self.base:
+            raise ValueError(f"expected {self.base} candles, got {candle.interval}")
+        key = (candle.symbol, self.base)
+        current = self._forming.get(key)
+        if current is not None and candle.open_time < current.open_time:
+            self.late += 1
+            return []
+        closed = []
+        if current is not None and candle.open_time > current.open_time:
+            closed = self._close_base(current)
+        if candle.closed:
+            self._forming.pop(key, None)
+            closed.extend(self._close_base(Candle(candle.symbol, self.base, candle.open_time, candle.open,
+                                                  candle.high, candle.low, candle.close, candle.volume, False,
+                                                  candle.source)))
+        else:
+            self._forming[key] = candle
+        return closed
+
+    def on_event(self, event) -> List[Candle]:
+        """ feed a Tick or a base interval Candle """
+        return self.on_candle(event) if isinstance(event, Candle) else self.on_tick(event)
+
+    def advance(self, ts: int) -> List[Candle]:
+        """ close every forming base candle that ended before ts (unix ms), for quiet symbols on a timer """
+        closed = []
+        step = INTERVAL_MS[self.base]
+        for key, candle in list(self._forming.items()):
+            if key[1] == self.base and candle.open_time + step <= ts:
+                del self._forming[key]
+                closed.extend(self._close_base(candle))
+        return closed
+
+    def load(self, candles: Iterable[Candle]) -> int:
+        """ feed closed base candles in open time order, :return: number of closed candles of all intervals """
+        return sum(len(self.on_candle(c)) for c in candles)
+
+    # rollup
+
+    def _store(self, candle: Candle, closed: List[Candle]) -> None:
+        candle.closed = True
+        key = (candle.symbol, candle.interval)
+        history = self._closed.get(key)
+        if history is None:
+            history = self._closed[key] = deque(maxlen=self.history)
+        history.append(candle)
+        closed.append(candle)
+        for listener in self._listeners:
+            listener(candle)
+
+    def _close_base(self, base: Candle) -> List[Candle]:
+        if base is self._forming.get((base.symbol, self.base)):
+            del self._forming[(base.symbol, self.base)]
+        closed: List[Candle] = []
+        self._store(base, closed)
+        base_end = base.open_time + INTERVAL_MS[self.base]
+        for interval in self.intervals:
+            key = (base.symbol, interval)
+            open_time = align(base.open_time, interval)
+            current = self._forming.get(key)
+            if current is not None and current.open_time != open_time:
+                # the rest of the previous candle is missing, close it with what it has
+                del self._forming[key]
+                self._store(current, closed)
+                current = None
+            if current is None:
+                current = Candle(base.symbol, interval, open_time, base.open, base.high, base.low, base.close,
+                                 base.volume, False, base.source)
+                self._forming[key] = current
+            else:
+                if base.high > current.high:
+                    current.high = base.high
+                if base.low < current.low:
+                    current.low = base.low
+                current.close = base.close
+                current.volume += base.volume
+            if open_time + INTERVAL_MS[interval] == base_end:
+                del self._forming[key]
+                self._store(current, closed)
+        return closed
+
+    # output
+
+    def candles(self, symbol: str, interval: str, include_forming: bool = False) -> List[Candle]:
+        interval = normalize_interval(interval)
+        result = list(self._closed.get((symbol, interval), ()))
+        if include_forming and (symbol, interval) in self._forming:
+            result.append(self._forming[(symbol, interval)])
+        return result
+
+    def forming(self, symbol: str, interval: str) -> Optional[Candle]:
+        return self._forming.get((symbol, normalize_interval(interval)))
+
+    def frame(self, symbol: str, interval: str, include_forming: bool = False) -> pd.DataFrame:
+        """ candles of symbol in the unified candle format """
+        return candles_to_frame(self.candles(symbol, interval, include_forming))
+
+    def frames(self, symbol: str, include_forming: bool = False) -> Dict[str, pd.DataFrame]:
+        """ base and rollup interval -> unified candle dataframe of symbol """
+        return {i: self.frame(symbol, i, include_forming) for i in [self.base] + self.intervals}
+
+
+def rollup_frame(df: pd.DataFrame, interval: str) -> pd.DataFrame:
+    """ vectorised rollup of a unified candle dataframe to a longer interval, for bulk history
+
+    incomplete trailing candles are kept, use CandleAggregator for live data
+    """
+    interval = normalize_interval(interval)
+    df = unified_frame(df)
+    if len(df) == 0:
+        return df
+    open_ms = df['timestamp'].to_numpy(dtype='datetime64[ms]').astype(np.int64)
+    ms = INTERVAL_MS[interval]
+    offset = align(0, interval) % ms
+    buckets = (open_ms - offset) // ms * ms + offset
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(buckets[starts], unit='ms'),
+        'open': df['open'].to_numpy()[starts],
+        'high': np.maximum.reduceat(df['high'].to_numpy(), starts),
+        'low': np.minimum.reduceat(df['low'].to_numpy(), starts),
+        'close': df['close'].to_numpy()[np.r_[starts[1:] - 1, len(df) - 1]],
+        'volume': np.add.reduceat(df['volume'].to_numpy(), starts),
+    }, columns=CANDLE_COLUMNS)
+
+
+def rollup_frames(df: pd.DataFrame, intervals: Sequence[str]) -> Dict[str, pd.DataFrame]:
+    """ :return: interval -> rollup of df, see rollup_frame """
+    return {normalize_interval(i): rollup_frame(df, i) for i in intervals}
+
+
+async def rollup(stream: MarketStream, aggregator: CandleAggregator) -> AsyncIterator[Candle]:
+    """ feed every event of stream into aggregator and yield the closed candles of all intervals """
+    async for event in stream:
+        try:
+            closed = aggregator.on_event(event)
+        except ValueError as e:
+            logger.warning('skip event {}: {}', event, e)
+            continue
+        for candle in closed:
+            yield candle
@@ -0,0 +1,198 @@
+import asyncio
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from utils.interval import INTERVAL_MS
+
+
+class Tick:
+    """ last trade / ticker update of a symbol, ts in unix milliseconds """
+    __slots__ = ["symbol", "price", "size", "ts", "source"]
+
+    def __init__(self, symbol: str, price: float, size: float, ts: int, source: str = ''):
+        self.symbol = symbol
+        self.price = price
+        self.size = size
+        self.ts = ts
+        self.source = source
+
+    def to_dict(self) -> Dict:
+        return {"type": "tick", "symbol": self.symbol, "price": self.price, "size": self.size, "ts": self.ts,
+                "source": self.source}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Tick':
+        return cls(data["symbol"], float(data["price"]), float(data["size"]), int(data["ts"]), data.get("source", ''))
+
+    def __repr__(self):
+        return f"Tick({self.source}:{self.symbol} {self.price} x {self.size} @ {self.ts})"
+
+
+class Candle:
+    """ candle of a symbol, open_time in unix milliseconds, closed is False while the candle is still forming """
+    __slots__ = ["symbol", "interval", "open_time", "open", "high", "low", "close", "volume", "closed", "source"]
+
+    def __init__(self, symbol: str, interval: str, open_time: int, open: float, high: float, low: float,
+                 close: float, volume: float, closed: bool = True, source: str = ''):
+        self.symbol = symbol
+        self.interval = interval
+        self.open_time = open_time
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.closed = closed
+        self.source = source
+
+    @property
+    def ts(self) -> int:
+        return self.open_time
+
+    def to_dict(self) -> Dict:
+        return {"type": "candle", "symbol": self.symbol, "interval": self.interval, "open_time": self.open_time,
+                "open": self.open, "high": self.high, "low": self.low, "close": self.close, "volume": self.volume,
+                "closed": self.closed, "source": self.source}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Candle':
+        return cls(data["symbol"], data["interval"], int(data["open_time"]), float(data["open"]),
+                   float(data["high"]), float(data["low"]), float(data["close"]), float(data["volume"]),
+                   bool(data.get("closed", True)), data.get("source", ''))
+
+    def __repr__(self):
+        state = '' if self.closed else ' open'
+        return (f"Candle({self.source}:{self.symbol} {self.interval} {self.open_time} "
+                f"o={self.open} h={self.high} l={self.low} c={self.close} v={self.volume}{state})")
+
+
+Event = Union[Tick, Candle]
+
+
+def event_from_dict(data: Dict) -> Event:
+    return Candle.from_dict(data) if data.get("type") == "candle" else Tick.from_dict(data)
+
+
+# unified candle format, timestamp is the utc open time
+CANDLE_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+
+def unified_frame(df: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """ utils.cex get_spot_candlesticks dataframe of any exchange in the unified candle format,
+    float prices and volume (base_volume on gate, 0 when the exchange returns none), sorted by timestamp """
+    if df is None or len(df) == 0:
+        return pd.DataFrame({c: pd.Series(dtype='datetime64[ns]' if c == 'timestamp' else float)
+                             for c in CANDLE_COLUMNS})
+    volume = next((c for c in ('volume', 'base_volume') if c in df.columns), None)
+    result = pd.DataFrame({
+        'timestamp': pd.to_datetime(df['timestamp']),
+        'open': df['open'].astype(float), 'high': df['high'].astype(float),
+        'low': df['low'].astype(float), 'close': df['close'].astype(float),
+        'volume': df[volume].astype(float) if volume else 0.0,
+    })
+    return result.drop_duplicates('timestamp', keep='last').sort_values('timestamp').reset_index(drop=True)
+
+
+def candles_to_frame(candles: Iterable[Candle]) -> pd.DataFrame:
+    """ candles in the unified candle format """
+    candles = list(candles)
+    return unified_frame(pd.DataFrame({
+        'timestamp': pd.to_datetime([c.open_time for c in candles], unit='ms'),
+        'open': [c.open for c in candles], 'high': [c.high for c in candles], 'low': [c.low for c in candles],
+        'close': [c.close for c in candles], 'volume': [c.volume for c in candles],
+    }))
+
+
+def candles_from_frame(df: Optional[pd.DataFrame], symbol: str, interval: str, source: str = '') -> List[Candle]:
+    """ candles from a utils.cex get_spot_candlesticks dataframe, sorted by open time """
+    if df is None or len(df) == 0:
+        return []
+    volume = next((c for c in ('volume', 'base_volume') if c in df.columns), None)
+    open_times = pd.to_datetime(df['timestamp']).astype('int64') // 1_000_000
+    candles = [Candle(symbol, interval, int(t), float(o), float(h), float(lo), float(c),
+                      float(v) if volume else 0.0, True, source)
+               for t, o, h, lo, c, v in zip(open_times, df['open'], df['high'], df['low'], df['close'],
+                                            df[volume] if volume else open_times)]
+    return sorted(candles, key=lambda x: x.open_time)
+
+
+class MarketStream(ABC):
+    """
+    async iterator of market data events (Tick / Candle)
+
+    every source (exchange websockets, file replay, local test feed) has the same interface:
+
+        async with BinanceStream(['BTC'], intervals=['1m']) as stream:
+            async for event in stream:
+                ...
+    """
+
+    async def __aenter__(self) -> 'MarketStream':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    def __aiter__(self) -> AsyncIterator[Event]:
+        return self.events()
+
+    @abstractmethod
+    def events(self) -> AsyncIterator[Event]:
+        """ iterate over events until the stream is closed or exhausted """
+
+    async def close(self) -> None:
+        pass
+
+
+class LocalStream(MarketStream):
+    """ in-process stream fed with put(), for tests and for bridging sync producers """
+    _END = object()
+
+    def __init__(self, events: Iterable[Event] = (), maxsize: int = 0):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize)
+        for event in events:
+            self._queue.put_nowait(event)
+
+    async def put(self, event: Event) -> None:
+        await self._queue.put(event)
+
+    def put_nowait(self, event: Event) -> None:
+        self._queue.put_nowait(event)
+
+    async def close(self) -> None:
+        self._queue.put_nowait(self._END)
+
+    async def events(self) -> AsyncIterator[Event]:
+        while True:
+            event = await self._queue.get()
+            if event is self._END:
+                return
+            yield event
+
+
+class CandleTracker:
+    """
+    last closed candle per (symbol, interval), drops duplicates and reports missing candles
+
+    used by the websocket streams to backfill gaps after reconnects or skipped messages
+    """
+
+    def __init__(self):
+        self.last: Dict[Tuple[str, str], int] = {}
+
+    def check(self, candle: Candle) -> Tuple[bool, Optional[int]]:
+        """ :return: (emit, first missing open_time or None) """
+        if not candle.closed:
+            last = self.last.get((candle.symbol, candle.interval))
+            return last is None or candle.open_time > last, None
+        key = (candle.symbol, candle.interval)
+        last = self.last.get(key)
+        if last is not None and candle.open_time <= last:
+            return False, None
+        self.last[key] = candle.open_time
+        step = INTERVAL_MS.get(candle.interval)
+        if last is not None and step and candle.open_time > last + step:
+            return True, last + step
+        return True, None
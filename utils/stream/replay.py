@@ -0,0 +1,69 @@
+import asyncio
+import json
+from typing import AsyncIterator, Optional
+
+from loguru import logger
+
+from utils.stream.base import Event, MarketStream, event_from_dict
+
+
+class ReplayStream(MarketStream):
+    """
+    plays back a stream recorded with record() (one json event per line)
+
+    events are delayed by their recorded time difference divided by speed, speed=0 replays as fast as possible
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, loop: bool = False):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+
+    async def events(self) -> AsyncIterator[Event]:
+        while True:
+            last_ts: Optional[int] = None
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    event = event_from_dict(json.loads(line))
+                    if self.speed > 0 and last_ts is not None and event.ts > last_ts:
+                        await asyncio.sleep((event.ts - last_ts) / 1000 / self.speed)
+                    if last_ts is None or event.ts > last_ts:
+                        last_ts = event.ts
+                    yield event
+            if not self.loop:
+                return
+
+
+async def record(stream: MarketStream, path: str, limit: Optional[int] = None) -> int:
+    """ append events of stream to path until it ends or limit events are written
+
+    :return: number of events written
+    """
+    count = 0
+    try:
+        with open(path, 'a', encoding='utf-8') as f:
+            async for event in stream:
+                f.write(json.dumps(event.to_dict()) + '\n')
+                count += 1
+                if limit is not None and count >= limit:
+                    break
+    finally:
+        await stream.close()
+    logger.info('recorded {} events to {}', count, path)
+    return count
+
+
+if __name__ == "__main__":
+    import sys
+
+    from utils.stream.websocket import market_stream
+
+    async def main():
+        if len(sys.argv) > 1 and sys.argv[1] == 'record':
+            await record(market_stream('binance', ['BTC'], intervals=['1m']), 'btc_stream.jsonl', limit=1000)
+        async for event in ReplayStream('btc_stream.jsonl', speed=10):
+            print(event)
+
+    asyncio.run(main())
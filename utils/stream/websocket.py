@@ -0,0 +1,397 @@
+import asyncio
+import json
+import time
+from abc import abstractmethod
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import websockets
+from loguru import logger
+
+from utils.http_session import exchange_session
+from utils.interval import INTERVAL_MS, exchange_interval, normalize_interval
+from utils.stream.base import Candle, CandleTracker, Event, MarketStream, Tick, candles_from_frame
+
+
+def _utc(ms: int) -> datetime:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+def _ms(value) -> int:
+    """ unix seconds / milliseconds / microseconds or iso string to milliseconds """
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            return int((dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp() * 1000)
+    value = int(value)
+    if value < 10 ** 11:
+        return value * 1000
+    if value > 10 ** 14:
+        return value // 1000
+    return value
+
+
+class WebsocketStream(MarketStream):
+    """
+    exchange websocket stream of ticks and candles for token symbols quoted in usdt (usdc on backpack)
+
+    every connection reconnects with exponential backoff, after a reconnect, or when a closed candle arrives
+    later than the next expected one, the missing candles are fetched from the exchange rest api and emitted
+    before live data continues, so candle consumers see every interval exactly once and in order. a backfill
+    that fails is retried on the next closed candle or reconnect, its candles then arrive after newer ones
+    """
+    name = ''
+    # (seconds, text) sent periodically on exchanges that close idle connections
+    keepalive: Optional[Tuple[float, str]] = None
+
+    def __init__(self, symbols: Sequence[str], intervals: Sequence[str] = (), ticks: bool = True,
+                 backfill: bool = True, reconnect_delay: float = 1.0, max_reconnect_delay: float = 60.0,
+                 queue_size: int = 100000):
+        """
+        :param symbols: token names, such as ["BTC", "ETH"]
+        :param intervals: candle intervals to subscribe, such as ["1m", "1h"]
+        :param ticks: subscribe trades
+        :param backfill: fetch missing candles from rest after reconnects and gaps
+        """
+        self.symbols = [s.upper() for s in symbols]
+        self.intervals = [normalize_interval(i) for i in intervals]
+        if self.name:
+            for interval in self.intervals:
+                exchange_interval(self.name, interval)
+        self.ticks = ticks
+        self.backfill = backfill
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.reconnects = 0
+        self._tracker = CandleTracker()
+        # (symbol, interval) -> [(start, end)] of backfills that failed, retried on the next closed candle
+        self._gaps: Dict[Tuple[str, str], List[Tuple[int, int]]] = {}
+        self._queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self._tasks: List[asyncio.Task] = []
+
+    # exchange specific
+
+    @abstractmethod
+    def connections(self) -> List[Tuple[str, List]]:
+        """ :return: (url, subscribe messages) per websocket connection """
+
+    @abstractmethod
+    def parse(self, message) -> List[Event]:
+        """ events of one websocket message, [] for acks, pongs and unknown messages """
+
+    def fetch_candles(self, symbol: str, interval: str, start: int, end: int) -> List[Candle]:
+        """ closed candles with start <= open_time < end from the rest api, called from a worker thread """
+        return []
+
+    # stream
+
+    async def events(self) -> AsyncIterator[Event]:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run(url, subscribe)) for url, subscribe in self.connections()]
+        try:
+            while True:
+                yield await self._queue.get()
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _emit(self, event: Event) -> None:
+        if isinstance(event, Candle):
+            emit, missing = self._tracker.check(event)
+            if not emit:
+                return
+            if self.backfill and event.closed:
+                key = (event.symbol, event.interval)
+                if missing is not None:
+                    self._gaps.setdefault(key, []).append((missing, event.open_time))
+                if key in self._gaps:
+                    await self._fill_gaps(key)
+        await self._queue.put(event)
+
+    async def _fill_gaps(self, key: Tuple[str, str]) -> None:
+        """ backfill the recorded gaps of key, a gap whose fetch fails again stays recorded.
+        a retried gap arrives after the newer candles already emitted """
+        failed = []
+        for start, end in self._gaps.pop(key, []):
+            ok, _ = await self._backfill(key[0], key[1], start, end)
+            if not ok:
+                failed.append((start, end))
+        if failed:
+            self._gaps[key] = failed
+
+    async def _backfill(self, symbol: str, interval: str, start: int, end: int) -> Tuple[bool, Optional[int]]:
+        """ queue the closed candles with start <= open_time < end
+
+        :return: (False, None) when the fetch failed, else (True, open_time of the last candle queued or None)
+        """
+        try:
+            candles = await asyncio.get_running_loop().run_in_executor(
+                None, self.fetch_candles, symbol, interval, start, end)
+        except Exception as e:
+            logger.error('{} backfill {} {} from {} failed: {}', self.name, symbol, interval, _utc(start), e)
+            return False, None
+        candles = sorted((c for c in candles if start <= c.open_time < end), key=lambda c: c.open_time)
+        logger.info('{} backfilled {} {} {} candles from {}', self.name, len(candles), symbol, interval, _utc(start))
+        for candle in candles:
+            await self._queue.put(candle)
+        return True, candles[-1].open_time if candles else None
+
+    async def _backfill_after_reconnect(self) -> None:
+        for key in list(self._gaps):
+            await self._fill_gaps(key)
+        now = int(time.time() * 1000)
+        for (symbol, interval), last in list(self._tracker.last.items()):
+            step = INTERVAL_MS[interval]
+            # the candle that is still forming comes from the live stream
+            end = now // step * step
+            if last + step < end:
+                _, delivered = await self._backfill(symbol, interval, last + step, end)
+                # only what was queued counts as seen, the next live closed candle backfills the rest of the gap
+                if delivered is not None and delivered > self._tracker.last.get((symbol, interval), last):
+                    self._tracker.last[(symbol, interval)] = delivered
+
+    async def _keepalive(self, ws) -> None:
+        seconds, text = self.keepalive
+        while True:
+            await asyncio.sleep(seconds)
+            await ws.send(text)
+
+    async def _run(self, url: str, subscribe: List) -> None:
+        delay = self.reconnect_delay
+        connected_before = False
+        while True:
+            pinger = None
+            try:
+                async with websockets.connect(url, ping_interval=20, max_size=2 ** 22) as ws:
+                    for message in subscribe:
+                        await ws.send(message if isinstance(message, str) else json.dumps(message))
+                    logger.info('{} connected {}', self.name, url)
+                    if connected_before and self.backfill:
+                        await self._backfill_after_reconnect()
+                    connected_before = True
+                    if self.keepalive:
+                        pinger = asyncio.create_task(self._keepalive(ws))
+                    async for message in ws:
+                        delay = self.reconnect_delay
+                        try:
+                            events = self.parse(message)
+                        except Exception as e:
+                            logger.warning('{} failed to parse message {}: {}', self.name, str(message)[:200], e)
+                            continue
+                        for event in events:
+                            await self._emit(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('{} connection {} lost: {}, reconnecting in {:.1f}s', self.name, url, e, delay)
+            finally:
+                if pinger is not None:
+                    pinger.cancel()
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+
+class BinanceStream(WebsocketStream):
+    """ binance spot combined streams: <symbol>@trade and <symbol>@kline_<interval> """
+    name = 'binance'
+    url = 'wss://stream.binance.com:9443/stream'
+
+    def __init__(self, symbols: Sequence[str], intervals: Sequence[str] = (), url: Optional[str] = None, **kwargs):
+        super().__init__(symbols, intervals, **kwargs)
+        if url is not None:
+            self.url = url
+        self._symbols = {f'{s}USDT': s for s in self.symbols}
+
+    def connections(self) -> List[Tuple[str, List]]:
+        streams = []
+        for pair in self._symbols:
+            if self.ticks:
+                streams.append(f'{pair.lower()}@trade')
+            streams.extend(f'{pair.lower()}@kline_{interval}' for interval in self.intervals)
+        return [(self.url, [{'method': 'SUBSCRIBE', 'params': streams, 'id': 1}])]
+
+    def parse(self, message) -> List[Event]:
+        data = json.loads(message)
+        data = data.get('data', data)
+        kind = data.get('e')
+        if kind == 'trade':
+            return [Tick(self._symbols[data['s']], float(data['p']), float(data['q']), int(data['T']), self.name)]
+        if kind == 'kline':
+            k = data['k']
+            return [Candle(self._symbols[data['s']], k['i'], int(k['t']), float(k['o']), float(k['h']),
+                           float(k['l']), float(k['c']), float(k['v']), bool(k['x']), self.name)]
+        return []
+
+    def fetch_candles(self, symbol: str, interval: str, start: int, end: int) -> List[Candle]:
+        from utils.cex import binance
+        df = binance.get_spot_candlesticks(symbol, interval=interval, start_time=_utc(start),
+                                           end_time=_utc(end - 1), limit=1000)
+        return candles_from_frame(df, symbol, interval, self.name)
+
+
+class OkxStream(WebsocketStream):
+    """ okx v5 public tickers channel and business candle<interval> channel """
+    name = 'okx'
+    public_url = 'wss://ws.okx.com:8443/ws/v5/public'
+    business_url = 'wss://ws.okx.com:8443/ws/v5/business'
+    keepalive = (25.0, 'ping')
+
+    def __init__(self, symbols: Sequence[str], intervals: Sequence[str] = (), public_url: Optional[str] = None,
+                 business_url: Optional[str] = None, **kwargs):
+        super().__init__(symbols, intervals, **kwargs)
+        self.public_url = public_url or self.public_url
+        self.business_url = business_url or self.business_url
+        self._symbols = {f'{s}-USDT': s for s in self.symbols}
+        self._intervals = {f"candle{exchange_interval('okx', i)}": i for i in self.intervals}
+
+    def connections(self) -> List[Tuple[str, List]]:
+        result = []
+        if self.ticks:
+            args = [{'channel': 'tickers', 'instId': inst} for inst in self._symbols]
+            result.append((self.public_url, [{'op': 'subscribe', 'args': args}]))
+        if self.intervals:
+            args = [{'channel': f"candle{exchange_interval('okx', i)}", 'instId': inst} for inst in self._symbols
+                    for i in self.intervals]
+            result.append((self.business_url, [{'op': 'subscribe', 'args': args}]))
+        return result
+
+    def parse(self, message) -> List[Event]:
+        if message == 'pong':
+            return []
+        data = json.loads(message)
+        arg = data.get('arg', {})
+        if 'data' not in data or 'event' in data:
+            return []
+        symbol = self._symbols[arg['instId']]
+        channel = arg['channel']
+        if channel == 'tickers':
+            return [Tick(symbol, float(d['last']), float(d['lastSz']), int(d['ts']), self.name) for d in data['data']]
+        interval = self._intervals.get(channel)
+        if interval is None:
+            return []
+        return [Candle(symbol, interval, int(d[0]), float(d[1]), float(d[2]), float(d[3]), float(d[4]),
+                       float(d[5]), d[8] == '1', self.name) for d in data['data']]
+
+    def fetch_candles(self, symbol: str, interval: str, start: int, end: int) -> List[Candle]:
+        from utils.cex import okx
+        candles = []
+        # okx pages 100 candles per request
+        step = INTERVAL_MS[interval] * 100
+        for page in range(start, end, step):
+            df = okx.get_spot_candlesticks(symbol, interval=interval, start_time=_utc(page - 1),
+                                           end_time=_utc(min(page + step, end)), limit=100)
+            candles.extend(candles_from_frame(df, symbol, interval, self.name))
+        return sorted({c.open_time: c for c in candles}.values(), key=lambda c: c.open_time)
+
+
+class GateStream(WebsocketStream):
+    """ gate v4 spot.trades and spot.candlesticks channels """
+    name = 'gate'
+    url = 'wss://api.gateio.ws/ws/v4/'
+
+    def __init__(self, symbols: Sequence[str], intervals: Sequence[str] = (), url: Optional[str] = None, **kwargs):
+        super().__init__(symbols, intervals, **kwargs)
+        if url is not None:
+            self.url = url
+        self._symbols = {f'{s}_USDT': s for s in self.symbols}
+        self._intervals = {exchange_interval('gate', i): i for i in self.intervals}
+
+    def connections(self) -> List[Tuple[str, List]]:
+        now = int(time.time())
+        messages = []
+        if self.ticks:
+            messages.append({'time': now, 'channel': 'spot.trades', 'event': 'subscribe',
+                             'payload': list(self._symbols)})
+        for pair in self._symbols:
+            for interval in self.intervals:
+                messages.append({'time': now, 'channel': 'spot.candlesticks', 'event': 'subscribe',
+                                 'payload': [exchange_interval('gate', interval), pair]})
+        return [(self.url, messages)]
+
+    def parse(self, message) -> List[Event]:
+        data = json.loads(message)
+        if data.get('event') != 'update':
+            return []
+        result = data['result']
+        if data['channel'] == 'spot.trades':
+            return [Tick(self._symbols[result['currency_pair']], float(result['price']), float(result['amount']),
+                         _ms(result.get('create_time_ms', result.get('create_time'))), self.name)]
+        if data['channel'] == 'spot.candlesticks':
+            bar, pair = result['n'].split('_', 1)
+            return [Candle(self._symbols[pair], self._intervals[bar], _ms(result['t']), float(result['o']),
+                           float(result['h']), float(result['l']), float(result['c']), float(result['a']),
+                           bool(result.get('w', False)), self.name)]
+        return []
+
+    def fetch_candles(self, symbol: str, interval: str, start: int, end: int) -> List[Candle]:
+        from utils.cex import gate
+        df = gate.get_spot_candlesticks(symbol, interval=interval, start_time=_utc(start),
+                                        end_time=_utc(end - 1))
+        return candles_from_frame(df, symbol, interval, self.name)
+
+
+class BackpackStream(WebsocketStream):
+    """ backpack trade.<symbol> and kline.<interval>.<symbol> streams, symbols are quoted in usdc """
+    name = 'backpack'
+    url = 'wss://ws.backpack.exchange'
+    rest_url = 'https://api.backpack.exchange/api/v1/klines'
+
+    def __init__(self, symbols: Sequence[str], intervals: Sequence[str] = (), url: Optional[str] = None, **kwargs):
+        super().__init__(symbols, intervals, **kwargs)
+        if url is not None:
+            self.url = url
+        self._symbols = {f'{s}_USDC': s for s in self.symbols}
+
+    def connections(self) -> List[Tuple[str, List]]:
+        params = []
+        for pair in self._symbols:
+            if self.ticks:
+                params.append(f'trade.{pair}')
+            params.extend(f'kline.{interval}.{pair}' for interval in self.intervals)
+        return [(self.url, [{'method': 'SUBSCRIBE', 'params': params}])]
+
+    def parse(self, message) -> List[Event]:
+        message = json.loads(message)
+        data = message.get('data', {})
+        kind = data.get('e')
+        if kind == 'trade':
+            return [Tick(self._symbols[data['s']], float(data['p']), float(data['q']), _ms(data['T']), self.name)]
+        if kind == 'kline':
+            # kline payloads carry no interval, it is part of the stream name kline.<interval>.<symbol>
+            interval = message['stream'].split('.')[1]
+            return [Candle(self._symbols[data['s']], interval, _ms(data['t']), float(data['o']), float(data['h']),
+                           float(data['l']), float(data['c']), float(data['v']), bool(data.get('X')), self.name)]
+        return []
+
+    def fetch_candles(self, symbol: str, interval: str, start: int, end: int) -> List[Candle]:
+        params = {'symbol': f'{symbol}_USDC', 'interval': interval, 'startTime': start // 1000,
+                  'endTime': end // 1000}
+        rows = exchange_session('backpack').get(self.rest_url, params=params).json()
+        return sorted((Candle(symbol, interval, _ms(r['start']), float(r['open']), float(r['high']),
+                              float(r['low']), float(r['close']), float(r.get('volume') or 0), True, self.name)
+                       for r in rows), key=lambda c: c.open_time)
+
+
+STREAMS = {cls.name: cls for cls in (BinanceStream, OkxStream, GateStream, BackpackStream)}
+
+
+def market_stream(exchange: str, symbols: Iterable[str], intervals: Sequence[str] = (), **kwargs) -> WebsocketStream:
+    """ websocket stream of an exchange by name, see STREAMS """
+    return STREAMS[exchange](list(symbols), intervals, **kwargs)
+
+
+if __name__ == "__main__":
+    async def main():
+        async with market_stream('binance', ['BTC', 'ETH'], intervals=['1m']) as stream:
+            async for event in stream:
+                print(event)
+
+    asyncio.run(main())
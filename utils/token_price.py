@@ -5,9 +5,16 @@ import importlib
 from enum import Enum
 from loguru import logger
 from functools import wraps
-from typing import Optional
+from typing import TYPE_CHECKING, Dict, Optional
 from datetime import datetime
 
+from utils.http_session import exchange_session
+from utils.interval import INTERVAL_MS, normalize_interval
+
+# pandas and the candle helpers are only loaded by the candle functions, a price lookup does not need them
+if TYPE_CHECKING:
+    import pandas as pd
+
 
 class PriceSource(Enum):
     BINANCE = "binance"
@@ -63,10 +70,38 @@ def get_token_spot_candlesticks(
         return df
 
 
+def get_token_candles(
+        token_name: str,
+        intervals=('1h', '4h', '1d'),
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        limit: Optional[int] = None,
+) -> Dict[str, 'pd.DataFrame']:
+    """
+    candles of several intervals from one request, the shortest interval is fetched and the others are
+    rolled up from it in memory
+
+    @param intervals: any spelling of utils.interval, such as ['1h', '4H', '1Dutc']
+    @param limit: candles of the shortest interval, longer intervals get proportionally fewer
+    @return: canonical interval -> dataframe in the unified candle format
+             (timestamp, open, high, low, close, volume)
+    """
+    from utils.stream.aggregator import rollup_frame
+    from utils.stream.base import unified_frame
+
+    intervals = sorted({normalize_interval(i) for i in intervals}, key=INTERVAL_MS.get)
+    base = intervals[0]
+    if any(INTERVAL_MS[i] % INTERVAL_MS[base] for i in intervals):
+        base = '1m'
+    base_df = unified_frame(get_token_spot_candlesticks(
+        token_name, interval=base, start_time=start_time, end_time=end_time, limit=limit))
+    return {i: base_df if i == base else rollup_frame(base_df, i) for i in intervals}
+
+
 def get_onchain_price(token):
     url = f'https://api.dexscreener.com/latest/dex/tokens/{token}'
     try:
-        res = requests.get(url)
+        res = exchange_session('dexscreener').get(url)
         token_pairs = res.json()['pairs']
         max_liquidity = 0
         for pair in token_pairs: